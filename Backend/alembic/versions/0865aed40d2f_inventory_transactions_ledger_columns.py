@@ -0,0 +1,40 @@
+"""Add warehouse, balance and reference to inventory_transactions
+
+Revision ID: 0865aed40d2f
+Revises: 21f465b9c0eb
+Create Date: 2026-10-19 12:40:11.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0865aed40d2f'
+down_revision: Union[str, Sequence[str], None] = '21f465b9c0eb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('inventory_transactions', sa.Column('warehouse_id', sa.UUID(), nullable=True))
+    op.add_column('inventory_transactions', sa.Column('balance_after', sa.DECIMAL(precision=12, scale=2), nullable=True))
+    op.add_column('inventory_transactions', sa.Column('reference', sa.String(length=100), nullable=True))
+    op.create_foreign_key(
+        'inventory_transactions_warehouse_id_fkey', 'inventory_transactions', 'warehouses', ['warehouse_id'], ['id']
+    )
+    op.create_index(
+        'ix_inventory_transactions_product_id_created_at', 'inventory_transactions', ['product_id', 'created_at'], unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_inventory_transactions_product_id_created_at', table_name='inventory_transactions')
+    op.drop_constraint('inventory_transactions_warehouse_id_fkey', 'inventory_transactions', type_='foreignkey')
+    op.drop_column('inventory_transactions', 'reference')
+    op.drop_column('inventory_transactions', 'balance_after')
+    op.drop_column('inventory_transactions', 'warehouse_id')
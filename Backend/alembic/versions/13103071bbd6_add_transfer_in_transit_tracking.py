@@ -0,0 +1,34 @@
+"""Add transfer in-transit tracking
+
+Revision ID: 13103071bbd6
+Revises: f813f111d9d0
+Create Date: 2026-10-19 18:41:05.227184
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '13103071bbd6'
+down_revision: Union[str, Sequence[str], None] = 'f813f111d9d0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing in_transit transfers never debited their source, so they stay
+    # undispatched and every counter starts at zero
+    op.add_column('warehouse_transfers', sa.Column('dispatched_at', sa.TIMESTAMP(), nullable=True))
+    op.add_column('warehouse_stock', sa.Column('in_transit_quantity', sa.DECIMAL(precision=10, scale=2), server_default='0', nullable=False))
+    op.add_column('warehouses', sa.Column('in_transit_quantity', sa.DECIMAL(precision=12, scale=2), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('warehouses', 'in_transit_quantity')
+    op.drop_column('warehouse_stock', 'in_transit_quantity')
+    op.drop_column('warehouse_transfers', 'dispatched_at')
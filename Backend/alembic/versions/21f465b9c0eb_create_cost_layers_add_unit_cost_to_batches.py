@@ -0,0 +1,47 @@
+"""Create cost_layers, add unit_cost to batches
+
+Revision ID: 21f465b9c0eb
+Revises: 5c6fa5e1e5b9
+Create Date: 2026-10-19 11:26:08.774312
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '21f465b9c0eb'
+down_revision: Union[str, Sequence[str], None] = '5c6fa5e1e5b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('cost_layers',
+    sa.Column('product_id', sa.UUID(), nullable=False),
+    sa.Column('warehouse_id', sa.UUID(), nullable=True),
+    sa.Column('source_type', sa.String(length=30), nullable=False),
+    sa.Column('source_id', sa.UUID(), nullable=True),
+    sa.Column('received_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('unit_cost', sa.DECIMAL(precision=10, scale=4), nullable=False),
+    sa.Column('quantity', sa.DECIMAL(precision=10, scale=2), nullable=False),
+    sa.Column('remaining_quantity', sa.DECIMAL(precision=10, scale=2), nullable=False),
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_cost_layers_open', 'cost_layers', ['product_id', 'warehouse_id', 'received_at'], unique=False, postgresql_where=sa.text('remaining_quantity > 0'))
+    op.add_column('batches', sa.Column('unit_cost', sa.DECIMAL(precision=10, scale=4), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('batches', 'unit_cost')
+    op.drop_index('ix_cost_layers_open', table_name='cost_layers', postgresql_where=sa.text('remaining_quantity > 0'))
+    op.drop_table('cost_layers')
@@ -0,0 +1,61 @@
+"""Generate available_quantity for warehouse_stock and batches
+
+Revision ID: 317d193bcb17
+Revises: 13103071bbd6
+Create Date: 2026-10-19 19:06:48.550231
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '317d193bcb17'
+down_revision: Union[str, Sequence[str], None] = '13103071bbd6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _generated():
+    return sa.Column(
+        'available_quantity',
+        sa.DECIMAL(precision=10, scale=2),
+        sa.Computed('quantity - reserved_quantity', persisted=True),
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # PostgreSQL can't turn a plain column into a generated one; recreate it
+    op.drop_column('warehouse_stock', 'available_quantity')
+    op.add_column('warehouse_stock', _generated())
+    op.create_index('ix_warehouse_stock_product_id_available_quantity', 'warehouse_stock', ['product_id', 'available_quantity'], unique=False)
+
+    # Batches had no reservations; keep today's available figure by booking the gap as reserved
+    op.add_column('batches', sa.Column('reserved_quantity', sa.DECIMAL(precision=10, scale=2), server_default='0', nullable=False))
+    op.execute("UPDATE batches SET reserved_quantity = greatest(quantity - available_quantity, 0)")
+    op.drop_column('batches', 'available_quantity')
+    op.add_column('batches', _generated())
+    op.create_index(
+        'ix_batches_product_id_warehouse_id_expiry_date_available', 'batches',
+        ['product_id', 'warehouse_id', 'expiry_date'], unique=False,
+        postgresql_where=sa.text('available_quantity > 0'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_batches_product_id_warehouse_id_expiry_date_available', table_name='batches')
+    op.drop_column('batches', 'available_quantity')
+    op.add_column('batches', sa.Column('available_quantity', sa.DECIMAL(precision=10, scale=2), nullable=True))
+    op.execute("UPDATE batches SET available_quantity = quantity - reserved_quantity")
+    op.alter_column('batches', 'available_quantity', nullable=False)
+    op.drop_column('batches', 'reserved_quantity')
+
+    op.drop_index('ix_warehouse_stock_product_id_available_quantity', table_name='warehouse_stock')
+    op.drop_column('warehouse_stock', 'available_quantity')
+    op.add_column('warehouse_stock', sa.Column('available_quantity', sa.DECIMAL(precision=10, scale=2), nullable=True))
+    op.execute("UPDATE warehouse_stock SET available_quantity = quantity - reserved_quantity")
+    op.alter_column('warehouse_stock', 'available_quantity', nullable=False)
@@ -0,0 +1,32 @@
+"""Index purchase orders for filtered, paginated listing
+
+Revision ID: 326a4a4dbb14
+Revises: 317d193bcb17
+Create Date: 2026-10-19 21:14:07.382945
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '326a4a4dbb14'
+down_revision: Union[str, Sequence[str], None] = '317d193bcb17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_purchase_orders_supplier_id_order_date', 'purchase_orders', ['supplier_id', 'order_date'], unique=False)
+    op.create_index('ix_purchase_orders_order_date_id', 'purchase_orders', ['order_date', 'id'], unique=False)
+    op.create_index('ix_purchase_order_items_po_id', 'purchase_order_items', ['po_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_purchase_order_items_po_id', table_name='purchase_order_items')
+    op.drop_index('ix_purchase_orders_order_date_id', table_name='purchase_orders')
+    op.drop_index('ix_purchase_orders_supplier_id_order_date', table_name='purchase_orders')
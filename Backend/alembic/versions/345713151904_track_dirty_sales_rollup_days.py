@@ -0,0 +1,84 @@
+"""Track sales days the daily rollup has not caught up with
+
+Revision ID: 345713151904
+Revises: 636a21cc69f1
+Create Date: 2026-10-19 23:05:38.617402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '345713151904'
+down_revision: Union[str, Sequence[str], None] = '636a21cc69f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TRIGGERS = {
+    'sales_rollup_dirty_insert': ('INSERT', 'REFERENCING NEW TABLE AS new_rows'),
+    'sales_rollup_dirty_update': ('UPDATE', 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+    'sales_rollup_dirty_delete': ('DELETE', 'REFERENCING OLD TABLE AS old_rows'),
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sales_rollup_dirty_days',
+    sa.Column('id', sa.UUID(), server_default=sa.text('gen_random_uuid()'), nullable=False),
+    sa.Column('sale_date', sa.Date(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('sale_date')
+    )
+    # Every write to sales marks the days it touched, whichever code path made
+    # it; updates only count when a rolled-up column changed.
+    op.execute("""
+        CREATE FUNCTION mark_sales_rollup_dirty() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO sales_rollup_dirty_days (sale_date)
+                SELECT DISTINCT sale_date FROM new_rows WHERE sale_date IS NOT NULL
+                ON CONFLICT (sale_date) DO NOTHING;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO sales_rollup_dirty_days (sale_date)
+                SELECT DISTINCT sale_date FROM old_rows WHERE sale_date IS NOT NULL
+                ON CONFLICT (sale_date) DO NOTHING;
+            ELSE
+                INSERT INTO sales_rollup_dirty_days (sale_date)
+                SELECT day FROM (
+                    SELECT o.sale_date, n.sale_date FROM old_rows AS o JOIN new_rows AS n ON n.id = o.id
+                    WHERE (o.sale_date, o.customer_id, o.warehouse_id, o.total_amount)
+                          IS DISTINCT FROM (n.sale_date, n.customer_id, n.warehouse_id, n.total_amount)
+                ) AS changed (old_day, new_day), LATERAL (VALUES (old_day), (new_day)) AS days (day)
+                WHERE day IS NOT NULL
+                GROUP BY day
+                ON CONFLICT (sale_date) DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    for name, (event, transition) in TRIGGERS.items():
+        op.execute(f"""
+            CREATE TRIGGER {name} AFTER {event} ON sales
+            {transition} FOR EACH STATEMENT EXECUTE FUNCTION mark_sales_rollup_dirty()
+        """)
+    # Days with sales after the last rebuilt day were never rolled up
+    op.execute("""
+        INSERT INTO sales_rollup_dirty_days (sale_date)
+        SELECT DISTINCT sale_date FROM sales
+        WHERE sale_date > coalesce((SELECT max(sale_date) FROM sales_daily_rollups), '-infinity'::date)
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name} ON sales")
+    op.execute("DROP FUNCTION IF EXISTS mark_sales_rollup_dirty()")
+    op.drop_table('sales_rollup_dirty_days')
@@ -0,0 +1,32 @@
+"""Index inventory_transactions for filtered history
+
+Revision ID: 5a1b12ffa93f
+Revises: 0865aed40d2f
+Create Date: 2026-10-19 13:05:42.618230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a1b12ffa93f'
+down_revision: Union[str, Sequence[str], None] = '0865aed40d2f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_inventory_transactions_created_at_id', 'inventory_transactions', ['created_at', 'id'], unique=False)
+    op.create_index('ix_inventory_transactions_warehouse_id_created_at', 'inventory_transactions', ['warehouse_id', 'created_at'], unique=False)
+    op.create_index('ix_inventory_transactions_reference_type_created_at', 'inventory_transactions', ['reference_type', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_inventory_transactions_reference_type_created_at', table_name='inventory_transactions')
+    op.drop_index('ix_inventory_transactions_warehouse_id_created_at', table_name='inventory_transactions')
+    op.drop_index('ix_inventory_transactions_created_at_id', table_name='inventory_transactions')
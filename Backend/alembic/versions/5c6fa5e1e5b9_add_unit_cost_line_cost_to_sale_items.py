@@ -0,0 +1,38 @@
+"""Add unit_cost, line_cost to sale_items
+
+Revision ID: 5c6fa5e1e5b9
+Revises: 887bb7103eef
+Create Date: 2026-10-19 10:41:52.118230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c6fa5e1e5b9'
+down_revision: Union[str, Sequence[str], None] = '887bb7103eef'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('sale_items', sa.Column('unit_cost', sa.DECIMAL(precision=10, scale=4), nullable=True))
+    op.add_column('sale_items', sa.Column('line_cost', sa.DECIMAL(precision=12, scale=2), nullable=True))
+    # Backfill existing lines from the current product cost; the best we know for past sales
+    op.execute("""
+        UPDATE sale_items AS si
+        SET unit_cost = p.cost_price,
+            line_cost = coalesce(si.quantity, 0) * coalesce(p.cost_price, 0)
+        FROM products AS p
+        WHERE p.id = si.product_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('sale_items', 'line_cost')
+    op.drop_column('sale_items', 'unit_cost')
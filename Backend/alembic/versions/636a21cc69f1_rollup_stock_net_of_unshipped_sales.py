@@ -0,0 +1,85 @@
+"""Roll up stock net of unshipped sales and ledger the changes
+
+Revision ID: 636a21cc69f1
+Revises: 326a4a4dbb14
+Create Date: 2026-10-19 22:41:53.108274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '636a21cc69f1'
+down_revision: Union[str, Sequence[str], None] = '326a4a4dbb14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Sales take their quantity off current_stock when created but only leave
+    # warehouse_stock when shipped, so the rollup target is the warehouse total
+    # less unshipped sales. Every change gets a product-level "rollup" ledger row.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION rollup_product_stock() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            touched uuid[];
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT array_agg(DISTINCT product_id) INTO touched FROM new_rows;
+            ELSIF TG_OP = 'DELETE' THEN
+                SELECT array_agg(DISTINCT product_id) INTO touched FROM old_rows;
+            ELSE
+                SELECT array_agg(product_id) INTO touched
+                FROM (SELECT product_id FROM new_rows UNION SELECT product_id FROM old_rows) AS rows;
+            END IF;
+
+            WITH target AS (
+                SELECT p.id, coalesce(p.current_stock, 0) AS current_stock,
+                       coalesce((SELECT sum(ws.quantity) FROM warehouse_stock AS ws WHERE ws.product_id = p.id), 0)
+                       - coalesce((SELECT sum(si.quantity) FROM sale_items AS si JOIN sales AS s ON s.id = si.sale_id
+                                   WHERE si.product_id = p.id AND s.shipped_at IS NULL), 0) AS expected
+                FROM products AS p
+                WHERE p.id = ANY(touched)
+            ), changed AS (
+                UPDATE products AS p SET current_stock = t.expected
+                FROM target AS t
+                WHERE p.id = t.id AND t.expected <> t.current_stock
+                RETURNING p.id, p.current_stock, t.expected - t.current_stock AS difference
+            )
+            INSERT INTO inventory_transactions
+                (id, product_id, warehouse_id, transaction_type, quantity, balance_after, reference_type, notes, created_at)
+            SELECT gen_random_uuid(), id, NULL, CASE WHEN difference > 0 THEN 'inbound' ELSE 'outbound' END,
+                   abs(difference), current_stock, 'rollup', 'Warehouse stock rollup', clock_timestamp()
+            FROM changed;
+            RETURN NULL;
+        END
+        $$
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION rollup_product_stock() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE products AS p SET current_stock = coalesce(
+                    (SELECT sum(ws.quantity) FROM warehouse_stock AS ws WHERE ws.product_id = p.id), 0)
+                WHERE p.id IN (SELECT product_id FROM new_rows);
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE products AS p SET current_stock = coalesce(
+                    (SELECT sum(ws.quantity) FROM warehouse_stock AS ws WHERE ws.product_id = p.id), 0)
+                WHERE p.id IN (SELECT product_id FROM old_rows);
+            ELSE
+                UPDATE products AS p SET current_stock = coalesce(
+                    (SELECT sum(ws.quantity) FROM warehouse_stock AS ws WHERE ws.product_id = p.id), 0)
+                WHERE p.id IN (SELECT product_id FROM new_rows UNION SELECT product_id FROM old_rows);
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
@@ -0,0 +1,41 @@
+"""Create stock_snapshots
+
+Revision ID: 6dd6467adf24
+Revises: 5a1b12ffa93f
+Create Date: 2026-10-19 13:41:27.905113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6dd6467adf24'
+down_revision: Union[str, Sequence[str], None] = '5a1b12ffa93f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('stock_snapshots',
+    sa.Column('id', sa.UUID(), server_default=sa.text('gen_random_uuid()'), nullable=False),
+    sa.Column('snapshot_date', sa.Date(), nullable=False),
+    sa.Column('product_id', sa.UUID(), nullable=False),
+    sa.Column('warehouse_id', sa.UUID(), nullable=True),
+    sa.Column('quantity', sa.DECIMAL(precision=12, scale=2), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_snapshots_snapshot_date_product_id', 'stock_snapshots', ['snapshot_date', 'product_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_stock_snapshots_snapshot_date_product_id', table_name='stock_snapshots')
+    op.drop_table('stock_snapshots')
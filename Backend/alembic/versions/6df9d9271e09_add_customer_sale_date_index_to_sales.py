@@ -0,0 +1,28 @@
+"""Add customer/sale_date index to sales
+
+Revision ID: 6df9d9271e09
+Revises: 62fac8c8cf29
+Create Date: 2026-10-19 09:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6df9d9271e09'
+down_revision: Union[str, Sequence[str], None] = '62fac8c8cf29'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_sales_customer_id_sale_date', 'sales', ['customer_id', 'sale_date'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_sales_customer_id_sale_date', table_name='sales')
@@ -0,0 +1,36 @@
+"""Require purchase order order_date
+
+Revision ID: 747124e58163
+Revises: 345713151904
+Create Date: 2026-10-19 23:31:12.094518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '747124e58163'
+down_revision: Union[str, Sequence[str], None] = '345713151904'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The listing pages on (order_date, id); NULL dates would sort first and fall out of the keyset
+    op.execute("UPDATE purchase_orders SET order_date = coalesce(created_at::date, current_date) WHERE order_date IS NULL")
+    op.alter_column('purchase_orders', 'order_date',
+               existing_type=sa.DATE(),
+               nullable=False,
+               existing_server_default=sa.text('CURRENT_DATE'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('purchase_orders', 'order_date',
+               existing_type=sa.DATE(),
+               nullable=True,
+               existing_server_default=sa.text('CURRENT_DATE'))
@@ -0,0 +1,50 @@
+"""Create sales_daily_rollups table
+
+Revision ID: 887bb7103eef
+Revises: 6df9d9271e09
+Create Date: 2026-10-19 10:03:17.228409
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '887bb7103eef'
+down_revision: Union[str, Sequence[str], None] = '6df9d9271e09'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sales_daily_rollups',
+    sa.Column('id', sa.UUID(), server_default=sa.text('gen_random_uuid()'), nullable=False),
+    sa.Column('sale_date', sa.Date(), nullable=False),
+    sa.Column('customer_id', sa.UUID(), nullable=True),
+    sa.Column('warehouse_id', sa.UUID(), nullable=True),
+    sa.Column('sale_count', sa.Integer(), nullable=False),
+    sa.Column('total_sales', sa.DECIMAL(precision=14, scale=2), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+    sa.ForeignKeyConstraint(['warehouse_id'], ['warehouses.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sales_daily_rollups_sale_date_customer_id', 'sales_daily_rollups', ['sale_date', 'customer_id'], unique=False)
+    # Backfill every closed day
+    op.execute("""
+        INSERT INTO sales_daily_rollups (sale_date, customer_id, warehouse_id, sale_count, total_sales)
+        SELECT sale_date, customer_id, warehouse_id, count(id), coalesce(sum(total_amount), 0)
+        FROM sales
+        WHERE sale_date < current_date
+        GROUP BY sale_date, customer_id, warehouse_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_sales_daily_rollups_sale_date_customer_id', table_name='sales_daily_rollups')
+    op.drop_table('sales_daily_rollups')
@@ -0,0 +1,65 @@
+"""Add warehouse_stock rollup triggers
+
+Revision ID: f813f111d9d0
+Revises: 6dd6467adf24
+Create Date: 2026-10-19 18:02:11.402317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f813f111d9d0'
+down_revision: Union[str, Sequence[str], None] = '6dd6467adf24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TRIGGERS = {
+    'warehouse_stock_rollup_insert': ('INSERT', 'REFERENCING NEW TABLE AS new_rows'),
+    'warehouse_stock_rollup_update': ('UPDATE', 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+    'warehouse_stock_rollup_delete': ('DELETE', 'REFERENCING OLD TABLE AS old_rows'),
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Recomputes products.current_stock from warehouse_stock for the products a
+    # statement touched. Installed disabled; StockReconciliationService.set_rollup
+    # reconciles and switches it on.
+    op.execute("""
+        CREATE FUNCTION rollup_product_stock() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE products AS p SET current_stock = coalesce(
+                    (SELECT sum(ws.quantity) FROM warehouse_stock AS ws WHERE ws.product_id = p.id), 0)
+                WHERE p.id IN (SELECT product_id FROM new_rows);
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE products AS p SET current_stock = coalesce(
+                    (SELECT sum(ws.quantity) FROM warehouse_stock AS ws WHERE ws.product_id = p.id), 0)
+                WHERE p.id IN (SELECT product_id FROM old_rows);
+            ELSE
+                UPDATE products AS p SET current_stock = coalesce(
+                    (SELECT sum(ws.quantity) FROM warehouse_stock AS ws WHERE ws.product_id = p.id), 0)
+                WHERE p.id IN (SELECT product_id FROM new_rows UNION SELECT product_id FROM old_rows);
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    for name, (event, transition) in TRIGGERS.items():
+        op.execute(f"""
+            CREATE TRIGGER {name} AFTER {event} ON warehouse_stock
+            {transition} FOR EACH STATEMENT EXECUTE FUNCTION rollup_product_stock()
+        """)
+        op.execute(f"ALTER TABLE warehouse_stock DISABLE TRIGGER {name}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name} ON warehouse_stock")
+    op.execute("DROP FUNCTION IF EXISTS rollup_product_stock()")
@@ -5,11 +5,17 @@ from typing import List, Optional
 
 from app.models.batch import Batch
 from app.schemas.batch import BatchCreate, BatchUpdate
+from app.services.costing_service import CostingService
 
 
 def create_batch(db: Session, batch_data: BatchCreate) -> Batch:
     batch = Batch(**batch_data.model_dump())
     db.add(batch)
+    if batch.unit_cost is not None:
+        db.flush()  # batch.id is generated by the database
+        CostingService(db).receive(
+            batch.product_id, batch.warehouse_id, batch.quantity, batch.unit_cost, "batch", batch.id
+        )
     db.commit()
     db.refresh(batch)
     return batch
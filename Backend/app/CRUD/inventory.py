@@ -1,27 +1,39 @@
-from app.models.inventory import WarehouseStock
-from app.schemas.inventory import WarehouseStockCreate, WarehouseStockUpdate
+from app.models.inventory import (WarehouseStock, Warehouse, Product, InventoryTransaction,
+                                  WarehouseTransfer, WarehouseTransferItem, PurchaseOrder, PurchaseOrderItem)
+from app.models.batch import Batch
+from app.schemas.inventory import (WarehouseStockCreate, WarehouseStockUpdate, WarehouseStockBulkUpsert, StockTakeCreate,
+                                   TransferReceive, PurchaseOrderReceive)
+from app.services.costing_service import CostingService
+from app.CRUD.ledger import ledger_row, record_movements
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from uuid import UUID
-from typing import List,Optional
+from sqlalchemy.orm import Session, selectinload, raiseload
+from sqlalchemy import (select, func, true, and_, or_, case, cast, literal, null, insert, update, tuple_,
+                        literal_column, Table, MetaData, Column, DECIMAL, Date, String)
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID, aggregate_order_by, insert as pg_insert
+from datetime import date, datetime
+from uuid import UUID, uuid4
+from typing import Dict, Iterator, List, Optional, Tuple
+from decimal import Decimal
 
 # crud/inventory.py
 
 def create_warehouse_stock(db: Session, stock: WarehouseStockCreate) -> WarehouseStock:
-    # Compute available_quantity before creating the object
-    available_quantity = stock.quantity - stock.reserved_quantity
-
     # Create the DB model instance
     db_stock = WarehouseStock(
         product_id=stock.product_id,
         warehouse_id=stock.warehouse_id,
         quantity=stock.quantity,
         reserved_quantity=stock.reserved_quantity,
-        available_quantity=available_quantity,
         bin_location=stock.bin_location,
     )
 
     db.add(db_stock)
+    db.flush()
+    if db_stock.quantity:
+        record_movements(db, [ledger_row(
+            db_stock.product_id, db_stock.quantity, db_stock.quantity, "adjustment", db_stock.id,
+            warehouse_id=db_stock.warehouse_id, notes="Opening warehouse stock",
+        )])
     db.commit()
     db.refresh(db_stock)
     return db_stock
@@ -32,12 +44,15 @@ def update_warehouse_stock(db: Session, stock_id: UUID, stock_data: WarehouseSto
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
 
+    previous_quantity = stock.quantity or 0
     for key, value in stock_data.model_dump(exclude_unset=True).items():
         setattr(stock, key, value)
 
-    # Optional: Recalculate available_quantity if needed
-    if 'quantity' in stock_data.model_fields_set or 'reserved_quantity' in stock_data.model_fields_set:
-        stock.available_quantity = (stock.quantity or 0) - (stock.reserved_quantity or 0)
+    if (stock.quantity or 0) != previous_quantity:
+        record_movements(db, [ledger_row(
+            stock.product_id, (stock.quantity or 0) - previous_quantity, stock.quantity, "adjustment", stock.id,
+            warehouse_id=stock.warehouse_id, notes="Warehouse stock edited",
+        )])
 
     db.commit()
     db.refresh(stock)
@@ -50,6 +65,78 @@ def get_all_warehouse_stocks(db: Session, warehouse_id: Optional[UUID] = None) -
         query = query.filter(WarehouseStock.warehouse_id == warehouse_id)
     return query.all()
 
+
+# -------- Stock matrix (products x warehouses) --------
+
+def stock_matrix_warehouses(db: Session, warehouse_ids: Optional[List[UUID]] = None) -> List[dict]:
+    """The matrix header: the given warehouses, or every active one, ordered by code"""
+    stmt = select(Warehouse.id, Warehouse.code, Warehouse.name).order_by(Warehouse.code, Warehouse.id)
+    if warehouse_ids:
+        stmt = stmt.where(Warehouse.id.in_(warehouse_ids))
+    else:
+        stmt = stmt.where(Warehouse.is_active.isnot(False))
+    return [dict(row._mapping) for row in db.execute(stmt)]
+
+
+def stock_matrix_page(
+    db: Session,
+    after: Optional[Tuple[str, UUID]] = None,
+    limit: int = 500,
+    category_id: Optional[UUID] = None,
+) -> Tuple[list, bool]:
+    """(id, sku) of one page of products, keyset-ordered by (sku, id), plus whether more follow"""
+    stmt = select(Product.id, Product.sku).order_by(Product.sku, Product.id).limit(limit + 1)
+    if after:
+        stmt = stmt.where(tuple_(Product.sku, Product.id) > tuple_(*after))
+    if category_id:
+        stmt = stmt.where(Product.category_id == category_id)
+    rows = db.execute(stmt).all()
+    return rows[:limit], len(rows) > limit
+
+
+def iter_stock_matrix_rows(
+    db: Session,
+    warehouse_ids: List[UUID],
+    product_ids: List[UUID],
+    measure: str = "quantity",
+    chunk_size: int = 1000,
+) -> Iterator[dict]:
+    """
+    One row per product with its measure per warehouse, pivoted in SQL into an
+    array ordered like warehouse_ids (0 where there is no stock row).
+    """
+    header = func.unnest(cast(warehouse_ids, ARRAY(PG_UUID(as_uuid=True)))).table_valued(
+        "warehouse_id", with_ordinality="position"
+    ).render_derived("header")
+    value = func.coalesce(getattr(WarehouseStock, measure), cast(0, DECIMAL(10, 2)))
+    stmt = (
+        select(
+            Product.id,
+            Product.sku,
+            Product.name,
+            func.array_agg(aggregate_order_by(value, header.c.position)).label("quantities"),
+            func.sum(value).label("total"),
+        )
+        .join_from(Product, header, true())
+        .outerjoin(WarehouseStock, and_(
+            WarehouseStock.product_id == Product.id,
+            WarehouseStock.warehouse_id == header.c.warehouse_id,
+        ))
+        .where(Product.id.in_(product_ids))
+        .group_by(Product.id)
+        .order_by(Product.sku, Product.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for row in db.execute(stmt):
+        yield {
+            "product_id": row.id,
+            "sku": row.sku,
+            "name": row.name,
+            "quantities": row.quantities,
+            "total": row.total,
+        }
+
+
 def get_warehouse_stock(db: Session, stock_id: UUID) -> WarehouseStock:
     return db.query(WarehouseStock).filter(WarehouseStock.id == stock_id).first()
 
@@ -57,5 +144,882 @@ def delete_warehouse_stock(db: Session, stock_id: UUID):
     stock = db.query(WarehouseStock).filter(WarehouseStock.id == stock_id).first()
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
+    if stock.quantity:
+        record_movements(db, [ledger_row(
+            stock.product_id, -stock.quantity, 0, "adjustment", stock.id,
+            warehouse_id=stock.warehouse_id, notes="Warehouse stock removed",
+        )])
     db.delete(stock)
     db.commit()
+
+
+UPSERT_CHUNK_SIZE = 5000
+
+
+def _upsert_stock_chunk(db: Session, rows: list, reference: Optional[str]) -> Tuple[int, int]:
+    """
+    Per chunk: lock the existing rows, then one statement that upserts and
+    writes ledger rows for quantity changes. Returns (inserted, updated); rows whose values
+    already match are left alone.
+    """
+    source = func.unnest(
+        cast([row.product_id for row in rows], ARRAY(PG_UUID(as_uuid=True))),
+        cast([row.warehouse_id for row in rows], ARRAY(PG_UUID(as_uuid=True))),
+        cast([row.quantity for row in rows], ARRAY(DECIMAL(10, 2))),
+        cast([row.reserved_quantity for row in rows], ARRAY(DECIMAL(10, 2))),
+        cast([row.bin_location for row in rows], ARRAY(String)),
+    ).table_valued("product_id", "warehouse_id", "quantity", "reserved_quantity", "bin_location").render_derived("source")
+
+    unknown = db.execute(
+        select(source.c.product_id, source.c.warehouse_id)
+        .outerjoin(Product, Product.id == source.c.product_id)
+        .outerjoin(Warehouse, Warehouse.id == source.c.warehouse_id)
+        .where(or_(Product.id.is_(None), Warehouse.id.is_(None)))
+        .limit(20)
+    ).all()
+    if unknown:
+        db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Unknown product or warehouse", "rows": [
+                {"product_id": str(row.product_id), "warehouse_id": str(row.warehouse_id)} for row in unknown
+            ]},
+        )
+
+    existing = (
+        select(WarehouseStock.product_id, WarehouseStock.warehouse_id, WarehouseStock.quantity)
+        .join(source, and_(
+            WarehouseStock.product_id == source.c.product_id,
+            WarehouseStock.warehouse_id == source.c.warehouse_id,
+        ))
+    )
+    # Locked first, in a separate statement: the upsert then can't race another
+    # writer, so the snapshot the CTE below reads is the quantity being replaced
+    db.execute(existing.with_only_columns(WarehouseStock.id).order_by(WarehouseStock.id).with_for_update(of=WarehouseStock))
+    previous = existing.cte("previous")
+    upsert = pg_insert(WarehouseStock).from_select(
+        ["id", "product_id", "warehouse_id", "quantity", "reserved_quantity", "bin_location"],
+        select(
+            func.gen_random_uuid(), source.c.product_id, source.c.warehouse_id,
+            source.c.quantity, source.c.reserved_quantity, source.c.bin_location,
+        ),
+    )
+    new_bin = func.coalesce(upsert.excluded.bin_location, WarehouseStock.bin_location)
+    upserted = (
+        upsert.on_conflict_do_update(
+            constraint="uix_product_warehouse",
+            set_={
+                "quantity": upsert.excluded.quantity,
+                "reserved_quantity": upsert.excluded.reserved_quantity,
+                "bin_location": new_bin,
+                "updated_at": func.now(),
+            },
+            where=tuple_(WarehouseStock.quantity, WarehouseStock.reserved_quantity, WarehouseStock.bin_location)
+            .is_distinct_from(tuple_(upsert.excluded.quantity, upsert.excluded.reserved_quantity, new_bin)),
+        )
+        .returning(
+            WarehouseStock.product_id,
+            WarehouseStock.warehouse_id,
+            WarehouseStock.quantity,
+            (literal_column("xmax") == 0).label("inserted"),
+        )
+        .cte("upserted")
+    )
+    delta = upserted.c.quantity - func.coalesce(previous.c.quantity, 0)
+    moved = (
+        select(upserted.c.product_id, upserted.c.warehouse_id, upserted.c.quantity, delta.label("delta"))
+        .outerjoin(previous, and_(
+            previous.c.product_id == upserted.c.product_id,
+            previous.c.warehouse_id == upserted.c.warehouse_id,
+        ))
+        .where(delta != 0)
+        .subquery()
+    )
+    ledger = (
+        insert(InventoryTransaction)
+        .from_select(
+            _ledger_columns(),
+            select(
+                func.gen_random_uuid(), moved.c.product_id, moved.c.warehouse_id,
+                case((moved.c.delta > 0, "inbound"), else_="outbound"), func.abs(moved.c.delta), moved.c.quantity,
+                literal("adjustment"), null(), literal(reference, String), literal("Bulk stock sync"),
+                func.clock_timestamp(),
+            ),
+        )
+        .cte("ledger")
+    )
+    counts = db.execute(
+        select(
+            func.count().filter(upserted.c.inserted),
+            func.count().filter(~upserted.c.inserted),
+        )
+        .add_cte(previous, ledger)
+    ).one()
+    return counts[0], counts[1]
+
+
+def bulk_upsert_warehouse_stock(db: Session, data: WarehouseStockBulkUpsert, chunk_size: int = UPSERT_CHUNK_SIZE) -> dict:
+    """Set stock levels for many (product, warehouse) pairs in one transaction, chunk_size rows per statement"""
+    pairs = {(row.product_id, row.warehouse_id) for row in data.rows}
+    if len(pairs) != len(data.rows):
+        raise HTTPException(status_code=400, detail="Each product/warehouse pair can only appear once")
+    if any(row.reserved_quantity > row.quantity for row in data.rows):
+        raise HTTPException(status_code=400, detail="reserved_quantity cannot exceed quantity")
+
+    inserted = updated = chunks = 0
+    for start in range(0, len(data.rows), chunk_size):
+        chunk_inserted, chunk_updated = _upsert_stock_chunk(db, data.rows[start:start + chunk_size], data.reference)
+        inserted += chunk_inserted
+        updated += chunk_updated
+        chunks += 1
+    db.commit()
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": len(data.rows) - inserted - updated,
+        "chunks": chunks,
+    }
+
+
+def inventory_summary(db: Session) -> dict:
+    """Dashboard counters in one statement, plus stock value (qty x cost_price) per warehouse."""
+    products = select(
+        func.count().label("total_products"),
+        func.count().filter(Product.current_stock < Product.min_stock_level).label("low_stock_items"),
+        func.coalesce(func.sum(Product.current_stock * Product.cost_price), 0).label("total_stock_value"),
+    ).subquery()
+    # Product-level ledger rows only: a sale and its shipment are one movement
+    transactions = select(
+        func.count().filter(InventoryTransaction.transaction_type == "inbound").label("inbound"),
+        func.count().filter(InventoryTransaction.transaction_type == "outbound").label("outbound"),
+    ).where(InventoryTransaction.warehouse_id.is_(None)).subquery()
+    # Both sides are single-row aggregates, so the cross join is one row
+    totals = db.execute(select(products, transactions).join_from(products, transactions, true())).one()
+
+    per_warehouse = db.execute(
+        select(
+            Warehouse.id,
+            Warehouse.name,
+            func.coalesce(func.sum(WarehouseStock.quantity), 0).label("quantity"),
+            func.coalesce(func.sum(WarehouseStock.quantity * Product.cost_price), 0).label("stock_value"),
+        )
+        .outerjoin(WarehouseStock, WarehouseStock.warehouse_id == Warehouse.id)
+        .outerjoin(Product, Product.id == WarehouseStock.product_id)
+        .group_by(Warehouse.id, Warehouse.name)
+        .order_by(Warehouse.name)
+    ).all()
+
+    return {
+        "total_products": totals.total_products,
+        "low_stock_items": totals.low_stock_items,
+        "total_inbound_transactions": totals.inbound,
+        "total_outbound_transactions": totals.outbound,
+        "total_stock_value": totals.total_stock_value,
+        "stock_value_by_warehouse": [
+            {
+                "warehouse_id": row.id,
+                "warehouse_name": row.name,
+                "quantity": row.quantity,
+                "stock_value": row.stock_value,
+            }
+            for row in per_warehouse
+        ],
+        "generated_at": datetime.utcnow(),
+    }
+
+
+# -------- Manual adjustment --------
+def adjust_product_stock(
+    db: Session,
+    product_id: UUID,
+    transaction_type: str,
+    quantity: Decimal,
+    notes: Optional[str] = None,
+) -> InventoryTransaction:
+    """
+    Move Product.current_stock and write its ledger row in one statement.
+
+    The stock check sits in the UPDATE's WHERE clause, so concurrent adjustments
+    and sales queue on the row lock instead of overwriting each other.
+    """
+    stock = func.coalesce(Product.current_stock, 0)
+    delta = quantity if transaction_type == "inbound" else -quantity
+    adjusted = update(Product).where(Product.id == product_id)
+    if transaction_type == "outbound":
+        adjusted = adjusted.where(stock >= quantity)
+    adjusted = (
+        adjusted
+        .values(current_stock=stock + delta)
+        .returning(Product.id, Product.current_stock)
+        .cte("adjusted")
+    )
+    txn = db.scalars(
+        insert(InventoryTransaction)
+        .from_select(
+            ["id", "product_id", "transaction_type", "quantity", "balance_after", "reference_type", "notes", "created_at"],
+            select(
+                func.gen_random_uuid(), adjusted.c.id, literal(transaction_type, String), literal(quantity, DECIMAL(10, 2)),
+                adjusted.c.current_stock, literal("adjustment"),
+                literal(notes or f"Manual stock {transaction_type}", String), func.clock_timestamp(),
+            ),
+        )
+        .add_cte(adjusted)
+        .returning(InventoryTransaction)
+    ).first()
+
+    if txn is None:
+        db.rollback()
+        if not db.scalar(select(Product.id).where(Product.id == product_id)):
+            raise HTTPException(status_code=404, detail="Product not found")
+        raise HTTPException(status_code=400, detail="Insufficient stock")
+    db.commit()
+    return txn
+
+
+# -------- Warehouse transfers --------
+# pending -> in_transit (dispatch: source debited, destination in_transit_quantity
+# credited) -> completed (every item received into the destination's on-hand stock).
+def _transfer_lines(quantities: Dict[UUID, Decimal]):
+    return func.unnest(
+        cast(list(quantities), ARRAY(PG_UUID(as_uuid=True))),
+        cast(list(quantities.values()), ARRAY(DECIMAL(10, 2))),
+    ).table_valued("product_id", "quantity").render_derived("moved")
+
+
+def _lock_transfer(db: Session, transfer_id: UUID) -> WarehouseTransfer:
+    transfer = (
+        db.query(WarehouseTransfer)
+        .filter(WarehouseTransfer.id == transfer_id)
+        .with_for_update()
+        .first()
+    )
+    if not transfer:
+        raise HTTPException(status_code=404, detail="Transfer not found")
+    # Closed transfers never move stock again
+    if transfer.status in ("completed", "cancelled"):
+        raise HTTPException(status_code=400, detail=f"Transfer is already {transfer.status}")
+    if transfer.from_warehouse_id == transfer.to_warehouse_id:
+        raise HTTPException(status_code=400, detail="Source and destination warehouse are the same")
+    return transfer
+
+
+def _outstanding_quantities(db: Session, transfer: WarehouseTransfer) -> Dict[UUID, Decimal]:
+    outstanding = WarehouseTransferItem.quantity - func.coalesce(WarehouseTransferItem.received_quantity, 0)
+    return dict(db.execute(
+        select(WarehouseTransferItem.product_id, func.sum(outstanding))
+        .where(WarehouseTransferItem.transfer_id == transfer.id)
+        .group_by(WarehouseTransferItem.product_id)
+        .having(func.sum(outstanding) > 0)
+    ).all())
+
+
+def _lock_transfer_stock(db: Session, product_ids: List[UUID], warehouse_ids: List[UUID]) -> None:
+    # One pass in a stable order, so opposing transfers can't deadlock
+    db.execute(
+        select(WarehouseStock.id)
+        .where(WarehouseStock.product_id.in_(product_ids), WarehouseStock.warehouse_id.in_(warehouse_ids))
+        .order_by(WarehouseStock.id)
+        .with_for_update()
+    )
+
+
+def _transfer_ledger(transfer: WarehouseTransfer, source, warehouse_id: UUID, transaction_type: str):
+    """Ledger INSERT ... SELECT over a CTE of (product_id, quantity after, moved_quantity)"""
+    return insert(InventoryTransaction).from_select(
+        _ledger_columns(),
+        select(
+            func.gen_random_uuid(), source.c.product_id, literal(warehouse_id, PG_UUID(as_uuid=True)),
+            literal(transaction_type), source.c.moved_quantity, source.c.quantity,
+            literal("transfer"), literal(transfer.id, PG_UUID(as_uuid=True)),
+            literal(transfer.transfer_number, String), literal(transfer.notes, String),
+            func.clock_timestamp(),
+        ),
+    ).add_cte(source).returning(InventoryTransaction.product_id)
+
+
+def _debit_transfer_source(db: Session, transfer: WarehouseTransfer, quantities: Dict[UUID, Decimal]) -> None:
+    moved = _transfer_lines(quantities)
+    debited = (
+        update(WarehouseStock)
+        .where(
+            WarehouseStock.product_id == moved.c.product_id,
+            WarehouseStock.warehouse_id == transfer.from_warehouse_id,
+            WarehouseStock.available_quantity >= moved.c.quantity,
+        )
+        .values(
+            quantity=WarehouseStock.quantity - moved.c.quantity,
+            updated_at=func.now(),
+        )
+        .returning(WarehouseStock.product_id, WarehouseStock.quantity, moved.c.quantity.label("moved_quantity"))
+        .cte("debited")
+    )
+    sent = set(db.scalars(_transfer_ledger(transfer, debited, transfer.from_warehouse_id, "outbound")).all())
+    short = [str(product_id) for product_id in quantities if product_id not in sent]
+    if short:
+        db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient stock in source warehouse for products: {', '.join(short[:20])}",
+        )
+
+
+def _credit_transfer_destination(
+    db: Session,
+    transfer: WarehouseTransfer,
+    quantities: Dict[UUID, Decimal],
+    in_transit: Optional[str] = None,
+) -> None:
+    """
+    Upsert the destination rows in one INSERT ... ON CONFLICT.
+
+    in_transit="add" books the quantities as in transit only (dispatch);
+    "release" moves them from in transit to on hand (receipt); None credits
+    on hand directly. The warehouse's in-transit total moves with the rows,
+    and on-hand credits get their ledger rows.
+    """
+    moved = _transfer_lines(quantities)
+    on_hand = in_transit != "add"
+    credit = pg_insert(WarehouseStock).from_select(
+        ["id", "product_id", "warehouse_id", "quantity", "reserved_quantity", "in_transit_quantity"],
+        select(
+            func.gen_random_uuid(), moved.c.product_id, literal(transfer.to_warehouse_id, PG_UUID(as_uuid=True)),
+            moved.c.quantity if on_hand else literal(0), literal(0), literal(0) if on_hand else moved.c.quantity,
+        ),
+    )
+    changes = {"updated_at": func.now()}
+    if on_hand:
+        changes["quantity"] = WarehouseStock.quantity + credit.excluded.quantity
+    if in_transit == "add":
+        changes["in_transit_quantity"] = WarehouseStock.in_transit_quantity + credit.excluded.in_transit_quantity
+    elif in_transit == "release":
+        changes["in_transit_quantity"] = WarehouseStock.in_transit_quantity - credit.excluded.quantity
+    if in_transit:
+        total = sum(quantities.values(), Decimal("0"))
+        db.execute(
+            update(Warehouse)
+            .where(Warehouse.id == transfer.to_warehouse_id)
+            .values(in_transit_quantity=Warehouse.in_transit_quantity + (total if in_transit == "add" else -total))
+        )
+    upsert = credit.on_conflict_do_update(constraint="uix_product_warehouse", set_=changes)
+    if not on_hand:
+        db.execute(upsert)
+        return
+
+    credited = upsert.returning(WarehouseStock.product_id, WarehouseStock.quantity).cte("credited")
+    received = _transfer_lines(quantities)
+    credited_lines = (
+        select(credited.c.product_id, credited.c.quantity, received.c.quantity.label("moved_quantity"))
+        .join(received, received.c.product_id == credited.c.product_id)
+        .cte("credited_lines")
+    )
+    db.execute(_transfer_ledger(transfer, credited_lines, transfer.to_warehouse_id, "inbound").add_cte(credited))
+
+
+def _close_if_received(db: Session, transfer: WarehouseTransfer) -> None:
+    if not _outstanding_quantities(db, transfer):
+        transfer.status = "completed"
+
+
+def dispatch_warehouse_transfer(db: Session, transfer_id: UUID) -> WarehouseTransfer:
+    """Take the transfer's quantities out of the source and book them in transit to the destination"""
+    transfer = _lock_transfer(db, transfer_id)
+    if transfer.dispatched_at:
+        raise HTTPException(status_code=400, detail="Transfer already dispatched")
+
+    quantities = _outstanding_quantities(db, transfer)
+    if quantities:
+        _lock_transfer_stock(db, list(quantities), [transfer.from_warehouse_id, transfer.to_warehouse_id])
+        _debit_transfer_source(db, transfer, quantities)
+        _credit_transfer_destination(db, transfer, quantities, in_transit="add")
+
+    transfer.status = "in_transit"
+    transfer.dispatched_at = func.now()
+    db.commit()
+    db.refresh(transfer)
+    return transfer
+
+
+def receive_warehouse_transfer(db: Session, transfer_id: UUID, data: TransferReceive) -> WarehouseTransfer:
+    """
+    Receive part or all of a dispatched transfer, many items per call. Each
+    item's received_quantity can't pass its quantity; the transfer completes
+    when nothing is outstanding.
+    """
+    transfer = _lock_transfer(db, transfer_id)
+    if not transfer.dispatched_at:
+        raise HTTPException(status_code=400, detail="Transfer has not been dispatched")
+
+    received = {}
+    for line in data.lines:
+        received[line.item_id] = received.get(line.item_id, 0) + line.quantity
+    lines = func.unnest(
+        cast(list(received), ARRAY(PG_UUID(as_uuid=True))),
+        cast(list(received.values()), ARRAY(DECIMAL(10, 2))),
+    ).table_valued("item_id", "quantity").render_derived("received")
+    already = func.coalesce(WarehouseTransferItem.received_quantity, 0)
+    rows = db.execute(
+        update(WarehouseTransferItem)
+        .where(
+            WarehouseTransferItem.id == lines.c.item_id,
+            WarehouseTransferItem.transfer_id == transfer.id,
+            already + lines.c.quantity <= WarehouseTransferItem.quantity,
+        )
+        .values(received_quantity=already + lines.c.quantity)
+        .returning(WarehouseTransferItem.id, WarehouseTransferItem.product_id, lines.c.quantity)
+    ).all()
+    if len(rows) < len(received):
+        db.rollback()
+        rejected = set(received) - {row.id for row in rows}
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown items or quantities above what is outstanding: {', '.join(str(i) for i in list(rejected)[:20])}",
+        )
+
+    quantities: Dict[UUID, Decimal] = {}
+    for row in rows:
+        quantities[row.product_id] = quantities.get(row.product_id, 0) + row.quantity
+    _lock_transfer_stock(db, list(quantities), [transfer.to_warehouse_id])
+    _credit_transfer_destination(db, transfer, quantities, in_transit="release")
+
+    _close_if_received(db, transfer)
+    db.commit()
+    db.refresh(transfer)
+    return transfer
+
+
+def complete_warehouse_transfer(db: Session, transfer_id: UUID) -> WarehouseTransfer:
+    """
+    Receive everything still outstanding. A transfer that was never dispatched
+    moves straight from source to destination on-hand stock.
+
+    Each side is one set-based statement whatever the line count: an UPDATE ...
+    FROM unnest() on the source, guarded by available_quantity, and an INSERT
+    ... ON CONFLICT on the destination, each feeding its ledger rows from RETURNING.
+    """
+    transfer = _lock_transfer(db, transfer_id)
+    quantities = _outstanding_quantities(db, transfer)
+    if quantities:
+        if transfer.dispatched_at:
+            _lock_transfer_stock(db, list(quantities), [transfer.to_warehouse_id])
+            _credit_transfer_destination(db, transfer, quantities, in_transit="release")
+        else:
+            _lock_transfer_stock(db, list(quantities), [transfer.from_warehouse_id, transfer.to_warehouse_id])
+            _debit_transfer_source(db, transfer, quantities)
+            _credit_transfer_destination(db, transfer, quantities)
+        db.execute(
+            update(WarehouseTransferItem)
+            .where(WarehouseTransferItem.transfer_id == transfer.id)
+            .values(received_quantity=WarehouseTransferItem.quantity)
+        )
+
+    transfer.status = "completed"
+    db.commit()
+    db.refresh(transfer)
+    return transfer
+
+
+def warehouse_in_transit(db: Session, warehouse_id: UUID, include_items: bool = False) -> dict:
+    """Stock on its way to a warehouse, read from the maintained counters"""
+    total = db.scalar(select(Warehouse.in_transit_quantity).where(Warehouse.id == warehouse_id))
+    if total is None:
+        raise HTTPException(status_code=404, detail="Warehouse not found")
+    result = {"warehouse_id": warehouse_id, "in_transit_quantity": total}
+    if include_items:
+        rows = db.execute(
+            select(WarehouseStock.product_id, WarehouseStock.in_transit_quantity)
+            .where(WarehouseStock.warehouse_id == warehouse_id, WarehouseStock.in_transit_quantity > 0)
+            .order_by(WarehouseStock.product_id)
+        ).all()
+        result["items"] = [{"product_id": row.product_id, "in_transit_quantity": row.in_transit_quantity} for row in rows]
+    return result
+
+
+# -------- Stock take --------
+# Counted lines are loaded once into a temp table; everything after is set-based SQL
+_stock_take_lines = Table(
+    "stock_take_lines",
+    MetaData(),
+    Column("product_id", PG_UUID(as_uuid=True), nullable=False),
+    Column("warehouse_id", PG_UUID(as_uuid=True), nullable=False),
+    Column("counted_quantity", DECIMAL(10, 2), nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+def _load_stock_take_lines(db: Session, data: StockTakeCreate) -> None:
+    lines = _stock_take_lines
+    lines.create(db.connection())
+    counted = func.unnest(
+        cast([line.product_id for line in data.lines], ARRAY(PG_UUID(as_uuid=True))),
+        cast([line.warehouse_id for line in data.lines], ARRAY(PG_UUID(as_uuid=True))),
+        cast([line.counted_quantity for line in data.lines], ARRAY(DECIMAL(10, 2))),
+    ).table_valued("product_id", "warehouse_id", "counted_quantity").render_derived()
+    db.execute(
+        insert(lines).from_select(
+            ["product_id", "warehouse_id", "counted_quantity"],
+            select(counted.c.product_id, counted.c.warehouse_id, counted.c.counted_quantity),
+        )
+    )
+
+
+def _stock_take_variances():
+    lines = _stock_take_lines
+    system = func.coalesce(WarehouseStock.quantity, 0)
+    variance = lines.c.counted_quantity - system
+    return (
+        select(
+            lines.c.product_id,
+            lines.c.warehouse_id,
+            system.label("system_quantity"),
+            lines.c.counted_quantity,
+            variance.label("variance"),
+            func.round(variance * func.coalesce(Product.cost_price, 0), 2).label("variance_value"),
+        )
+        .select_from(lines)
+        .join(Product, Product.id == lines.c.product_id)
+        .outerjoin(
+            WarehouseStock,
+            and_(
+                WarehouseStock.product_id == lines.c.product_id,
+                WarehouseStock.warehouse_id == lines.c.warehouse_id,
+            ),
+        )
+        .where(variance != 0)
+    )
+
+
+def _ledger_columns() -> List[str]:
+    return [
+        "id", "product_id", "warehouse_id", "transaction_type", "quantity", "balance_after",
+        "reference_type", "reference_id", "reference", "notes", "created_at",
+    ]
+
+
+def apply_stock_take(db: Session, data: StockTakeCreate) -> dict:
+    """
+    Post counted quantities for many (product, warehouse) pairs in one transaction.
+
+    Warehouse stock is set to the counted quantity, each product's current_stock
+    moves by its net variance, and every change gets a ledger row. With dry_run
+    nothing is written and only the variance report is returned.
+    """
+    pairs = {(line.product_id, line.warehouse_id) for line in data.lines}
+    if len(pairs) != len(data.lines):
+        raise HTTPException(status_code=400, detail="Each product/warehouse pair can only be counted once")
+
+    lines = _stock_take_lines
+    _load_stock_take_lines(db, data)
+
+    unknown = db.execute(
+        select(lines.c.product_id, lines.c.warehouse_id)
+        .outerjoin(Product, Product.id == lines.c.product_id)
+        .outerjoin(Warehouse, Warehouse.id == lines.c.warehouse_id)
+        .where(or_(Product.id.is_(None), Warehouse.id.is_(None)))
+        .limit(20)
+    ).all()
+    if unknown:
+        db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Unknown product or warehouse", "lines": [
+                {"product_id": str(row.product_id), "warehouse_id": str(row.warehouse_id)} for row in unknown
+            ]},
+        )
+
+    if not data.dry_run:
+        # Lock the stock rows and products being corrected, in a stable order
+        db.execute(
+            select(WarehouseStock.id)
+            .join(lines, and_(
+                WarehouseStock.product_id == lines.c.product_id,
+                WarehouseStock.warehouse_id == lines.c.warehouse_id,
+            ))
+            .order_by(WarehouseStock.id)
+            .with_for_update(of=WarehouseStock)
+        )
+        db.execute(
+            select(Product.id)
+            .where(Product.id.in_(select(lines.c.product_id)))
+            .order_by(Product.id)
+            .with_for_update()
+        )
+
+    variances = db.execute(_stock_take_variances().order_by(lines.c.product_id, lines.c.warehouse_id)).all()
+    stock_take_id = uuid4()
+    result = {
+        "stock_take_id": stock_take_id,
+        "applied": not data.dry_run,
+        "lines_counted": len(data.lines),
+        "lines_with_variance": len(variances),
+        "net_variance": sum((row.variance for row in variances), Decimal("0")),
+        "net_variance_value": sum((row.variance_value for row in variances), Decimal("0")),
+        "variances": [row._asdict() for row in variances],
+    }
+    if data.dry_run or not variances:
+        db.rollback()
+        return result
+
+    moved = _stock_take_variances().subquery()
+    direction = case((moved.c.variance > 0, "inbound"), else_="outbound")
+    db.execute(
+        insert(InventoryTransaction).from_select(
+            _ledger_columns(),
+            select(
+                func.gen_random_uuid(), moved.c.product_id, moved.c.warehouse_id, direction,
+                func.abs(moved.c.variance), moved.c.counted_quantity, literal("stock_take"),
+                literal(stock_take_id, PG_UUID(as_uuid=True)), literal(data.reference, String), literal(data.notes, String),
+                func.clock_timestamp(),
+            ),
+        )
+    )
+
+    # Product-level stock moves by the net variance, with its own ledger rows
+    net = select(moved.c.product_id, func.sum(moved.c.variance).label("variance")).group_by(moved.c.product_id).subquery()
+    adjusted = (
+        update(Product)
+        .where(Product.id == net.c.product_id, net.c.variance != 0)
+        .values(current_stock=func.coalesce(Product.current_stock, 0) + net.c.variance)
+        .returning(Product.id, Product.current_stock, net.c.variance)
+        .cte("adjusted")
+    )
+    db.execute(
+        insert(InventoryTransaction).from_select(
+            _ledger_columns(),
+            select(
+                func.gen_random_uuid(), adjusted.c.id, null(),
+                case((adjusted.c.variance > 0, "inbound"), else_="outbound"),
+                func.abs(adjusted.c.variance), adjusted.c.current_stock, literal("stock_take"),
+                literal(stock_take_id, PG_UUID(as_uuid=True)), literal(data.reference, String), literal(data.notes, String),
+                func.clock_timestamp(),
+            ),
+        ).add_cte(adjusted)
+    )
+
+    db.execute(
+        update(WarehouseStock)
+        .where(
+            WarehouseStock.product_id == lines.c.product_id,
+            WarehouseStock.warehouse_id == lines.c.warehouse_id,
+            WarehouseStock.quantity != lines.c.counted_quantity,
+        )
+        .values(
+            quantity=lines.c.counted_quantity,
+            updated_at=func.now(),
+        )
+    )
+    missing = (
+        select(
+            func.gen_random_uuid(), lines.c.product_id, lines.c.warehouse_id,
+            lines.c.counted_quantity, literal(0),
+        )
+        .outerjoin(WarehouseStock, and_(
+            WarehouseStock.product_id == lines.c.product_id,
+            WarehouseStock.warehouse_id == lines.c.warehouse_id,
+        ))
+        .where(WarehouseStock.id.is_(None), lines.c.counted_quantity > 0)
+    )
+    db.execute(
+        insert(WarehouseStock).from_select(
+            ["id", "product_id", "warehouse_id", "quantity", "reserved_quantity"],
+            missing,
+        )
+    )
+
+    db.commit()
+    return result
+
+
+# -------- Purchase orders --------
+def purchase_order_page(
+    db: Session,
+    after: Optional[Tuple[date, UUID]] = None,
+    limit: int = 100,
+    supplier_id: Optional[UUID] = None,
+    status: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    include_items: bool = True,
+) -> Tuple[List[PurchaseOrder], bool]:
+    """
+    Newest first, one keyset page on (order_date, id); returns the page and
+    whether more follow. Items come in one extra IN query for the whole page,
+    or not at all.
+    """
+    query = db.query(PurchaseOrder)
+    if supplier_id:
+        query = query.filter(PurchaseOrder.supplier_id == supplier_id)
+    if status:
+        query = query.filter(PurchaseOrder.status == status)
+    if start_date:
+        query = query.filter(PurchaseOrder.order_date >= start_date)
+    if end_date:
+        query = query.filter(PurchaseOrder.order_date <= end_date)
+    if after:
+        query = query.filter(tuple_(PurchaseOrder.order_date, PurchaseOrder.id) < tuple_(*after))
+
+    rows = (
+        query.options(selectinload(PurchaseOrder.items) if include_items else raiseload(PurchaseOrder.items))
+        .order_by(PurchaseOrder.order_date.desc(), PurchaseOrder.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    return rows[:limit], len(rows) > limit
+
+
+# -------- Purchase order receipts --------
+def _receipt_ledger(po: PurchaseOrder, source, warehouse_id: Optional[UUID], notes: Optional[str]):
+    """Inbound ledger rows from a CTE of (product_id, quantity after, moved_quantity); no warehouse is product level"""
+    return insert(InventoryTransaction).from_select(
+        _ledger_columns(),
+        select(
+            func.gen_random_uuid(), source.c.product_id,
+            literal(warehouse_id, PG_UUID(as_uuid=True)) if warehouse_id else null(),
+            literal("inbound"), source.c.moved_quantity, source.c.quantity,
+            literal("purchase_order"), literal(po.id, PG_UUID(as_uuid=True)),
+            literal(po.po_number, String), literal(notes, String), func.clock_timestamp(),
+        ),
+    ).add_cte(source)
+
+
+def _receive_batches(db: Session, data: PurchaseOrderReceive, received_items: list) -> None:
+    """
+    Create or top up the batches named on the receipt, in one INSERT ... ON CONFLICT.
+    unit_cost stays NULL: the receipt's purchase_order cost layer already carries it.
+    """
+    items = {row.id: row for row in received_items}
+    batches: Dict[Tuple[UUID, str], list] = {}
+    for line in data.lines:
+        if line.batch_number:
+            item = items[line.item_id]
+            batch = batches.setdefault(
+                (item.product_id, line.batch_number),
+                [Decimal("0"), line.manufacturing_date, line.expiry_date],
+            )
+            batch[0] += line.quantity
+    if not batches:
+        return
+
+    keys, values = list(batches), list(batches.values())
+    received = func.unnest(
+        cast([product_id for product_id, _ in keys], ARRAY(PG_UUID(as_uuid=True))),
+        cast([batch_number for _, batch_number in keys], ARRAY(String)),
+        cast([value[1] for value in values], ARRAY(Date)),
+        cast([value[2] for value in values], ARRAY(Date)),
+        cast([value[0] for value in values], ARRAY(DECIMAL(10, 2))),
+    ).table_valued(
+        "product_id", "batch_number", "manufacturing_date", "expiry_date", "quantity"
+    ).render_derived("received_batches")
+    stmt = pg_insert(Batch).from_select(
+        ["product_id", "warehouse_id", "batch_number", "manufacturing_date", "expiry_date", "quantity"],
+        select(
+            received.c.product_id, literal(data.warehouse_id, PG_UUID(as_uuid=True)), received.c.batch_number,
+            received.c.manufacturing_date, received.c.expiry_date, received.c.quantity,
+        ),
+    )
+    db.execute(stmt.on_conflict_do_update(
+        constraint="uq_batch_combination",
+        set_={"quantity": Batch.quantity + stmt.excluded.quantity},
+    ))
+
+
+def receive_purchase_order(db: Session, po_id: UUID, data: PurchaseOrderReceive) -> PurchaseOrder:
+    """
+    Book goods received against a purchase order into one warehouse.
+
+    In one transaction: received_qty on the lines (never past the ordered
+    quantity), Product.current_stock and the warehouse row with their ledger
+    rows, the batches named on the receipt and a cost layer per line at its
+    unit price. The order then moves to partial or received. Stock, ledger and
+    batches are one statement each whatever the line count.
+    """
+    po = db.query(PurchaseOrder).filter(PurchaseOrder.id == po_id).with_for_update().first()
+    if not po:
+        raise HTTPException(status_code=404, detail="Purchase Order not found")
+    if po.status in ("received", "cancelled"):
+        raise HTTPException(status_code=400, detail=f"Purchase order is already {po.status}")
+    if not db.scalar(select(Warehouse.id).where(Warehouse.id == data.warehouse_id)):
+        raise HTTPException(status_code=404, detail="Warehouse not found")
+
+    received: Dict[UUID, Decimal] = {}
+    for line in data.lines:
+        received[line.item_id] = received.get(line.item_id, 0) + line.quantity
+    lines = func.unnest(
+        cast(list(received), ARRAY(PG_UUID(as_uuid=True))),
+        cast(list(received.values()), ARRAY(DECIMAL(10, 2))),
+    ).table_valued("item_id", "quantity").render_derived("received")
+    already = func.coalesce(PurchaseOrderItem.received_qty, 0)
+    rows = db.execute(
+        update(PurchaseOrderItem)
+        .where(
+            PurchaseOrderItem.id == lines.c.item_id,
+            PurchaseOrderItem.po_id == po.id,
+            already + lines.c.quantity <= PurchaseOrderItem.quantity,
+        )
+        .values(received_qty=already + lines.c.quantity)
+        .returning(PurchaseOrderItem.id, PurchaseOrderItem.product_id, PurchaseOrderItem.unit_price, lines.c.quantity)
+    ).all()
+    if len(rows) < len(received):
+        db.rollback()
+        rejected = set(received) - {row.id for row in rows}
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown items or quantities above what is outstanding: {', '.join(str(i) for i in list(rejected)[:20])}",
+        )
+
+    quantities: Dict[UUID, Decimal] = {}
+    for row in rows:
+        quantities[row.product_id] = quantities.get(row.product_id, 0) + row.quantity
+    db.execute(select(Product.id).where(Product.id.in_(list(quantities))).order_by(Product.id).with_for_update())
+    _lock_transfer_stock(db, list(quantities), [data.warehouse_id])
+
+    # Product level first: with the stock rollup enabled, the warehouse write
+    # below resets current_stock to the warehouse total
+    moved = _transfer_lines(quantities)
+    adjusted = (
+        update(Product)
+        .where(Product.id == moved.c.product_id)
+        .values(current_stock=func.coalesce(Product.current_stock, 0) + moved.c.quantity)
+        .returning(Product.id.label("product_id"), Product.current_stock.label("quantity"),
+                   moved.c.quantity.label("moved_quantity"))
+        .cte("adjusted")
+    )
+    db.execute(_receipt_ledger(po, adjusted, None, data.notes))
+
+    moved = _transfer_lines(quantities)
+    credit = pg_insert(WarehouseStock).from_select(
+        ["id", "product_id", "warehouse_id", "quantity", "reserved_quantity", "in_transit_quantity"],
+        select(
+            func.gen_random_uuid(), moved.c.product_id, literal(data.warehouse_id, PG_UUID(as_uuid=True)),
+            moved.c.quantity, literal(0), literal(0),
+        ),
+    )
+    credited = (
+        credit.on_conflict_do_update(
+            constraint="uix_product_warehouse",
+            set_={"quantity": WarehouseStock.quantity + credit.excluded.quantity, "updated_at": func.now()},
+        )
+        .returning(WarehouseStock.product_id, WarehouseStock.quantity)
+        .cte("credited")
+    )
+    receipt = _transfer_lines(quantities)
+    credited_lines = (
+        select(credited.c.product_id, credited.c.quantity, receipt.c.quantity.label("moved_quantity"))
+        .join(receipt, receipt.c.product_id == credited.c.product_id)
+        .cte("credited_lines")
+    )
+    db.execute(_receipt_ledger(po, credited_lines, data.warehouse_id, data.notes).add_cte(credited))
+
+    _receive_batches(db, data, rows)
+    costing = CostingService(db)
+    for row in rows:
+        costing.receive(row.product_id, data.warehouse_id, row.quantity, row.unit_price, "purchase_order", po.id)
+
+    outstanding = db.scalar(
+        select(func.count())
+        .where(PurchaseOrderItem.po_id == po.id, func.coalesce(PurchaseOrderItem.received_qty, 0) < PurchaseOrderItem.quantity)
+    )
+    po.status = "partial" if outstanding else "received"
+    db.commit()
+    db.refresh(po)
+    return po
@@ -0,0 +1,131 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, insert, select, tuple_, cast, Date
+from sqlalchemy.orm import Session
+
+from app.models.inventory import InventoryTransaction
+
+
+# -------- Stock movement ledger --------
+# Every path that changes stock appends one row per product (and warehouse)
+# moved, in the same transaction as the stock change. balance_after is the
+# warehouse's stock when warehouse_id is set, Product.current_stock otherwise.
+
+def ledger_row(
+    product_id: UUID,
+    quantity,
+    balance_after,
+    reference_type: str,
+    reference_id: Optional[UUID] = None,
+    reference: Optional[str] = None,
+    warehouse_id: Optional[UUID] = None,
+    notes: Optional[str] = None,
+) -> dict:
+    """A ledger entry for a signed quantity (positive in, negative out)"""
+    quantity = Decimal(str(quantity))
+    return {
+        "product_id": product_id,
+        "warehouse_id": warehouse_id,
+        "transaction_type": "inbound" if quantity >= 0 else "outbound",
+        "quantity": abs(quantity),
+        "balance_after": balance_after,
+        "reference_type": reference_type,
+        "reference_id": reference_id,
+        "reference": reference,
+        "notes": notes,
+    }
+
+
+def record_movements(db: Session, rows: List[dict]) -> None:
+    """Append ledger rows in a single INSERT"""
+    if not rows:
+        return
+    # clock_timestamp() keeps rows of one transaction in the order they happened
+    db.execute(
+        insert(InventoryTransaction).values([{**row, "created_at": func.clock_timestamp()} for row in rows])
+    )
+
+
+# -------- History --------
+def _transaction_filters(
+    product_id: Optional[UUID] = None,
+    transaction_type: Optional[str] = None,
+    reference_type: Optional[str] = None,
+    warehouse_id: Optional[UUID] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    level: Optional[str] = None,
+) -> list:
+    filters = []
+    # A sale moves Product.current_stock and its shipment the warehouse row,
+    # so totals over both levels count the same goods twice
+    if level == "product":
+        filters.append(InventoryTransaction.warehouse_id.is_(None))
+    elif level == "warehouse":
+        filters.append(InventoryTransaction.warehouse_id.isnot(None))
+    if product_id:
+        filters.append(InventoryTransaction.product_id == product_id)
+    if transaction_type:
+        filters.append(InventoryTransaction.transaction_type == transaction_type)
+    if reference_type:
+        filters.append(InventoryTransaction.reference_type == reference_type)
+    if warehouse_id:
+        filters.append(InventoryTransaction.warehouse_id == warehouse_id)
+    if start_date:
+        filters.append(InventoryTransaction.created_at >= start_date)
+    if end_date:
+        # end_date is inclusive; compare against the next midnight so created_at stays sargable
+        filters.append(InventoryTransaction.created_at < end_date + timedelta(days=1))
+    return filters
+
+
+def list_transactions(
+    db: Session,
+    after: Optional[Tuple[datetime, UUID]] = None,
+    limit: int = 100,
+    **filters,
+) -> Tuple[List[InventoryTransaction], bool]:
+    """Newest first, one keyset page on (created_at, id); returns the page and whether more follow"""
+    conditions = _transaction_filters(**filters)
+    if after:
+        conditions.append(tuple_(InventoryTransaction.created_at, InventoryTransaction.id) < tuple_(*after))
+
+    rows = (
+        db.query(InventoryTransaction)
+        .filter(*conditions)
+        .order_by(InventoryTransaction.created_at.desc(), InventoryTransaction.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    return rows[:limit], len(rows) > limit
+
+
+def transaction_totals(db: Session, period: str = "day", level: str = "product", **filters) -> List[dict]:
+    """Inbound, outbound and net quantity per day/week/month over the same filters, at one stock level"""
+    bucket = cast(func.date_trunc(period, InventoryTransaction.created_at), Date)
+    inbound = InventoryTransaction.transaction_type == "inbound"
+    outbound = InventoryTransaction.transaction_type == "outbound"
+    rows = db.execute(
+        select(
+            bucket.label("period"),
+            func.coalesce(func.sum(InventoryTransaction.quantity).filter(inbound), 0).label("inbound"),
+            func.coalesce(func.sum(InventoryTransaction.quantity).filter(outbound), 0).label("outbound"),
+            func.count().label("transactions"),
+        )
+        .where(*_transaction_filters(level=level, **filters))
+        .group_by(bucket)
+        .order_by(bucket)
+    ).all()
+    return [
+        {
+            "period": row.period,
+            "inbound": row.inbound,
+            "outbound": row.outbound,
+            "net": row.inbound - row.outbound,
+            "transactions": row.transactions,
+        }
+        for row in rows
+    ]
@@ -0,0 +1,208 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import select, func, tuple_, literal_column
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List
+
+from app.models.inventory import Sale, SaleItem, Product, Category, Warehouse
+from app.models.customer import Customer
+
+CUBE_DIMENSIONS = ("customer", "product", "category", "warehouse", "month")
+
+
+# Revenue as booked on the line; older rows without line_total fall back to qty * price
+def _line_revenue():
+    return func.coalesce(SaleItem.line_total, SaleItem.quantity * SaleItem.unit_price)
+
+
+def _gross_revenue():
+    return SaleItem.quantity * SaleItem.unit_price
+
+
+# Cost is snapshotted on the line at sale time, so no products join is needed
+def _line_cogs():
+    return func.coalesce(SaleItem.line_cost, 0)
+
+
+def _pl_scan(start_date: date, end_date: date):
+    """sale_items of the period joined to their sale."""
+    return (
+        select()
+        .select_from(SaleItem)
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .where(Sale.sale_date >= start_date, Sale.sale_date <= end_date)
+    )
+
+
+def _margin(revenue: Decimal, profit: Decimal) -> float:
+    return round(float(profit / revenue * 100), 2) if revenue > 0 else 0
+
+
+# -------- Overall P&L --------
+def profit_loss_totals(db: Session, start_date: date, end_date: date) -> dict:
+    row = db.execute(
+        _pl_scan(start_date, end_date).add_columns(
+            func.coalesce(func.sum(_line_revenue()), 0).label("revenue"),
+            func.coalesce(func.sum(_line_cogs()), 0).label("cogs"),
+        )
+    ).one()
+
+    revenue = Decimal(row.revenue)
+    cogs = Decimal(row.cogs)
+    gross_profit = revenue - cogs
+    return {
+        "total_revenue": float(revenue),
+        "total_cogs": float(cogs),
+        "gross_profit": float(gross_profit),
+        "profit_margin": _margin(revenue, gross_profit),
+    }
+
+
+# -------- P&L per customer --------
+def profit_loss_by_customer(db: Session, start_date: date, end_date: date) -> List[dict]:
+    rows = db.execute(
+        _pl_scan(start_date, end_date)
+        .add_columns(
+            Sale.customer_name,
+            func.coalesce(func.sum(_gross_revenue()), 0).label("revenue"),
+            func.coalesce(func.sum(_line_cogs()), 0).label("cogs"),
+        )
+        .group_by(Sale.customer_name)
+    ).all()
+
+    results = []
+    for row in rows:
+        profit = row.revenue - row.cogs
+        results.append({
+            "customer_name": row.customer_name,
+            "total_revenue": float(row.revenue),
+            "total_cogs": float(row.cogs),
+            "gross_profit": float(profit),
+            "profit_margin": _margin(row.revenue, profit),
+        })
+    return results
+
+
+# -------- P&L per product --------
+def profit_loss_by_product(db: Session, start_date: date, end_date: date) -> List[dict]:
+    per_product = (
+        _pl_scan(start_date, end_date)
+        .add_columns(
+            SaleItem.product_id,
+            func.coalesce(func.sum(SaleItem.quantity), 0).label("quantity_sold"),
+            func.coalesce(func.sum(_gross_revenue()), 0).label("revenue"),
+            func.coalesce(func.sum(_line_cogs()), 0).label("cogs"),
+        )
+        .group_by(SaleItem.product_id)
+        .subquery()
+    )
+    # Names are looked up once per product, after aggregation
+    rows = db.execute(
+        select(per_product, Product.name.label("product_name"))
+        .join(Product, Product.id == per_product.c.product_id)
+    ).all()
+
+    results = []
+    for row in rows:
+        profit = row.revenue - row.cogs
+        results.append({
+            "product_id": str(row.product_id),
+            "product_name": row.product_name,
+            "quantity_sold": row.quantity_sold,
+            "revenue": row.revenue,
+            "cogs": row.cogs,
+            "profit": float(profit),
+            "margin": _margin(row.revenue, profit),
+        })
+    return results
+
+
+# -------- Profit cube --------
+def _cube_columns():
+    return {
+        "customer": Sale.customer_id,
+        "product": SaleItem.product_id,
+        "category": Product.category_id,
+        "warehouse": Sale.warehouse_id,
+        "month": func.to_char(Sale.sale_date, literal_column("'YYYY-MM'")),
+    }
+
+
+def _cube_labels(db: Session, dims: List[str], columns: Dict[str, list]) -> Dict[str, dict]:
+    """id -> name lookups for the keys present in the result, one query per dimension."""
+    sources = {
+        "customer": (Customer.id, Customer.name),
+        "product": (Product.id, Product.name),
+        "category": (Category.id, Category.name),
+        "warehouse": (Warehouse.id, Warehouse.name),
+    }
+    labels = {}
+    for dim in dims:
+        if dim not in sources:
+            continue
+        keys = {key for key in columns[dim] if key is not None}
+        id_col, name_col = sources[dim]
+        rows = db.execute(select(id_col, name_col).where(id_col.in_(keys))).all() if keys else []
+        labels[dim] = {str(row[0]): row[1] for row in rows}
+    return labels
+
+
+def profit_loss_cube(
+    db: Session,
+    start_date: date,
+    end_date: date,
+    dims: List[str],
+    grouping: str = "sets",
+) -> dict:
+    """
+    Revenue, COGS and quantity for several groupings in one GROUPING SETS statement.
+
+    grouping="sets" returns each dimension on its own plus the grand total,
+    "rollup" follows the order of dims, "cube" returns every combination. The
+    payload is columnar; grouping_id is GROUPING(dims...), a bit set per row
+    where 1 means that dimension is rolled up.
+    """
+    available = _cube_columns()
+    keys = [available[dim] for dim in dims]
+
+    if grouping == "rollup":
+        group_by = func.rollup(*keys)
+    elif grouping == "cube":
+        group_by = func.cube(*keys)
+    else:
+        group_by = func.grouping_sets(*[tuple_(key) for key in keys], tuple_())
+
+    stmt = (
+        _pl_scan(start_date, end_date)
+        .add_columns(
+            func.grouping(*keys).label("grouping_id"),
+            *[key.label(dim) for dim, key in zip(dims, keys)],
+            func.coalesce(func.sum(SaleItem.quantity), 0).label("quantity"),
+            func.coalesce(func.sum(_line_revenue()), 0).label("revenue"),
+            func.coalesce(func.sum(_line_cogs()), 0).label("cogs"),
+        )
+        .group_by(group_by)
+        .order_by(literal_column("grouping_id"), *keys)
+    )
+    if "category" in dims:
+        stmt = stmt.join(Product, Product.id == SaleItem.product_id)
+
+    names = ["grouping_id", *dims, "quantity", "revenue", "cogs"]
+    columns = {name: [] for name in names}
+    for row in db.execute(stmt):
+        for name in names:
+            value = getattr(row, name)
+            if isinstance(value, Decimal):
+                value = float(value)
+            elif value is not None and name in dims and name != "month":
+                value = str(value)
+            columns[name].append(value)
+    columns["profit"] = [round(r - c, 2) for r, c in zip(columns["revenue"], columns["cogs"])]
+
+    return {
+        "dims": dims,
+        "grouping": grouping,
+        "row_count": len(columns["grouping_id"]),
+        "columns": columns,
+        "labels": _cube_labels(db, dims, columns),
+    }
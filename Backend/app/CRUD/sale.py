@@ -1,12 +1,17 @@
 from sqlalchemy.orm import Session,selectinload,joinedload
 from uuid import UUID
-from app.models.inventory import Sale, SaleItem,WarehouseStock
+from app.models.inventory import Sale, SaleItem,WarehouseStock,Product,SalesDailyRollup,SalesRollupDirtyDay
+from app.models.customer import Customer
+from app.services.costing_service import CENT, UNIT, CostingService
+from app.CRUD.ledger import ledger_row, record_movements
 from app.schemas.inventory import SaleCreate, SaleUpdate,SaleOut
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from fastapi import HTTPException
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy import select
-from datetime import datetime
+from sqlalchemy import select, func, delete, insert, union_all
+from datetime import datetime, date
+from decimal import Decimal
+import json
 import uuid
 
 
@@ -14,6 +19,52 @@ def generate_sale_number():
     now = datetime.utcnow()
     return f"SALE-{now.strftime('%Y%m%d')}-{uuid.uuid4().hex[:6].upper()}"
     
+def lock_product_costs(db: Session, product_ids) -> dict:
+    """Lock the products being sold and return their current cost_price by id."""
+    rows = db.execute(
+        select(Product.id, Product.cost_price)
+        .where(Product.id.in_(set(product_ids)))
+        .order_by(Product.id)
+        .with_for_update()
+    ).all()
+    return {row.id: row.cost_price for row in rows}
+
+
+def line_cost(unit_cost: Optional[Decimal], quantity) -> Decimal:
+    return (unit_cost or Decimal("0")) * Decimal(str(quantity or 0))
+
+
+def sale_line_costs(db: Session, sale: Sale, items) -> List[Tuple[Optional[Decimal], Decimal]]:
+    """
+    (unit_cost, line_cost) for the new lines of an edited sale. Lines of a
+    shipped sale keep the cost of the layers they shipped out of, pooled per
+    product (a product may ship on several lines) into a weighted unit cost;
+    the rest are costed at the product's current cost_price.
+    """
+    shipped: Dict[UUID, List[Decimal]] = {}
+    if sale.shipped_at is not None:
+        for item in db.query(SaleItem).filter(SaleItem.sale_id == sale.id):
+            totals = shipped.setdefault(item.product_id, [Decimal("0"), Decimal("0")])
+            totals[0] += Decimal(str(item.quantity or 0))
+            totals[1] += item.line_cost or Decimal("0")
+    costs = lock_product_costs(db, [item.product_id for item in items if item.product_id not in shipped])
+    result = []
+    for item in items:
+        quantity = Decimal(str(item.quantity or 0))
+        if item.product_id in shipped:
+            shipped_quantity, shipped_cost = shipped[item.product_id]
+            if not shipped_quantity:
+                result.append((None, Decimal("0")))
+                continue
+            unit_cost = (shipped_cost / shipped_quantity).quantize(UNIT)
+            cost = (shipped_cost * quantity / shipped_quantity).quantize(CENT)
+        else:
+            unit_cost = costs.get(item.product_id)
+            cost = line_cost(unit_cost, quantity)
+        result.append((unit_cost, cost))
+    return result
+
+
 # -------- Create Sale --------
 def create_sale_record(db: Session, sale_data: SaleCreate) -> Sale:
     sale = Sale(
@@ -37,6 +88,7 @@ def create_sale_record(db: Session, sale_data: SaleCreate) -> Sale:
     db.add(sale)
     db.flush()  # Needed to assign sale.id for SaleItem FK
 
+    costs = lock_product_costs(db, [item.product_id for item in sale_data.items])
     for item in sale_data.items:
         sale_item = SaleItem(
             sale_id=sale.id,
@@ -45,7 +97,9 @@ def create_sale_record(db: Session, sale_data: SaleCreate) -> Sale:
             unit_price=item.unit_price,
             discount=item.discount,
             tax=item.tax,
-            line_total=item.total_price
+            line_total=item.total_price,
+            unit_cost=costs.get(item.product_id),
+            line_cost=line_cost(costs.get(item.product_id), item.quantity)
         )
         db.add(sale_item)
 
@@ -80,11 +134,13 @@ def update_sale(db: Session, sale_id: UUID, sale_data: SaleUpdate) -> Optional[S
     for field, value in sale_data.dict(exclude={"items"}).items():
         setattr(sale, field, value)
 
+    line_costs = sale_line_costs(db, sale, sale_data.items)
+
     # Delete existing sale items
     db.query(SaleItem).filter(SaleItem.sale_id == sale.id).delete()
 
     # Add new sale items
-    for item in sale_data.items:
+    for item, (unit_cost, cost) in zip(sale_data.items, line_costs):
         sale_item = SaleItem(
             sale_id=sale.id,
             product_id=item.product_id,
@@ -92,7 +148,9 @@ def update_sale(db: Session, sale_id: UUID, sale_data: SaleUpdate) -> Optional[S
             unit_price=item.unit_price,
             discount=item.discount,
             tax=item.tax,
-            line_total=item.total_price
+            line_total=item.total_price,
+            unit_cost=unit_cost,
+            line_cost=cost
         )
         db.add(sale_item)
 
@@ -141,7 +199,14 @@ async def ship_sale(sale_id: UUID, db: Session):
     if not sale.warehouse_id:
         raise HTTPException(status_code=400, detail="Warehouse not assigned for this sale")
 
+    # Mark the sale shipped before touching warehouse_stock: while the stock
+    # rollup triggers are on they count only unshipped sales as pending
+    sale.status = "shipped"
+    sale.shipped_at = datetime.utcnow()
+    db.flush()
+
     # Check and deduct stock
+    movements = []
     for item in sale.items:
         stock = db.execute(
             select(WarehouseStock)
@@ -157,12 +222,303 @@ async def ship_sale(sale_id: UUID, db: Session):
         stock.quantity -= item.quantity
         stock.reserved_quantity = max(stock.reserved_quantity - item.quantity, 0)
         db.add(stock)
+        movements.append(ledger_row(
+            item.product_id, -item.quantity, stock.quantity, "shipment", sale.id, sale.sale_number,
+            warehouse_id=sale.warehouse_id,
+        ))
+    record_movements(db, movements)
 
-    # Update sale status
-    sale.status = "shipped"
-    sale.shipped_at = datetime.utcnow()
-    db.add(sale)
+    CostingService(db).cost_sale(sale)
 
     db.commit()
     db.refresh(sale)
-    return sale
\ No newline at end of file
+    return sale
+
+
+# -------------Sales summary by customer -------------------
+
+def _sale_date_filters(start_date: Optional[date], end_date: Optional[date]) -> list:
+    filters = []
+    if start_date:
+        filters.append(Sale.sale_date >= start_date)
+    if end_date:
+        filters.append(Sale.sale_date <= end_date)
+    return filters
+
+
+def sales_summary_by_customer(
+    db: Session,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    after_customer_id: Optional[UUID] = None,
+    limit: int = 50,
+    top_n: int = 3,
+) -> Tuple[List[dict], bool]:
+    """
+    Aggregate sales per customer in SQL, one keyset page at a time.
+
+    Pages are ordered by customer_id; returns the page and whether more follow.
+    Sales without a customer_id (walk-in sales) are not attributed to anyone.
+    """
+    filters = [Sale.customer_id.isnot(None), *_sale_date_filters(start_date, end_date)]
+    page_filters = list(filters)
+    if after_customer_id:
+        page_filters.append(Sale.customer_id > after_customer_id)
+
+    rows = db.execute(
+        select(
+            Sale.customer_id,
+            func.max(Sale.customer_name).label("customer_name"),
+            func.count(Sale.id).label("total_sales"),
+            func.coalesce(func.sum(Sale.total_amount), 0).label("total_revenue"),
+            func.max(Sale.sale_date).label("last_sale_date"),
+        )
+        .where(*page_filters)
+        .group_by(Sale.customer_id)
+        .order_by(Sale.customer_id)
+        .limit(limit + 1)
+    ).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], False
+
+    customer_ids = [row.customer_id for row in rows]
+    line_revenue = func.coalesce(func.sum(SaleItem.line_total), 0)
+    ranked = (
+        select(
+            Sale.customer_id,
+            SaleItem.product_id,
+            func.coalesce(func.sum(SaleItem.quantity), 0).label("quantity"),
+            line_revenue.label("revenue"),
+            func.row_number().over(
+                partition_by=Sale.customer_id,
+                order_by=line_revenue.desc(),
+            ).label("rank"),
+        )
+        .join(SaleItem, SaleItem.sale_id == Sale.id)
+        .where(*filters, Sale.customer_id.in_(customer_ids))
+        .group_by(Sale.customer_id, SaleItem.product_id)
+        .subquery()
+    )
+    top_rows = db.execute(
+        select(ranked, Product.name.label("product_name"))
+        .outerjoin(Product, Product.id == ranked.c.product_id)
+        .where(ranked.c.rank <= top_n)
+        .order_by(ranked.c.customer_id, ranked.c.rank)
+    ).all()
+
+    top_products = {}
+    for row in top_rows:
+        top_products.setdefault(row.customer_id, []).append({
+            "product_id": row.product_id,
+            "product_name": row.product_name,
+            "quantity": float(row.quantity),
+            "revenue": float(row.revenue),
+        })
+
+    summaries = [
+        {
+            "customer_id": row.customer_id,
+            "customer_name": row.customer_name,
+            "total_sales": row.total_sales,
+            "total_revenue": float(row.total_revenue),
+            "last_sale_date": row.last_sale_date,
+            "top_products": top_products.get(row.customer_id, []),
+        }
+        for row in rows
+    ]
+    return summaries, has_more
+
+
+def iter_customer_sales_ndjson(
+    db: Session,
+    customer_ids: List[UUID],
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    chunk_size: int = 1000,
+) -> Iterator[str]:
+    """Yield one NDJSON line per sale (with its items) for the given customers."""
+    if not customer_ids:
+        return
+
+    stmt = (
+        select(
+            Sale.id,
+            Sale.customer_id,
+            Sale.customer_name,
+            Sale.sale_number,
+            Sale.sale_date,
+            Sale.status,
+            Sale.total_amount,
+            SaleItem.product_id,
+            SaleItem.quantity,
+            SaleItem.unit_price,
+            SaleItem.line_total,
+        )
+        .outerjoin(SaleItem, SaleItem.sale_id == Sale.id)
+        .where(Sale.customer_id.in_(customer_ids), *_sale_date_filters(start_date, end_date))
+        .order_by(Sale.customer_id, Sale.sale_date.desc(), Sale.id)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    current = None
+    for row in db.execute(stmt):
+        if current is None or current["sale_id"] != row.id:
+            if current is not None:
+                yield json.dumps(current, default=str) + "\n"
+            current = {
+                "sale_id": row.id,
+                "customer_id": row.customer_id,
+                "customer_name": row.customer_name,
+                "sale_number": row.sale_number,
+                "sale_date": row.sale_date,
+                "status": row.status,
+                "total_amount": row.total_amount,
+                "items": [],
+            }
+        if row.product_id is not None:
+            current["items"].append({
+                "product_id": row.product_id,
+                "quantity": row.quantity,
+                "unit_price": row.unit_price,
+                "line_total": row.line_total,
+            })
+    if current is not None:
+        yield json.dumps(current, default=str) + "\n"
+
+
+# -------------Daily sales rollup -------------------
+
+def _rebuild_rollup_days(db: Session, days) -> int:
+    """Replace the rollup rows of the days matched by days(sale_date column) from sales"""
+    db.execute(delete(SalesDailyRollup).where(days(SalesDailyRollup.sale_date)))
+    return db.execute(
+        insert(SalesDailyRollup).from_select(
+            ["sale_date", "customer_id", "warehouse_id", "sale_count", "total_sales"],
+            select(
+                Sale.sale_date,
+                Sale.customer_id,
+                Sale.warehouse_id,
+                func.count(Sale.id),
+                func.coalesce(func.sum(Sale.total_amount), 0),
+            )
+            .where(days(Sale.sale_date))
+            .group_by(Sale.sale_date, Sale.customer_id, Sale.warehouse_id),
+        )
+    ).rowcount
+
+
+def refresh_sales_daily_rollup(db: Session, start_date: date, end_date: date) -> int:
+    """Rebuild the per-day, per-customer, per-warehouse sales rollup for a closed date range."""
+    def in_range(day):
+        return day.between(start_date, end_date)
+
+    # Clear the marks first: a sale written during the rebuild marks its day again
+    db.execute(delete(SalesRollupDirtyDay).where(in_range(SalesRollupDirtyDay.sale_date)))
+    rows = _rebuild_rollup_days(db, in_range)
+    db.commit()
+    return rows
+
+
+def refresh_dirty_sales_days(db: Session) -> int:
+    """Rebuild every closed day whose sales changed since it was rolled up (backdated or missed runs)"""
+    days = db.scalars(
+        delete(SalesRollupDirtyDay)
+        .where(SalesRollupDirtyDay.sale_date < date.today())
+        .returning(SalesRollupDirtyDay.sale_date)
+    ).all()
+    if days:
+        _rebuild_rollup_days(db, lambda day: day.in_(days))
+    db.commit()
+    return len(days)
+
+
+# -------------Top customers -------------------
+
+def top_customers_summary(
+    db: Session,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    warehouse_id: Optional[UUID] = None,
+    limit: int = 5,
+) -> List[dict]:
+    """
+    Rank customers by sales with window functions in a single statement.
+
+    Percentages are taken against SUM() OVER () of every customer in range, and an
+    "Others" row carries whatever the top N don't cover. Ranges made only of closed
+    days (ending before today) read the daily rollup instead of scanning sales,
+    except for days marked dirty since their last rebuild, which are read live.
+    """
+    live = select(Sale.sale_date, Sale.customer_id, Sale.warehouse_id, Sale.total_amount.label("total_sales"))
+    if end_date is not None and end_date < date.today():
+        dirty = select(SalesRollupDirtyDay.sale_date)
+        source = union_all(
+            select(SalesDailyRollup.sale_date, SalesDailyRollup.customer_id, SalesDailyRollup.warehouse_id,
+                   SalesDailyRollup.total_sales)
+            .where(SalesDailyRollup.sale_date.not_in(dirty)),
+            live.where(Sale.sale_date.in_(dirty)),
+        ).subquery("source").c
+    else:
+        source = live.subquery("source").c
+    amount = func.sum(source.total_sales)
+
+    filters = [source.customer_id.isnot(None)]
+    if start_date:
+        filters.append(source.sale_date >= start_date)
+    if end_date:
+        filters.append(source.sale_date <= end_date)
+    if warehouse_id:
+        filters.append(source.warehouse_id == warehouse_id)
+
+    totals = func.coalesce(amount, 0)
+    ranked = (
+        select(
+            source.customer_id,
+            totals.label("total_sales"),
+            func.rank().over(order_by=totals.desc()).label("rank"),
+            func.sum(totals).over().label("grand_total"),
+            func.count().over().label("customer_count"),
+        )
+        .where(*filters)
+        .group_by(source.customer_id)
+        .subquery()
+    )
+    rows = db.execute(
+        select(ranked, Customer.name.label("customer_name"))
+        .outerjoin(Customer, Customer.id == ranked.c.customer_id)
+        .where(ranked.c.rank <= limit)
+        .order_by(ranked.c.rank, ranked.c.customer_id)
+    ).all()
+    if not rows:
+        return []
+
+    grand_total = rows[0].grand_total or 0
+
+    def share(value):
+        return round(float(value / grand_total * 100), 2) if grand_total else 0
+
+    result = [
+        {
+            "customer_id": row.customer_id,
+            "customer_name": row.customer_name,
+            "rank": row.rank,
+            "total_sales": float(row.total_sales),
+            "percentage_of_total_sales": share(row.total_sales),
+        }
+        for row in rows
+    ]
+
+    others_count = rows[0].customer_count - len(rows)
+    if others_count > 0:
+        others_total = grand_total - sum(row.total_sales for row in rows)
+        result.append({
+            "customer_id": None,
+            "customer_name": f"Others ({others_count} customers)",
+            "rank": None,
+            "total_sales": float(others_total),
+            "percentage_of_total_sales": share(others_total),
+        })
+    return result
@@ -1,9 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query,UploadFile,File
+from fastapi import APIRouter, Depends, HTTPException, status, Query,UploadFile,File,Response
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func, extract, and_, or_, desc,cast, Date,Integer,String
-from typing import Optional, List, Literal, Annotated,Dict
+from typing import Optional, List, Literal, Annotated, Dict, Union
 from uuid import UUID
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from pydantic import BaseModel, Field, ConfigDict, condecimal
 from decimal import Decimal
 from collections import defaultdict
@@ -13,7 +13,8 @@ from fastapi.responses import JSONResponse
 from pyzbar import pyzbar
 import numpy as np
 import cv2,io
-from fastapi.responses import StreamingResponse
+import json
+from fastapi.responses import StreamingResponse, FileResponse
 import barcode
 from barcode.writer import ImageWriter
 
@@ -24,20 +25,40 @@ from app.schemas.inventory import (
     ProductSupplierCreate, ProductSupplierUpdate, ProductSupplierOut,
     WarehouseBase,WarehouseCreate,WarehouseOut,WarehouseTransferCreate,WarehouseStockCreate,WarehouseStockOut,
     WarehouseTransferItemOut,WarehouseTransferOut,WarehouseTransferItemCreate,WarehouseUpdate,TransferStatus,
-    SaleBase, SaleCreate, SaleItemBase, SaleOut,SaleUpdate,GroupedSalesSummary,
-    PurchaseOrderCreate, PurchaseOrderOut, PurchaseOrderUpdate, MonthlySalesSummary,
-    PurchaseOrderItemCreate, PurchaseOrderItemOut,WarehouseStockUpdate,
-    InventoryTransactionCreate, InventoryTransactionOut,BarcodeGenerateRequest,BarcodeScanResponse
+    TransferReceive,WarehouseInTransitOut,
+    SaleBase, SaleCreate, SaleItemBase, SaleOut,SaleUpdate,GroupedSalesSummary,CustomerSalesSummary,
+    InvoiceBatchRequest, InvoiceBatchResult, PickListRequest, RebalanceRequest,
+    PurchaseOrderCreate, PurchaseOrderOut, PurchaseOrderHeaderOut, PurchaseOrderUpdate, MonthlySalesSummary,
+    PurchaseOrderItemCreate, PurchaseOrderItemOut, PurchaseOrderReceive, ReorderRunRequest,WarehouseStockUpdate,WarehouseStockBulkUpsert,WarehouseStockBulkResult,
+    InventoryTransactionCreate, InventoryTransactionOut, InventoryMovementSummary, StockTakeCreate, StockTakeResult,BarcodeGenerateRequest,BarcodeScanResponse
 )
 from app.models.inventory import (
     Product,Category,Supplier, ProductSupplier,WarehouseStock, Warehouse,WarehouseTransfer,WarehouseTransferItem, Sale, SaleItem, 
     PurchaseOrderItem, PurchaseOrder, InventoryTransaction)
 from app.models.customer import Customer
 from app.CRUD.notification import notify_admins
-from app.CRUD.sale import generate_sale_number,create_sale_record
+from app.CRUD.sale import (generate_sale_number,create_sale_record,sales_summary_by_customer,iter_customer_sales_ndjson,
+                           top_customers_summary,refresh_sales_daily_rollup,refresh_dirty_sales_days,line_cost,
+                           sale_line_costs)
 from app.CRUD.inventory import (create_warehouse_stock,get_all_warehouse_stocks,delete_warehouse_stock,update_warehouse_stock,
-                                get_warehouse_stock)
+                                get_warehouse_stock,inventory_summary,apply_stock_take,adjust_product_stock,
+                                complete_warehouse_transfer,dispatch_warehouse_transfer,receive_warehouse_transfer,
+                                warehouse_in_transit,stock_matrix_warehouses,stock_matrix_page,iter_stock_matrix_rows,
+                                bulk_upsert_warehouse_stock,receive_purchase_order,
+                                purchase_order_page)
+from app.CRUD import profit_loss as pl_crud
+from app.CRUD.ledger import ledger_row, record_movements, list_transactions, transaction_totals
 from app.api.deps import get_db
+from app.core.config import settings
+from app.services.invoice_service import InvoiceService
+from app.services.costing_service import CostingService
+from app.services.stock_history_service import StockHistoryService
+from app.services.stock_reconciliation_service import StockReconciliationService
+from app.services.picking_service import PickListService
+from app.services.rebalancing_service import RebalancingService
+from app.services.reorder_service import ReorderService
+from app.utils.helpers import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
+from app.utils.cache import cached
 
 router = APIRouter(prefix="/inventory", tags=["inventory"])
 
@@ -78,6 +99,14 @@ def list_products(
 
     return query.offset(skip).limit(limit).all()
 
+def _set_current_stock(db: Session, product: Product, value, notes: str) -> None:
+    """Set current_stock from a product payload and ledger the difference as an adjustment"""
+    previous = Decimal(str(product.current_stock or 0))
+    value = Decimal(str(value or 0))
+    product.current_stock = value
+    if value != previous:
+        record_movements(db, [ledger_row(product.id, value - previous, value, "adjustment", notes=notes)])
+
 # POST /api/products - Create a new product
 @router.post("/products", response_model=ProductOut, status_code=status.HTTP_201_CREATED)
 def create_product(product_in: ProductCreate, db: Session = Depends(get_db)):
@@ -98,10 +127,12 @@ def create_product(product_in: ProductCreate, db: Session = Depends(get_db)):
         db.refresh(category)
 
     # Create product with linked category_id
-    product_data = product_in.dict(exclude={"category_name"})
-    db_product = Product(**product_data, category_id=category.id)
+    product_data = product_in.dict(exclude={"category_name", "current_stock"})
+    db_product = Product(**product_data, category_id=category.id, current_stock=0)
 
     db.add(db_product)
+    db.flush()
+    _set_current_stock(db, db_product, product_in.current_stock, "Opening stock")
     db.commit()
     db.refresh(db_product)
     return db_product
@@ -182,14 +213,16 @@ def bulk_update_products(bulk_update: ProductBulkUpdate, db: Session = Depends(g
                 errors.append({"error": "Product ID is required", "data": product_data})
                 continue
             
-            product = db.query(Product).filter(Product.id == product_id).first()
+            product = db.query(Product).filter(Product.id == product_id).with_for_update().first()
             if not product:
                 errors.append({"error": f"Product with ID {product_id} not found", "data": product_data})
                 continue
             
             # Update fields
             for key, value in product_data.items():
-                if key != "id" and hasattr(product, key):
+                if key == "current_stock":
+                    _set_current_stock(db, product, value, "Stock set by bulk product update")
+                elif key != "id" and hasattr(product, key):
                     setattr(product, key, value)
             
             db.commit()
@@ -258,7 +291,7 @@ def get_product(id: UUID, db: Session = Depends(get_db)):
 # PUT /api/products/{id} - Update product
 @router.put("/products/{id}", response_model=ProductOut)
 def update_product(id: UUID, product_in: ProductUpdate, db: Session = Depends(get_db)):
-    product = db.query(Product).filter(Product.id == id).first()
+    product = db.query(Product).filter(Product.id == id).with_for_update().first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
@@ -273,7 +306,10 @@ def update_product(id: UUID, product_in: ProductUpdate, db: Session = Depends(ge
             raise HTTPException(status_code=400, detail="Barcode already exists")
 
     for key, value in product_in.dict(exclude_unset=True).items():
-        setattr(product, key, value)
+        if key == "current_stock":
+            _set_current_stock(db, product, value, "Stock set by product update")
+        else:
+            setattr(product, key, value)
 
     db.commit()
     db.refresh(product)
@@ -446,16 +482,35 @@ def create_transfer(transfer: WarehouseTransferCreate, db: Session = Depends(get
     db.refresh(tr)
     return tr
 
+@router.post("/warehouses/transfers/{id}/dispatch", response_model=WarehouseTransferOut)
+def dispatch_transfer(id: UUID, db: Session = Depends(get_db)):
+    return dispatch_warehouse_transfer(db, id)
+
+@router.post("/warehouses/transfers/{id}/receive", response_model=WarehouseTransferOut)
+def receive_transfer(id: UUID, data: TransferReceive, db: Session = Depends(get_db)):
+    return receive_warehouse_transfer(db, id, data)
+
 @router.post("/warehouses/transfers/{id}/complete", response_model=WarehouseTransferOut)
 def complete_transfer(id: UUID, db: Session = Depends(get_db)):
-    transfer = db.query(WarehouseTransfer).filter(WarehouseTransfer.id == id).first()
-    if not transfer:
-        raise HTTPException(404, detail="Transfer not found")
+    return complete_warehouse_transfer(db, id)
 
-    transfer.status = "completed"
-    db.commit()
-    db.refresh(transfer)
-    return transfer
+@router.post("/warehouses/rebalance", summary="Draft transfers from warehouses above max_stock_level to those below min_stock_level")
+def rebalance_warehouses(data: RebalanceRequest, db: Session = Depends(get_db)):
+    return RebalancingService(db).rebalance(
+        data.created_by, data.warehouse_ids, data.category_id, data.notes, data.dry_run, data.include_items
+    )
+
+@router.post("/warehouses/{id}/pick-list", summary="Pick waves for confirmed sales, in bin walking order")
+def create_pick_list(id: UUID, data: PickListRequest, db: Session = Depends(get_db)):
+    return PickListService(db).build(id, data.sale_ids, data.orders_per_wave)
+
+@router.get("/warehouses/{id}/in-transit", response_model=WarehouseInTransitOut)
+def get_warehouse_in_transit(
+    id: UUID,
+    include_items: bool = Query(False, description="Also list the in-transit quantity per product"),
+    db: Session = Depends(get_db)
+):
+    return warehouse_in_transit(db, id, include_items)
 # -------------------- xxxxxxxxxxxxxxxxxx --------------------
 # -------------------- Warehouse --------------------
 @router.get("/warehouses", response_model=List[WarehouseOut])
@@ -507,6 +562,10 @@ def get_warehouse(id: UUID, db: Session = Depends(get_db)):
 def create_stock(stock: WarehouseStockCreate, db: Session = Depends(get_db)):
     return create_warehouse_stock(db, stock)
 
+@router.post("/warehouse-stocks/bulk", response_model=WarehouseStockBulkResult, summary="Upsert many stock levels at once")
+def bulk_upsert_stocks(data: WarehouseStockBulkUpsert, db: Session = Depends(get_db)):
+    return bulk_upsert_warehouse_stock(db, data)
+
 @router.get("/warehouse-stocks", response_model=List[WarehouseStockOut])
 def list_stocks(
     warehouse_id: Optional[UUID] = Query(None, description="Optionally filter by warehouse ID"),
@@ -514,6 +573,37 @@ def list_stocks(
 ):
     return get_all_warehouse_stocks(db, warehouse_id=warehouse_id)
 
+@router.get("/warehouse-stocks/matrix", summary="Stock of every product across warehouses, one row per product")
+def stock_matrix(
+    response: Response,
+    warehouse_ids: Optional[List[UUID]] = Query(None, description="Columns to include; defaults to every active warehouse"),
+    measure: Literal["quantity", "available_quantity", "reserved_quantity", "in_transit_quantity"] = Query("quantity"),
+    category_id: Optional[UUID] = Query(None),
+    cursor: Optional[str] = Query(None, description=f"Cursor from the {NEXT_CURSOR_HEADER} header"),
+    limit: int = Query(500, ge=1, le=10000, description="Products per page"),
+    stream: bool = Query(False, description="Stream NDJSON: the header line, then one line per product"),
+    db: Session = Depends(get_db)
+):
+    warehouses = stock_matrix_warehouses(db, warehouse_ids)
+    if not warehouses:
+        raise HTTPException(status_code=404, detail="No warehouses found")
+    page, has_more = stock_matrix_page(db, after=decode_cursor(cursor, str, UUID), limit=limit, category_id=category_id)
+    headers = {}
+    if has_more:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(page[-1].sku, page[-1].id)
+
+    rows = iter_stock_matrix_rows(db, [w["id"] for w in warehouses], [row.id for row in page], measure) if page else iter(())
+    header = {"measure": measure, "warehouses": warehouses}
+    if stream:
+        def lines():
+            yield json.dumps(header, default=str) + "\n"
+            for row in rows:
+                yield json.dumps(row, default=str) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson", headers=headers)
+
+    response.headers.update(headers)
+    return {**header, "rows": list(rows)}
+
 @router.get("/warehouse-stocks/{stock_id}", response_model=WarehouseStockOut)
 def get_stock(stock_id: UUID, db: Session = Depends(get_db)):
     stock = get_warehouse_stock(db, stock_id)
@@ -538,38 +628,32 @@ def get_top_customers_summary(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
     warehouse_id: Optional[UUID] = Query(None),
+    limit: int = Query(5, ge=1, le=100, description="Number of top customers; the rest are grouped as Others"),
     db: Session = Depends(get_db)
 ):
-    query = db.query(
-        Sale.customer_id,
-        Customer.name.label("customer_name"),
-        func.sum(Sale.total_amount).label("total_sales")
-    ).join(Customer, Customer.id == Sale.customer_id)
-
-    if start_date:
-        query = query.filter(Sale.sale_date >= start_date)
-    if end_date:
-        query = query.filter(Sale.sale_date <= end_date)
-    if warehouse_id:
-        query = query.filter(Sale.warehouse_id == warehouse_id)
-
-    query = query.group_by(Sale.customer_id, Customer.name)
-    query = query.order_by(desc("total_sales"))
-    top_customers = query.limit(5).all()
-
-    total_all_sales = sum(row.total_sales for row in top_customers)
-
-    result = [
-        {
-            "customer_id": row.customer_id,
-            "customer_name": row.customer_name,
-            "total_sales": float(row.total_sales),
-            "percentage_of_total_sales": round((row.total_sales / total_all_sales) * 100, 2) if total_all_sales else 0
-        }
-        for row in top_customers
-    ]
+    return top_customers_summary(
+        db,
+        start_date=start_date,
+        end_date=end_date,
+        warehouse_id=warehouse_id,
+        limit=limit,
+    )
 
-    return result
+## Rebuild daily sales rollup (nightly job)
+@router.post("/sales/rollup/refresh")
+def refresh_sales_rollup(
+    start_date: Optional[date] = Query(None, description="Defaults to 7 days before end_date"),
+    end_date: Optional[date] = Query(None, description="Defaults to yesterday"),
+    db: Session = Depends(get_db)
+):
+    end_date = end_date or date.today() - timedelta(days=1)
+    start_date = start_date or end_date - timedelta(days=6)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must be on or before end_date")
+    rows = refresh_sales_daily_rollup(db, start_date, end_date)
+    # Backdated sales and days missed by earlier runs, wherever they fall
+    dirty_days = refresh_dirty_sales_days(db)
+    return {"start_date": start_date, "end_date": end_date, "rows": rows, "dirty_days": dirty_days}
 
 ##List Sales
 @router.get("/sales", response_model=List[SaleOut])
@@ -643,6 +727,7 @@ def create_sale(
 
     # Step 2: Add sale items and calculate totals
     total_amount = 0
+    movements = []
     for item in sale_in.items:
         product = db.query(Product).filter(Product.id == item.product_id).with_for_update().first()
         if not product:
@@ -655,6 +740,7 @@ def create_sale(
         # Product.current_stock -= item.quantity
         db.add(product)
         db.flush()
+        movements.append(ledger_row(product.id, -item.quantity, product.current_stock, "sale", sale.id, sale_number))
         # create_low_stock_notification(db, product)
         if product.min_stock_level is not None and product.current_stock <= product.min_stock_level:
          notify_admins(
@@ -687,11 +773,14 @@ def create_sale(
             discount=item.discount,
             tax=item.tax,
             line_total=item_total,
+            unit_cost=product.cost_price,
+            line_cost=line_cost(product.cost_price, item.quantity),
         )
         db.add(sale_item)
 
     # Step 3: Update Sale total
     sale.total_amount = (sale_in.subtotal or 0) + (sale_in.tax_amount or 0) - (sale_in.discount_amount or 0)
+    record_movements(db, movements)
 
     db.commit()
     db.refresh(sale)
@@ -898,9 +987,10 @@ def update_sale(
 
     # Handle sale items if provided
     if sale_data.items is not None:
+        line_costs = sale_line_costs(db, sale, sale_data.items)
         sale.items.clear()
         calculated_subtotal = 0
-        for item_data in sale_data.items:
+        for item_data, (unit_cost, cost) in zip(sale_data.items, line_costs):
             item_total = (
                 (item_data.unit_price or 0)
                 - (item_data.discount or 0)
@@ -916,6 +1006,8 @@ def update_sale(
                 discount=item_data.discount,
                 tax=item_data.tax,
                 line_total=item_total,
+                unit_cost=unit_cost,
+                line_cost=cost,
             )
             sale.items.append(item)
 
@@ -938,6 +1030,8 @@ def update_sale(
         + Decimal(sale.tax_amount or 0)
         - Decimal(sale.discount_amount or 0)
     )
+    # Item-only edits leave the sale row untouched; bump it so cached invoices are re-rendered
+    sale.updated_at = datetime.utcnow()
 
     db.commit()
     db.refresh(sale)
@@ -976,7 +1070,15 @@ def ship_sale(sale_id: UUID, db: Session = Depends(get_db)):
     if not sale.warehouse_id:
         raise HTTPException(status_code=400, detail="Warehouse not assigned for this sale.")
 
+    # Mark the sale shipped before touching warehouse_stock: while the stock
+    # rollup triggers are on they count only unshipped sales as pending
+    sale.status = "shipped"
+    sale.shipped_at = datetime.utcnow()
+    sale.updated_at = datetime.utcnow()
+    db.flush()
+
     # Deduct stock from warehouse
+    movements = []
     for item in sale.items:
         stock = db.query(WarehouseStock).filter(
             WarehouseStock.product_id == item.product_id,
@@ -999,12 +1101,15 @@ def ship_sale(sale_id: UUID, db: Session = Depends(get_db)):
         stock.quantity -= item.quantity
         stock.reserved_quantity = max(stock.reserved_quantity - item.quantity, 0)
         db.add(stock)
-        
-    sale.status = "shipped"
-    sale.shipped_at = datetime.utcnow()
-    sale.updated_at = datetime.utcnow()
+        movements.append(ledger_row(
+            item.product_id, -item.quantity, stock.quantity, "shipment", sale.id, sale.sale_number,
+            warehouse_id=sale.warehouse_id,
+        ))
+    record_movements(db, movements)
+
+    # Book COGS from the cost layers the goods ship out of
+    CostingService(db).cost_sale(sale)
 
-    db.add(sale)
     db.commit()
     db.refresh(sale)
     return sale 
@@ -1022,6 +1127,25 @@ def get_invoice(sale_id: UUID, db: Session = Depends(get_db)):
 
     return sale
 
+@router.get("/sales/{sale_id}/invoice.pdf", response_class=FileResponse)
+def get_invoice_pdf(sale_id: UUID, db: Session = Depends(get_db)):
+    path = InvoiceService(db).get_invoice_pdf(sale_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Sale not found")
+    return FileResponse(path, media_type="application/pdf", filename=f"invoice-{sale_id}.pdf")
+
+## Batch invoice rendering (month-end runs)
+@router.post("/sales/invoices/render", response_model=InvoiceBatchResult)
+def render_invoices(data: InvoiceBatchRequest, db: Session = Depends(get_db)):
+    service = InvoiceService(db)
+    if data.sale_ids:
+        sale_ids = data.sale_ids
+    elif data.start_date and data.end_date:
+        sale_ids = service.sale_ids_between(data.start_date, data.end_date)
+    else:
+        raise HTTPException(status_code=400, detail="Provide sale_ids or start_date and end_date")
+    return service.render_batch(sale_ids)
+
                     #############   purchase order API Calls  ########################
 
 ## Create Purchase Order
@@ -1047,15 +1171,51 @@ def create_po(data: PurchaseOrderCreate, db: Session = Depends(get_db)):
             received_qty=item.received_qty or 0
         ))
 
+    # Goods received with the order open cost layers; no warehouse is known yet
+    costing = CostingService(db)
+    for item in data.items:
+        if item.received_qty:
+            costing.receive(item.product_id, None, item.received_qty, item.unit_price, "purchase_order", po.id)
+
     db.commit()
     db.refresh(po)
     return po
 
 
+## Reorder run: draft POs for everything at or below its reorder point
+@router.post("/purchase-orders/reorder", summary="Draft one purchase order per supplier for products at or below their reorder point")
+def run_reorder(data: ReorderRunRequest, db: Session = Depends(get_db)):
+    return ReorderService(db).run(data.category_id, data.supplier_id, data.dry_run, data.include_items)
+
+
 ## List Purchase Orders
-@router.get("/purchase-orders", response_model=List[PurchaseOrderOut])
-def list_purchase_orders(db: Session = Depends(get_db)):
-    return db.query(PurchaseOrder).options(joinedload(PurchaseOrder.items)).all()
+@router.get("/purchase-orders", response_model=Union[List[PurchaseOrderOut], List[PurchaseOrderHeaderOut]])
+def list_purchase_orders(
+    response: Response,
+    supplier_id: Optional[UUID] = Query(None),
+    status: Optional[str] = Query(None, description="draft, pending, partial, received, cancelled"),
+    start_date: Optional[date] = Query(None, description="Order date from (YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="Order date to (YYYY-MM-DD), inclusive"),
+    include_items: bool = Query(True, description="Include the order lines"),
+    cursor: Optional[str] = Query(None, description=f"Cursor from the {NEXT_CURSOR_HEADER} header"),
+    limit: int = Query(100, ge=1, le=1000, description="Purchase orders per page"),
+    db: Session = Depends(get_db)
+):
+    rows, has_more = purchase_order_page(
+        db,
+        after=decode_cursor(cursor, date.fromisoformat, UUID),
+        limit=limit,
+        supplier_id=supplier_id,
+        status=status,
+        start_date=start_date,
+        end_date=end_date,
+        include_items=include_items,
+    )
+    if has_more:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].order_date.isoformat(), rows[-1].id)
+    if include_items:
+        return rows
+    return [PurchaseOrderHeaderOut.model_validate(row) for row in rows]
 
 ## Get PO by ID
 @router.get("/purchase-orders/{id}", response_model=PurchaseOrderOut)
@@ -1066,6 +1226,12 @@ def get_po(id: UUID, db: Session = Depends(get_db)):
     return po
 
 
+## Receive goods against a PO
+@router.post("/purchase-orders/{id}/receive", response_model=PurchaseOrderOut)
+def receive_po(id: UUID, data: PurchaseOrderReceive, db: Session = Depends(get_db)):
+    return receive_purchase_order(db, id, data)
+
+
 ## Update PO status
 @router.put("/purchase-orders/{id}", response_model=PurchaseOrderOut)
 def update_po(id: UUID, data: PurchaseOrderUpdate, db: Session = Depends(get_db)):
@@ -1125,53 +1291,111 @@ def adjust_inventory(
     data: StockAdjustRequest,
     db: Session = Depends(get_db)
 ):
-    product = db.query(Product).filter(Product.id == data.product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
+    return adjust_product_stock(db, data.product_id, data.transaction_type, data.quantity, data.notes)
 
-    if data.transaction_type == "inbound":
-        product.current_stock += data.quantity
-    elif data.transaction_type == "outbound":
-        if product.current_stock < data.quantity:
-            raise HTTPException(status_code=400, detail="Insufficient stock")
-        product.current_stock -= data.quantity
-    else:
-        raise HTTPException(status_code=400, detail="Invalid transaction type")
-
-    txn = InventoryTransaction(
-        product_id=product.id,
-        transaction_type=data.transaction_type,
-        quantity=data.quantity,
-        reference_type="adjustment",
-        reference_id=None,
-        notes=data.notes or f"Manual stock {data.transaction_type}"
+
+# ✅ 3. GET /inventory/transactions - All Inventory Transactions
+@router.get(
+    "/transactions",
+    response_model=Union[List[InventoryTransactionOut], List[InventoryMovementSummary]],
+    summary="Inventory transaction history",
+)
+def get_transactions(
+    response: Response,
+    product_id: Optional[UUID] = Query(None),
+    transaction_type: Optional[Literal["inbound", "outbound"]] = Query(None),
+    reference_type: Optional[str] = Query(None, description="purchase_order, sale, shipment, transfer, adjustment"),
+    warehouse_id: Optional[UUID] = Query(None),
+    start_date: Optional[date] = Query(None, description="Start date (YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="End date (YYYY-MM-DD), inclusive"),
+    level: Optional[Literal["warehouse", "product"]] = Query(None, description="product: rows moving Product.current_stock; warehouse: rows moving warehouse_stock. Totals default to warehouse when warehouse_id is given, product otherwise"),
+    group_by: Optional[Literal["day", "week", "month"]] = Query(None, description="Return inbound/outbound/net totals per period instead of rows"),
+    cursor: Optional[str] = Query(None, description=f"Cursor from the {NEXT_CURSOR_HEADER} header"),
+    limit: int = Query(100, ge=1, le=1000, description="Transactions per page"),
+    db: Session = Depends(get_db)
+):
+    filters = dict(
+        product_id=product_id,
+        transaction_type=transaction_type,
+        reference_type=reference_type,
+        warehouse_id=warehouse_id,
+        start_date=start_date,
+        end_date=end_date,
     )
+    if group_by:
+        return transaction_totals(db, period=group_by, level=level or ("warehouse" if warehouse_id else "product"), **filters)
+    filters["level"] = level
+
+    rows, has_more = list_transactions(db, after=decode_cursor(cursor, datetime.fromisoformat, UUID), limit=limit, **filters)
+    if has_more:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].created_at.isoformat(), rows[-1].id)
+    return rows
 
-    db.add(txn)
+@router.post("/stock-takes", response_model=StockTakeResult, summary="Post a cycle count / stock take in bulk")
+def post_stock_take(data: StockTakeCreate, db: Session = Depends(get_db)):
+    return apply_stock_take(db, data)
+
+
+@router.post("/stock-snapshots", summary="Snapshot per-product, per-warehouse stock (run nightly)")
+def take_stock_snapshot(
+    snapshot_date: Optional[date] = Query(None, description="Defaults to yesterday"),
+    db: Session = Depends(get_db)
+):
+    snapshot_date = snapshot_date or date.today() - timedelta(days=1)
+    rows = StockHistoryService(db).take_snapshot(snapshot_date)
     db.commit()
-    db.refresh(txn)
-    return txn
+    return {"snapshot_date": snapshot_date, "rows": rows}
 
 
-# ✅ 3. GET /inventory/transactions - All Inventory Transactions
-@router.get("/transactions", response_model=List[InventoryTransactionOut], summary="Inventory transaction history")
-def get_transactions(db: Session = Depends(get_db)):
-    return db.query(InventoryTransaction).order_by(InventoryTransaction.created_at.desc()).all()
+@router.get("/stock-as-of", summary="Stock levels at the end of a past date")
+def stock_as_of(
+    as_of: date = Query(..., alias="date", description="YYYY-MM-DD"),
+    level: Literal["warehouse", "product"] = Query("warehouse", description="warehouse: warehouse_stock rows; product: Product.current_stock"),
+    product_id: Optional[UUID] = Query(None),
+    warehouse_id: Optional[UUID] = Query(None),
+    db: Session = Depends(get_db)
+):
+    if level == "product" and warehouse_id:
+        raise HTTPException(status_code=400, detail="warehouse_id only applies to level=warehouse")
+    return StockHistoryService(db).stock_as_of(as_of, level=level, product_id=product_id, warehouse_id=warehouse_id)
+
+@router.get("/stock-reconciliation", summary="Products whose current_stock differs from warehouse stock less unshipped sales")
+def stock_reconciliation_report(
+    response: Response,
+    include_unlocated: bool = Query(False, description="Also list products that have no warehouse_stock rows"),
+    cursor: Optional[str] = Query(None, description=f"Cursor from the {NEXT_CURSOR_HEADER} header"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    service = StockReconciliationService(db)
+    after = decode_cursor(cursor, UUID)
+    rows, has_more = service.mismatches(after=after[0] if after else None, limit=limit, include_unlocated=include_unlocated)
+    if has_more:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1]["product_id"])
+    return {**service.summary(include_unlocated), "items": rows}
+
+
+@router.post("/stock-reconciliation/repair", summary="Set drifted current_stock to warehouse stock less unshipped sales, in batches")
+def repair_stock_reconciliation(
+    include_unlocated: bool = Query(False, description="Also zero products that have no warehouse_stock rows"),
+    batch_size: int = Query(1000, ge=1, le=50000),
+    db: Session = Depends(get_db)
+):
+    return StockReconciliationService(db).repair(batch_size=batch_size, include_unlocated=include_unlocated)
+
+
+@router.post("/stock-reconciliation/rollup", summary="Keep current_stock trigger-maintained from warehouse_stock")
+def set_stock_rollup(
+    enabled: bool = Query(..., description="true reconciles and enables the rollup triggers, false disables them"),
+    db: Session = Depends(get_db)
+):
+    return StockReconciliationService(db).set_rollup(enabled)
 
 # ✅ 4. GET /inventory/reports - Inventory Summary
 @router.get("/reports", summary="Inventory summary report")
 def inventory_report(db: Session = Depends(get_db)):
-    total_products = db.query(Product).count()
-    low_stock = db.query(Product).filter(Product.current_stock < Product.min_stock_level).count()
-    total_inbound = db.query(InventoryTransaction).filter(InventoryTransaction.transaction_type == "inbound").count()
-    total_outbound = db.query(InventoryTransaction).filter(InventoryTransaction.transaction_type == "outbound").count()
+    return cached("inventory:report", settings.REPORT_CACHE_TTL, lambda: inventory_summary(db))
 
-    return {
-        "total_products": total_products,
-        "low_stock_items": low_stock,
-        "total_inbound_transactions": total_inbound,
-        "total_outbound_transactions": total_outbound
-    }
 #5.GET /inventory/profit-loss - Analysis
 @router.get("/profit-loss", summary="Profit/Loss Analysis")
 def profit_loss_report(
@@ -1179,37 +1403,7 @@ def profit_loss_report(
     end_date: date = Query(..., description="End date (YYYY-MM-DD)"),
     db: Session = Depends(get_db)
 ):
-    # Fetch sale items in date range
-    items = (
-        db.query(SaleItem)
-        .join(Sale, Sale.id == SaleItem.sale_id)
-        .join(Product, Product.id == SaleItem.product_id)
-        .filter(Sale.sale_date >= start_date, Sale.sale_date <= end_date)
-        .all()
-    )
-
-    total_revenue = Decimal("0.00")
-    total_cogs = Decimal("0.00")
-
-    for item in items:
-        quantity = item.quantity or 0
-        unit_price = item.unit_price or 0
-        line_total = item.line_total or (quantity * unit_price)
-        cost_price = item.product.cost_price or Decimal("0.00")
-        cogs = cost_price * quantity
-
-        total_revenue += Decimal(line_total)
-        total_cogs += Decimal(cogs)
-
-    gross_profit = total_revenue - total_cogs
-    profit_margin = (gross_profit / total_revenue * 100) if total_revenue > 0 else 0
-
-    return {
-        "total_revenue": float(total_revenue),
-        "total_cogs": float(total_cogs),
-        "gross_profit": float(gross_profit),
-        "profit_margin": round(float(profit_margin), 2)
-    }
+    return pl_crud.profit_loss_totals(db, start_date, end_date)
 
 #############################
 @router.get("/profit-loss/customer", summary="Customer-wise Profit/Loss")
@@ -1218,38 +1412,21 @@ def profit_loss_by_customer(
     end_date: date = Query(...),
     db: Session = Depends(get_db)
 ):
-    items = (
-        db.query(SaleItem, Sale, Product)
-        .join(Sale, Sale.id == SaleItem.sale_id)
-        .join(Product, Product.id == SaleItem.product_id)
-        .filter(Sale.sale_date >= start_date, Sale.sale_date <= end_date)
-        .all()
-    )
-
-    from collections import defaultdict
-    customer_data = defaultdict(lambda: {"revenue": Decimal("0"), "cogs": Decimal("0")})
-
-    for item, sale, product in items:
-        revenue = item.quantity * item.unit_price
-        cogs = item.quantity * (product.cost_price or Decimal("0.00"))
-        customer_data[sale.customer_name]["revenue"] += revenue
-        customer_data[sale.customer_name]["cogs"] += cogs
-
-    results = []
-    for customer, values in customer_data.items():
-        revenue = values["revenue"]
-        cogs = values["cogs"]
-        profit = revenue - cogs
-        margin = (profit / revenue * 100) if revenue > 0 else 0
-        results.append({
-            "customer_name": customer,
-            "total_revenue": float(revenue),
-            "total_cogs": float(cogs),
-            "gross_profit": float(profit),
-            "profit_margin": round(float(margin), 2)
-        })
-
-    return results
+    return pl_crud.profit_loss_by_customer(db, start_date, end_date)
+############################
+@router.get("/profit-loss/cube", summary="Multi-dimensional Profit/Loss")
+def profit_loss_cube(
+    start_date: date = Query(...),
+    end_date: date = Query(...),
+    dims: str = Query(..., description=f"Comma separated, any of: {', '.join(pl_crud.CUBE_DIMENSIONS)}"),
+    grouping: Literal["sets", "rollup", "cube"] = Query("sets", description="sets: each dim alone plus total; rollup: hierarchical in dims order; cube: all combinations"),
+    db: Session = Depends(get_db)
+):
+    dim_list = [d.strip() for d in dims.split(",") if d.strip()]
+    unknown = [d for d in dim_list if d not in pl_crud.CUBE_DIMENSIONS]
+    if not dim_list or unknown or len(set(dim_list)) != len(dim_list):
+        raise HTTPException(status_code=400, detail=f"dims must be distinct values from: {', '.join(pl_crud.CUBE_DIMENSIONS)}")
+    return pl_crud.profit_loss_cube(db, start_date, end_date, dim_list, grouping=grouping)
 ############################
 @router.get("/profit-loss/product", summary="Product-wise Profit/Loss")
 def profit_loss_by_product(
@@ -1257,79 +1434,73 @@ def profit_loss_by_product(
     end_date: date = Query(...),
     db: Session = Depends(get_db)
 ):
-    items = (
-        db.query(SaleItem, Product)
-        .join(Sale, Sale.id == SaleItem.sale_id)
-        .join(Product, Product.id == SaleItem.product_id)
-        .filter(Sale.sale_date >= start_date, Sale.sale_date <= end_date)
-        .all()
-    )
+    return pl_crud.profit_loss_by_product(db, start_date, end_date)
 
-    from collections import defaultdict
-    product_data = defaultdict(lambda: {
-        "product_id": None,
-        "product_name": None,
-        "quantity_sold": Decimal("0.00"),
-        "revenue": Decimal("0.00"),
-        "cogs": Decimal("0.00")
-    })
-
-    for item, product in items:
-        qty = item.quantity or Decimal("0")
-        revenue = qty * item.unit_price
-        cogs = qty * (product.cost_price or Decimal("0.00"))
-
-        product_data[product.id]["product_id"] = str(product.id)
-        product_data[product.id]["product_name"] = product.name
-        product_data[product.id]["quantity_sold"] += qty
-        product_data[product.id]["revenue"] += revenue
-        product_data[product.id]["cogs"] += cogs
-
-    results = []
-    for data in product_data.values():
-        profit = data["revenue"] - data["cogs"]
-        margin = (profit / data["revenue"] * 100) if data["revenue"] > 0 else 0
-        results.append({
-            **data,
-            "profit": float(profit),
-            "margin": round(float(margin), 2)
-        })
-
-    return results
 
+############################
+@router.get("/sales/{sale_id}/cogs", summary="Per-line cost of goods sold for a sale")
+def get_sale_cogs(sale_id: UUID, db: Session = Depends(get_db)):
+    sale = db.query(Sale).filter(Sale.id == sale_id).first()
+    if not sale:
+        raise HTTPException(status_code=404, detail="Sale not found")
+    return [
+        {
+            "sale_item_id": item.id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "unit_cost": item.unit_cost,
+            "line_cost": item.line_cost,
+        }
+        for item in sale.items
+    ]
 
-####################### Inventory summary based on product suppliers ##################
+@router.post("/costing/rebuild", summary="Rebuild cost layers and shipped-line COGS")
+def rebuild_costing(
+    product_id: Optional[UUID] = Query(None, description="Limit the rebuild to one product"),
+    method: Optional[Literal["fifo", "average"]] = Query(None, description="Defaults to COSTING_METHOD"),
+    db: Session = Depends(get_db)
+):
+    return CostingService(db, method=method).rebuild(product_id=product_id)
 
-@router.get("/sales/summary/by-customer", summary="Sales summary grouped by customer")
-def sales_by_customer(db: Session = Depends(get_db)):
-    sales = (
-        db.query(Sale)
-        .options(joinedload(Sale.items))
-        .order_by(Sale.sale_date.desc())
-        .all()
-    )
 
-    customer_sales = []
+####################### Inventory summary based on product suppliers ##################
 
-    for sale in sales:
-        customer_sales.append({
-            "customer_name": sale.customer_name,
-            "sale_date": sale.sale_date,
-            "status": sale.status,
-            "total_amount": str(sale.total_amount),
-            "items": [
-                {
-                    "product_id": item.product_id,
-                    "quantity": str(item.quantity),
-                    "unit_price": str(item.unit_price),
-                    "line_total": str(item.line_total),
-                    "created_at": item.created_at.isoformat() if item.created_at else None
-                }
-                for item in sale.items
-            ]
-        })
+@router.get("/sales/summary/by-customer", response_model=List[CustomerSalesSummary], summary="Sales summary grouped by customer")
+def sales_by_customer(
+    response: Response,
+    start_date: Optional[date] = Query(None, description="Start date (YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="End date (YYYY-MM-DD)"),
+    cursor: Optional[str] = Query(None, description=f"Cursor from the {NEXT_CURSOR_HEADER} header"),
+    limit: int = Query(50, ge=1, le=500, description="Customers per page"),
+    include_items: bool = Query(False, description="Stream the page's sales with line items as NDJSON"),
+    db: Session = Depends(get_db)
+):
+    after = decode_cursor(cursor, UUID)
+    summaries, has_more = sales_summary_by_customer(
+        db,
+        start_date=start_date,
+        end_date=end_date,
+        after_customer_id=after[0] if after else None,
+        limit=limit,
+    )
+    headers = {}
+    if has_more:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(summaries[-1]["customer_id"])
+
+    if include_items:
+        return StreamingResponse(
+            iter_customer_sales_ndjson(
+                db,
+                [row["customer_id"] for row in summaries],
+                start_date=start_date,
+                end_date=end_date,
+            ),
+            media_type="application/x-ndjson",
+            headers=headers,
+        )
 
-    return customer_sales
+    response.headers.update(headers)
+    return summaries
 
 @router.get("/sales/summary/by-product", summary="Sales summary per product with customer")
 def sales_by_product_customer(db: Session = Depends(get_db)):
@@ -1,7 +1,7 @@
 from fastapi import APIRouter
 from typing import List
 from app.schemas.statuses import (
-    SerialStatus, SalesStatus, ShippingStatus, TransferStatus, AllStatuses
+    SerialStatus, SalesStatus, ShippingStatus, TransferStatus, PurchaseOrderStatus, AllStatuses
 )
 
 router = APIRouter(prefix="/statuses", tags=["statuses"])
@@ -13,4 +13,5 @@ async def get_all_statuses():
         sales=[status.value for status in SalesStatus],
         shipping=[status.value for status in ShippingStatus],
         transfer=[status.value for status in TransferStatus],
+        purchase_order=[status.value for status in PurchaseOrderStatus],
     )
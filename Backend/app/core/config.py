@@ -21,10 +21,18 @@ class Settings(BaseSettings):
     
     # Redis
     REDIS_URL: Optional[str] = None
+    REPORT_CACHE_TTL: int = 30  # seconds dashboard summaries are served from cache
     
     # File Upload
     MAX_FILE_SIZE: int = 10485760  # 10MB
     ALLOWED_EXTENSIONS: str = "jpg,jpeg,png,gif,pdf,doc,docx"
+
+    # Invoices
+    INVOICE_CACHE_DIR: str = "storage/invoices"
+    INVOICE_RENDER_WORKERS: int = 4
+
+    # Inventory costing: "fifo" or "average" (moving weighted average)
+    COSTING_METHOD: str = "fifo"
     
     # Environment
     ENVIRONMENT: str = "development"
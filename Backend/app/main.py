@@ -3,6 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.v1 import api_router
 from app.core.database import Base, engine
+from app.utils.helpers import NEXT_CURSOR_HEADER
 from app.models.user import User
 from app.models.session import UserSession
 from starlette.middleware.sessions import SessionMiddleware
@@ -29,6 +30,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 @app.on_event("startup")
@@ -36,6 +38,11 @@ def startup_event():
     # This ensures your SQLAlchemy before_flush event hook is registered
     import app.models.events
 
+@app.on_event("shutdown")
+def shutdown_event():
+    from app.services.invoice_service import shutdown_render_pool
+    shutdown_render_pool()
+
 # Include API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
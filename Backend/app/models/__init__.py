@@ -2,7 +2,7 @@ from .user import User
 from .session import UserSession
 from .quotation import Quotation,QuotationAttachment
 from .contractor import ContractorProfile,Project,ProjectMedia
-from .inventory import Product,Category, Supplier, ProductSupplier, Warehouse, WarehouseTransfer, WarehouseTransferItem,WarehouseStock,Sale,SaleItem,PurchaseOrder,PurchaseOrderItem,InventoryTransaction
+from .inventory import Product,Category, Supplier, ProductSupplier, Warehouse, WarehouseTransfer, WarehouseTransferItem,WarehouseStock,Sale,SaleItem,SalesDailyRollup,SalesRollupDirtyDay,PurchaseOrder,PurchaseOrderItem,InventoryTransaction,CostLayer,StockSnapshot
 from .customer import Customer
 from .price_list import PriceList, PriceListItem
 from .batch import Batch
@@ -14,7 +14,7 @@ from .notification import Notification
 
 __all__ = ["User", "UserSession", "Quotation", "QuotationAttachment", "ContractorProfile", "Project", "ProjectMedia", 
            "Product","Category", "Supplier", "ProductSupplier", "Warehouse", "WarehouseTransfer", "WarehouseTransferItem", "WarehouseStock",
-             "Sale", "SaleItem","Shipment","Notification","ProductTax","TaxGroup","PurchaseOrder", "PurchaseOrderItem","InventoryTransaction","Customer", "PriceList", "PriceListItem",
+             "Sale", "SaleItem","SalesDailyRollup","Shipment","Notification","ProductTax","TaxGroup","PurchaseOrder", "PurchaseOrderItem","InventoryTransaction","CostLayer","StockSnapshot","Customer", "PriceList", "PriceListItem",
              "Batch", "SerialNumber"]
 
   
\ No newline at end of file
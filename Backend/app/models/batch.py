@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Date, DECIMAL, TIMESTAMP, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, String, Date, DECIMAL, TIMESTAMP, ForeignKey, UniqueConstraint, Computed, Index, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 import uuid
@@ -9,6 +9,12 @@ class Batch(BaseModel):
     __tablename__ = "batches"
     __table_args__ = (
         UniqueConstraint("product_id", "warehouse_id", "batch_number", name="uq_batch_combination"),
+        # Batches that can still be picked, earliest expiry first
+        Index(
+            "ix_batches_product_id_warehouse_id_expiry_date_available",
+            "product_id", "warehouse_id", "expiry_date",
+            postgresql_where=text("available_quantity > 0"),
+        ),
     )
 
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=func.gen_random_uuid())
@@ -18,5 +24,7 @@ class Batch(BaseModel):
     manufacturing_date = Column(Date, nullable=True)
     expiry_date = Column(Date, nullable=True)
     quantity = Column(DECIMAL(10, 2), nullable=False)
-    available_quantity = Column(DECIMAL(10, 2), nullable=False)
+    reserved_quantity = Column(DECIMAL(10, 2), nullable=False, default=0, server_default="0")
+    available_quantity = Column(DECIMAL(10, 2), Computed("quantity - reserved_quantity", persisted=True))
+    unit_cost = Column(DECIMAL(10, 4), nullable=True)  # opens a cost layer when set
     created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
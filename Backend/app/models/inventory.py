@@ -1,7 +1,7 @@
 import uuid
 from uuid import uuid4
 import enum
-from sqlalchemy import Column, String,Enum, Text, DECIMAL, TIMESTAMP, func, UniqueConstraint, Integer, ForeignKey, Boolean, Date,DateTime
+from sqlalchemy import Column, String,Enum, Text, DECIMAL, TIMESTAMP, func, UniqueConstraint, Index, Integer, ForeignKey, Boolean, Date,DateTime, Computed
 from sqlalchemy.dialects.postgresql import UUID
 from typing import Optional
 from app.models.base import BaseModel
@@ -94,6 +94,7 @@ class Warehouse(BaseModel):
     phone = Column(String(20))
     email = Column(String(255))
     is_active = Column(Boolean, default=True)
+    in_transit_quantity = Column(DECIMAL(12, 2), nullable=False, default=0, server_default="0")  # Sum of its warehouse_stock.in_transit_quantity
     created_at = Column(TIMESTAMP, server_default=func.now())
 
     transfers_from = relationship("WarehouseTransfer", back_populates="from_warehouse", foreign_keys="WarehouseTransfer.from_warehouse_id")
@@ -108,6 +109,7 @@ class WarehouseTransfer(BaseModel):
     to_warehouse_id = Column(UUID(as_uuid=True), ForeignKey("warehouses.id"))
     transfer_date = Column(Date, server_default=func.current_date())
     status = Column(String(20), default="pending")  # pending, in_transit, completed
+    dispatched_at = Column(TIMESTAMP)  # Set when the source was debited
     notes = Column(Text)
     created_by = Column(UUID(as_uuid=True))
     created_at = Column(TIMESTAMP, server_default=func.now())
@@ -137,12 +139,14 @@ class WarehouseStock(BaseModel):
     warehouse_id = Column(UUID(as_uuid=True), ForeignKey("warehouses.id"), nullable=False)
     quantity = Column(DECIMAL(10, 2), nullable=False, default=0)
     reserved_quantity = Column(DECIMAL(10, 2), nullable=False, default=0)
-    available_quantity = Column(DECIMAL(10, 2), nullable=False)  # Set by trigger
+    available_quantity = Column(DECIMAL(10, 2), Computed("quantity - reserved_quantity", persisted=True))
+    in_transit_quantity = Column(DECIMAL(10, 2), nullable=False, default=0, server_default="0")  # Dispatched to this warehouse, not yet received
     bin_location = Column(String(50), nullable=True)
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     created_at = Column(DateTime, server_default=func.now())
     __table_args__ = (
         UniqueConstraint("product_id", "warehouse_id", name="uix_product_warehouse"),
+        Index("ix_warehouse_stock_product_id_available_quantity", "product_id", "available_quantity"),
     )
     product = relationship("Product", backref="warehouse_stocks")
     warehouse = relationship("Warehouse", backref="stocks")
@@ -178,12 +182,40 @@ class Sale(BaseModel):
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     shipped_at = Column(TIMESTAMP, nullable=True)
 
+    __table_args__ = (
+        Index("ix_sales_customer_id_sale_date", "customer_id", "sale_date"),
+    )
 
     items = relationship("SaleItem", back_populates="sale", cascade="all, delete")
     customer = relationship("Customer", back_populates="sales", lazy="selectin")
     shipments = relationship('Shipment', back_populates='sale', cascade='all, delete')
 
 
+class SalesDailyRollup(BaseModel):
+    __tablename__ = "sales_daily_rollups"
+
+    # Rebuilt with INSERT ... SELECT, so ids come from the database
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=func.gen_random_uuid())
+    sale_date = Column(Date, nullable=False)
+    customer_id = Column(UUID(as_uuid=True), ForeignKey("customers.id"), nullable=True)
+    warehouse_id = Column(UUID(as_uuid=True), ForeignKey("warehouses.id"), nullable=True)
+    sale_count = Column(Integer, nullable=False, default=0)
+    total_sales = Column(DECIMAL(14, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_sales_daily_rollups_sale_date_customer_id", "sale_date", "customer_id"),
+    )
+
+
+class SalesRollupDirtyDay(BaseModel):
+    __tablename__ = "sales_rollup_dirty_days"
+
+    # Days whose sales changed since the rollup was last rebuilt; a trigger on
+    # sales inserts them, refresh_sales_daily_rollup clears them
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=func.gen_random_uuid())
+    sale_date = Column(Date, nullable=False, unique=True)
+
+
 class SaleItem(BaseModel):
     __tablename__ = "sale_items"
 
@@ -194,6 +226,8 @@ class SaleItem(BaseModel):
     discount = Column(DECIMAL(5, 2), default=0.0)   
     tax = Column(DECIMAL(5, 2), default=0.0)       
     line_total = Column(DECIMAL(12, 2))             # total_price
+    unit_cost = Column(DECIMAL(10, 4))               # product cost_price at the time of sale
+    line_cost = Column(DECIMAL(12, 2))               # unit_cost * quantity
     created_at = Column(TIMESTAMP, server_default=func.now())
 
     sale = relationship("Sale", back_populates="items")
@@ -202,10 +236,15 @@ class SaleItem(BaseModel):
 
 class PurchaseOrder(BaseModel):
     __tablename__ = "purchase_orders"
+    __table_args__ = (
+        # Listing filters by supplier and pages newest first on (order_date, id)
+        Index("ix_purchase_orders_supplier_id_order_date", "supplier_id", "order_date"),
+        Index("ix_purchase_orders_order_date_id", "order_date", "id"),
+    )
 
     supplier_id = Column(UUID(as_uuid=True), ForeignKey("suppliers.id"),nullable=False) 
     po_number = Column(String(50), unique=True)
-    order_date = Column(Date, server_default=func.current_date())
+    order_date = Column(Date, nullable=False, server_default=func.current_date())
     total_amount = Column(DECIMAL(12, 2), nullable=True)
     status = Column(String(20), default="pending")
     created_at = Column(TIMESTAMP, server_default=func.now())
@@ -216,7 +255,7 @@ class PurchaseOrder(BaseModel):
 class PurchaseOrderItem(BaseModel):
     __tablename__ = "purchase_order_items"
 
-    po_id = Column(UUID(as_uuid=True), ForeignKey("purchase_orders.id"))
+    po_id = Column(UUID(as_uuid=True), ForeignKey("purchase_orders.id"), index=True)
     product_id = Column(UUID(as_uuid=True), ForeignKey("products.id"))
     quantity = Column(DECIMAL(10, 2))
     unit_price = Column(DECIMAL(10, 4))
@@ -227,14 +266,60 @@ class PurchaseOrderItem(BaseModel):
     purchase_order = relationship("PurchaseOrder", back_populates="items")
     product = relationship("Product")
 
+class CostLayer(BaseModel):
+    __tablename__ = "cost_layers"
+
+    product_id = Column(UUID(as_uuid=True), ForeignKey("products.id"), nullable=False)
+    warehouse_id = Column(UUID(as_uuid=True), ForeignKey("warehouses.id"), nullable=True)  # NULL: not yet put away
+    source_type = Column(String(30), nullable=False)  # 'purchase_order', 'batch', 'average'
+    source_id = Column(UUID(as_uuid=True))
+    received_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    unit_cost = Column(DECIMAL(10, 4), nullable=False)
+    quantity = Column(DECIMAL(10, 2), nullable=False)
+    remaining_quantity = Column(DECIMAL(10, 2), nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_cost_layers_open",
+            "product_id", "warehouse_id", "received_at",
+            postgresql_where=(remaining_quantity > 0),
+        ),
+    )
+
+
 class InventoryTransaction(BaseModel):
     __tablename__ = "inventory_transactions"
 
     product_id = Column(UUID(as_uuid=True), ForeignKey("products.id"), nullable=False)
+    warehouse_id = Column(UUID(as_uuid=True), ForeignKey("warehouses.id"), nullable=True)  # NULL: product-level stock
     transaction_type = Column(String(20), nullable=False)  # 'inbound' or 'outbound'
     quantity = Column(DECIMAL(10, 2), nullable=False)
-    reference_type = Column(String(50))  # 'purchase_order', 'sale', 'adjustment'
+    balance_after = Column(DECIMAL(12, 2))  # warehouse stock if warehouse_id is set, else Product.current_stock
+    reference_type = Column(String(50))  # 'purchase_order', 'sale', 'shipment', 'transfer', 'adjustment'
     reference_id = Column(UUID(as_uuid=True))  # ID of the PO or Sale
+    reference = Column(String(100))  # human readable document number
     notes = Column(Text)
 
     product = relationship("Product", back_populates="transactions")
+
+    __table_args__ = (
+        Index("ix_inventory_transactions_product_id_created_at", "product_id", "created_at"),
+        Index("ix_inventory_transactions_created_at_id", "created_at", "id"),
+        Index("ix_inventory_transactions_warehouse_id_created_at", "warehouse_id", "created_at"),
+        Index("ix_inventory_transactions_reference_type_created_at", "reference_type", "created_at"),
+    )
+
+
+class StockSnapshot(BaseModel):
+    __tablename__ = "stock_snapshots"
+
+    # Quantities at the end of snapshot_date, written with INSERT ... SELECT
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=func.gen_random_uuid())
+    snapshot_date = Column(Date, nullable=False)
+    product_id = Column(UUID(as_uuid=True), ForeignKey("products.id"), nullable=False)
+    warehouse_id = Column(UUID(as_uuid=True), ForeignKey("warehouses.id"), nullable=True)  # NULL: Product.current_stock
+    quantity = Column(DECIMAL(12, 2), nullable=False)
+
+    __table_args__ = (
+        Index("ix_stock_snapshots_snapshot_date_product_id", "snapshot_date", "product_id"),
+    )
@@ -13,7 +13,8 @@ class BatchBase(BaseModel):
     manufacturing_date: Optional[date] = None
     expiry_date: Optional[date] = None
     quantity: Decimal
-    available_quantity: Decimal
+    reserved_quantity: Decimal = Decimal("0")
+    unit_cost: Optional[Decimal] = None
 
 
 # Create
@@ -26,12 +27,13 @@ class BatchUpdate(BaseModel):
     manufacturing_date: Optional[date] = None
     expiry_date: Optional[date] = None
     quantity: Optional[Decimal] = None
-    available_quantity: Optional[Decimal] = None
+    reserved_quantity: Optional[Decimal] = None
 
 
 # Read
 class BatchOut(BatchBase):
     id: UUID
+    available_quantity: Decimal  # quantity - reserved_quantity, generated by the database
     created_at: datetime
 
     class Config:
@@ -177,6 +177,7 @@ class WarehouseUpdate(BaseModel):
 
 class WarehouseOut(WarehouseBase):
     id: UUID
+    in_transit_quantity: Decimal = Decimal("0")
     created_at: datetime
 
     class Config:
@@ -219,6 +220,7 @@ class WarehouseTransferOut(BaseModel):
     to_warehouse_id: UUID
     transfer_date: date
     status: TransferStatus
+    dispatched_at: Optional[datetime] = None
     notes: Optional[str]
     created_by: UUID
     created_at: datetime
@@ -226,13 +228,28 @@ class WarehouseTransferOut(BaseModel):
 
     class Config:
         model_config = ConfigDict(from_attributes=True)
+
+class TransferReceiveLine(BaseModel):
+    item_id: UUID
+    quantity: Annotated[Decimal, Field(gt=0, max_digits=10, decimal_places=2)]
+
+class TransferReceive(BaseModel):
+    lines: List[TransferReceiveLine] = Field(..., min_length=1, max_length=5000)
+
+class WarehouseInTransitItem(BaseModel):
+    product_id: UUID
+    in_transit_quantity: Decimal
+
+class WarehouseInTransitOut(BaseModel):
+    warehouse_id: UUID
+    in_transit_quantity: Decimal
+    items: Optional[List[WarehouseInTransitItem]] = None
 ############### Warehouse Stock ########################
 class WarehouseStockBase(BaseModel):
     product_id: UUID
     warehouse_id: UUID
     quantity: Annotated[Decimal, Field(max_digits=10, decimal_places=2)]
     reserved_quantity: Annotated[Decimal, Field(max_digits=10, decimal_places=2)]
-    available_quantity: Annotated[Decimal, Field(max_digits=10, decimal_places=2)]
     bin_location: Optional[str] = None
 
 class WarehouseStockCreate(WarehouseStockBase):
@@ -243,17 +260,63 @@ class WarehouseStockUpdate(WarehouseStockBase):
     warehouse_id: Optional[UUID] = None
     quantity: Optional[Decimal] = None
     reserved_quantity: Optional[Decimal] = None
-    available_quantity: Optional[Decimal] = None  # Usually computed
     bin_location: Optional[str] = None
 
 class WarehouseStockOut(WarehouseStockBase):
     id: UUID
-    available_quantity: Annotated[Decimal, Field(max_digits=10, decimal_places=2)]
+    available_quantity: Annotated[Decimal, Field(max_digits=10, decimal_places=2)]  # Generated column
+    in_transit_quantity: Decimal = Decimal("0")
     updated_at: datetime
 
     class Config:
         from_attributes = True
 
+
+class WarehouseStockUpsertRow(BaseModel):
+    product_id: UUID
+    warehouse_id: UUID
+    quantity: Annotated[Decimal, Field(ge=0, max_digits=10, decimal_places=2)]
+    reserved_quantity: Annotated[Decimal, Field(ge=0, max_digits=10, decimal_places=2)] = Decimal("0")
+    bin_location: Optional[str] = Field(None, max_length=50)  # None keeps the current bin
+
+class WarehouseStockBulkUpsert(BaseModel):
+    rows: List[WarehouseStockUpsertRow] = Field(..., min_length=1, max_length=100000)
+    reference: Optional[str] = Field(None, max_length=100)  # sync run id, recorded on ledger rows
+
+class WarehouseStockBulkResult(BaseModel):
+    inserted: int
+    updated: int
+    unchanged: int
+    chunks: int
+
+class StockTakeLine(BaseModel):
+    product_id: UUID
+    warehouse_id: UUID
+    counted_quantity: Annotated[Decimal, Field(ge=0, max_digits=10, decimal_places=2)]
+
+class StockTakeCreate(BaseModel):
+    lines: List[StockTakeLine] = Field(..., min_length=1, max_length=50000)
+    reference: Optional[str] = Field(None, max_length=100)  # count sheet / session number
+    notes: Optional[str] = None
+    dry_run: bool = False  # report variances without applying them
+
+class StockTakeVariance(BaseModel):
+    product_id: UUID
+    warehouse_id: UUID
+    system_quantity: Decimal
+    counted_quantity: Decimal
+    variance: Decimal
+    variance_value: Decimal
+
+class StockTakeResult(BaseModel):
+    stock_take_id: UUID
+    applied: bool
+    lines_counted: int
+    lines_with_variance: int
+    net_variance: Decimal
+    net_variance_value: Decimal
+    variances: List[StockTakeVariance]
+
 #############     sale Items     ##############
 # --- Enum for payment status (used in frontend dropdowns) ---
 class PaymentStatus(str, Enum):
@@ -383,6 +446,28 @@ class SaleOut(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class PickListRequest(BaseModel):
+    sale_ids: List[UUID] = Field(..., min_length=1, max_length=1000)
+    orders_per_wave: int = Field(10, ge=1, le=200)
+
+class RebalanceRequest(BaseModel):
+    created_by: UUID
+    warehouse_ids: Optional[List[UUID]] = Field(None, max_length=500)  # default: every active warehouse
+    category_id: Optional[UUID] = None
+    notes: Optional[str] = None
+    dry_run: bool = True
+    include_items: bool = False
+
+class InvoiceBatchRequest(BaseModel):
+    sale_ids: Optional[List[UUID]] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+class InvoiceBatchResult(BaseModel):
+    rendered: int
+    cached: int
+    not_found: List[UUID] = []
+
 class GroupedSalesSummary(BaseModel):
     label: str  # e.g. "2025-07-18", "2025-W29", "2025-07"
     total_sales: int
@@ -395,6 +480,22 @@ class MonthlySalesSummary(BaseModel):
     total_sales: int
     total_revenue: float
 
+
+class CustomerTopProduct(BaseModel):
+    product_id: UUID
+    product_name: Optional[str] = None
+    quantity: float
+    revenue: float
+
+
+class CustomerSalesSummary(BaseModel):
+    customer_id: UUID
+    customer_name: Optional[str] = None
+    total_sales: int
+    total_revenue: float
+    last_sale_date: Optional[date] = None
+    top_products: List[CustomerTopProduct] = []
+
           #############    Purchase order Items    ##############
 class PurchaseOrderItemBase(BaseModel):
     product_id: UUID
@@ -435,15 +536,35 @@ class PurchaseOrderUpdate(BaseModel):
     items: Optional[List[PurchaseOrderItemCreate]] = None
 
 
-class PurchaseOrderOut(PurchaseOrderBase):
+class PurchaseOrderHeaderOut(PurchaseOrderBase):
     id: UUID
     total_amount: Decimal
     created_at: datetime
-    items: List[PurchaseOrderItemOut]
 
     class Config:
         from_attributes = True
 
+class PurchaseOrderOut(PurchaseOrderHeaderOut):
+    items: List[PurchaseOrderItemOut]
+
+class ReorderRunRequest(BaseModel):
+    category_id: Optional[UUID] = None
+    supplier_id: Optional[UUID] = None
+    dry_run: bool = True
+    include_items: bool = False
+
+class PurchaseOrderReceiveLine(BaseModel):
+    item_id: UUID
+    quantity: Annotated[Decimal, Field(gt=0, max_digits=10, decimal_places=2)]
+    batch_number: Optional[str] = Field(None, max_length=100)  # creates or tops up a batch when set
+    manufacturing_date: Optional[date] = None
+    expiry_date: Optional[date] = None
+
+class PurchaseOrderReceive(BaseModel):
+    warehouse_id: UUID
+    lines: List[PurchaseOrderReceiveLine] = Field(..., min_length=1, max_length=5000)
+    notes: Optional[str] = None
+
                 ########  Inventory Transactions ############
 class InventoryTransactionCreate(BaseModel):
     product_id: UUID
@@ -457,13 +578,24 @@ class InventoryTransactionCreate(BaseModel):
 class InventoryTransactionOut(BaseModel):
     id: UUID
     product_id: UUID
+    warehouse_id: Optional[UUID] = None
     transaction_type: str
     quantity: Decimal
+    balance_after: Optional[Decimal] = None
     reference_type: Optional[str]
     reference_id: Optional[UUID]
+    reference: Optional[str] = None
     notes: Optional[str]
     created_at: datetime
 
     class Config:
         from_attributes = True
 
+
+class InventoryMovementSummary(BaseModel):
+    period: date
+    inbound: Decimal
+    outbound: Decimal
+    net: Decimal
+    transactions: int
+
@@ -25,9 +25,17 @@ class TransferStatus(str, Enum):
     in_transit = "in_transit"
     completed = "completed"
 
+class PurchaseOrderStatus(str, Enum):
+    draft = "draft"
+    pending = "pending"
+    partial = "partial"
+    received = "received"
+    cancelled = "cancelled"
+
 class AllStatuses(BaseModel):
     serial: List[SerialStatus]
     sales: List[SalesStatus]
     shipping: List[ShippingStatus]
     transfer: List[TransferStatus]
+    purchase_order: List[PurchaseOrderStatus]
 
@@ -0,0 +1,352 @@
+from collections import defaultdict, deque
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Optional
+from uuid import UUID
+
+from sqlalchemy import select, delete, insert, update, func, literal, null, and_, or_, union_all
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.batch import Batch
+from app.models.inventory import CostLayer, InventoryTransaction, Product, PurchaseOrderItem, Sale, SaleItem
+
+COSTING_METHODS = ("fifo", "average")
+
+# Open layers locked per round trip while consuming
+LAYER_FETCH_SIZE = 20
+REBUILD_CHUNK_SIZE = 5000
+
+CENT = Decimal("0.01")
+UNIT = Decimal("0.0001")
+
+
+class CostingService:
+    """
+    Cost layers per product and warehouse, fed by receipts and drained by shipments.
+
+    FIFO keeps one layer per receipt; "average" keeps a single moving-average layer
+    per product and warehouse. Layers with no warehouse (PO receipts that have not
+    been put away) are drawn on only after the shipping warehouse's own layers.
+    """
+
+    def __init__(self, db: Session, method: Optional[str] = None):
+        self.db = db
+        self.method = (method or settings.COSTING_METHOD).lower()
+        if self.method not in COSTING_METHODS:
+            raise ValueError(f"Unknown costing method: {self.method}")
+
+    # -------- Receipts --------
+    def receive(
+        self,
+        product_id: UUID,
+        warehouse_id: Optional[UUID],
+        quantity,
+        unit_cost,
+        source_type: str,
+        source_id: Optional[UUID] = None,
+        received_at: Optional[datetime] = None,
+    ) -> Optional[CostLayer]:
+        """Open a cost layer for received stock (or fold it into the moving average)"""
+        quantity = Decimal(str(quantity or 0))
+        unit_cost = Decimal(str(unit_cost or 0))
+        if quantity <= 0:
+            return None
+
+        if self.method == "average":
+            # The product row lock serialises receipts, so two cannot both find
+            # no average layer and open one each
+            self.db.query(Product.id).filter(Product.id == product_id).with_for_update().scalar()
+            layer = (
+                self.db.query(CostLayer)
+                .filter(
+                    CostLayer.product_id == product_id,
+                    CostLayer.warehouse_id == warehouse_id if warehouse_id else CostLayer.warehouse_id.is_(None),
+                    CostLayer.source_type == "average",
+                )
+                .with_for_update()
+                .first()
+            )
+            if layer:
+                on_hand = layer.remaining_quantity + quantity
+                layer.unit_cost = ((layer.remaining_quantity * layer.unit_cost + quantity * unit_cost) / on_hand).quantize(UNIT)
+                layer.quantity += quantity
+                layer.remaining_quantity = on_hand
+                return layer
+            source_type, source_id = "average", None
+
+        layer = CostLayer(
+            product_id=product_id,
+            warehouse_id=warehouse_id,
+            source_type=source_type,
+            source_id=source_id,
+            received_at=received_at or datetime.utcnow(),
+            unit_cost=unit_cost,
+            quantity=quantity,
+            remaining_quantity=quantity,
+        )
+        self.db.add(layer)
+        return layer
+
+    # -------- Issues --------
+    def consume(self, product_id: UUID, warehouse_id: Optional[UUID], quantity) -> Decimal:
+        """Drain layers oldest first and return the cost of the quantity issued"""
+        remaining = Decimal(str(quantity or 0))
+        cost = Decimal("0")
+
+        query = self.db.query(CostLayer).filter(
+            CostLayer.product_id == product_id,
+            CostLayer.remaining_quantity > 0,
+        )
+        if warehouse_id:
+            query = query.filter(or_(CostLayer.warehouse_id == warehouse_id, CostLayer.warehouse_id.is_(None)))
+        query = query.order_by(
+            CostLayer.warehouse_id.is_(None),
+            CostLayer.received_at,
+            CostLayer.id,
+        )
+
+        # A short fetch does not mean the layers ran out: rows another
+        # transaction drained while we waited on their lock drop out of it
+        while remaining > 0:
+            layers = query.limit(LAYER_FETCH_SIZE).with_for_update().all()
+            if not layers:
+                break
+            for layer in layers:
+                take = min(layer.remaining_quantity, remaining)
+                layer.remaining_quantity -= take
+                cost += take * layer.unit_cost
+                remaining -= take
+                if remaining == 0:
+                    break
+            self.db.flush()
+
+        if remaining > 0:
+            # Stock that predates the layers is costed at the product's standard cost
+            fallback = self.db.query(Product.cost_price).filter(Product.id == product_id).scalar()
+            cost += remaining * (fallback or Decimal("0"))
+        return cost
+
+    def cost_sale(self, sale: Sale) -> None:
+        """Set each line's unit_cost/line_cost from the layers it ships out of"""
+        for item in sale.items:
+            quantity = Decimal(str(item.quantity or 0))
+            total = self.consume(item.product_id, sale.warehouse_id, quantity)
+            item.line_cost = total.quantize(CENT)
+            item.unit_cost = (total / quantity).quantize(UNIT) if quantity else None
+
+    # -------- Full rebuild --------
+    def _events(self, product_id: Optional[UUID]):
+        # Warehouse receipts replay from their purchase_order ledger rows, which
+        # carry the warehouse and the time of receipt. Quantities received with no
+        # such row (entered on the order itself) stay unlocated at the line's creation.
+        prices = (
+            select(
+                PurchaseOrderItem.po_id,
+                PurchaseOrderItem.product_id,
+                (func.sum(PurchaseOrderItem.quantity * PurchaseOrderItem.unit_price)
+                 / func.nullif(func.sum(PurchaseOrderItem.quantity), 0)).label("unit_cost"),
+                func.sum(PurchaseOrderItem.received_qty).label("received_qty"),
+                func.min(PurchaseOrderItem.created_at).label("created_at"),
+            )
+            .group_by(PurchaseOrderItem.po_id, PurchaseOrderItem.product_id)
+            .subquery()
+        )
+        ledgered = (
+            select(
+                InventoryTransaction.reference_id.label("po_id"),
+                InventoryTransaction.product_id,
+                func.sum(InventoryTransaction.quantity).label("quantity"),
+            )
+            .where(InventoryTransaction.reference_type == "purchase_order", InventoryTransaction.warehouse_id.isnot(None))
+            .group_by(InventoryTransaction.reference_id, InventoryTransaction.product_id)
+            .subquery()
+        )
+        receipts = (
+            select(
+                InventoryTransaction.product_id,
+                InventoryTransaction.created_at.label("at"),
+                literal(0).label("kind"),
+                InventoryTransaction.warehouse_id,
+                InventoryTransaction.quantity,
+                prices.c.unit_cost,
+                literal("purchase_order").label("source_type"),
+                InventoryTransaction.reference_id.label("ref_id"),
+            )
+            .join(prices, and_(
+                prices.c.po_id == InventoryTransaction.reference_id,
+                prices.c.product_id == InventoryTransaction.product_id,
+            ))
+            .where(
+                InventoryTransaction.reference_type == "purchase_order",
+                InventoryTransaction.warehouse_id.isnot(None),
+                InventoryTransaction.transaction_type == "inbound",
+            )
+        )
+        # Nothing ledgered: create_po opened one layer per line at the line's price
+        unledgered_lines = (
+            select(
+                PurchaseOrderItem.product_id,
+                PurchaseOrderItem.created_at,
+                literal(0),
+                null(),
+                PurchaseOrderItem.received_qty,
+                PurchaseOrderItem.unit_price,
+                literal("purchase_order"),
+                PurchaseOrderItem.po_id,
+            )
+            .outerjoin(ledgered, and_(
+                ledgered.c.po_id == PurchaseOrderItem.po_id,
+                ledgered.c.product_id == PurchaseOrderItem.product_id,
+            ))
+            .where(ledgered.c.quantity.is_(None), PurchaseOrderItem.received_qty > 0)
+        )
+        unledgered_qty = prices.c.received_qty - ledgered.c.quantity
+        unledgered = (
+            select(
+                prices.c.product_id,
+                prices.c.created_at,
+                literal(0),
+                null(),
+                unledgered_qty,
+                prices.c.unit_cost,
+                literal("purchase_order"),
+                prices.c.po_id,
+            )
+            .join(ledgered, and_(ledgered.c.po_id == prices.c.po_id, ledgered.c.product_id == prices.c.product_id))
+            .where(unledgered_qty > 0)
+        )
+        batches = (
+            select(
+                Batch.product_id,
+                Batch.created_at,
+                literal(0),
+                Batch.warehouse_id,
+                Batch.quantity,
+                Batch.unit_cost,
+                literal("batch"),
+                Batch.id,
+            )
+            .where(Batch.unit_cost.isnot(None), Batch.quantity > 0)
+        )
+        issues = (
+            select(
+                SaleItem.product_id,
+                Sale.shipped_at,
+                literal(1),
+                Sale.warehouse_id,
+                SaleItem.quantity,
+                null(),
+                null(),
+                SaleItem.id,
+            )
+            .join(Sale, Sale.id == SaleItem.sale_id)
+            .where(Sale.shipped_at.isnot(None))
+        )
+        if product_id:
+            receipts = receipts.where(InventoryTransaction.product_id == product_id)
+            unledgered_lines = unledgered_lines.where(PurchaseOrderItem.product_id == product_id)
+            unledgered = unledgered.where(prices.c.product_id == product_id)
+            batches = batches.where(Batch.product_id == product_id)
+            issues = issues.where(SaleItem.product_id == product_id)
+
+        events = union_all(receipts, unledgered_lines, unledgered, batches, issues).subquery()
+        return self.db.execute(
+            select(events)
+            .order_by(events.c.product_id, events.c.at, events.c.kind)
+            .execution_options(yield_per=REBUILD_CHUNK_SIZE)
+        )
+
+    def rebuild(self, product_id: Optional[UUID] = None) -> Dict[str, int]:
+        """
+        Recompute all layers and shipped-line COGS by replaying receipts and
+        shipments in time order. Meant for backfills and method changes.
+        """
+        stmt = delete(CostLayer)
+        if product_id:
+            stmt = stmt.where(CostLayer.product_id == product_id)
+        self.db.execute(stmt)
+
+        costs = select(Product.id, Product.cost_price)
+        if product_id:
+            costs = costs.where(Product.id == product_id)
+        fallback_costs = dict(self.db.execute(costs).all())
+        layer_rows, line_rows = [], []
+        counts = {"products": 0, "layers": 0, "sale_lines": 0}
+
+        def flush_rows():
+            if layer_rows:
+                self.db.execute(insert(CostLayer), layer_rows)
+                counts["layers"] += len(layer_rows)
+                layer_rows.clear()
+            if line_rows:
+                self.db.execute(update(SaleItem), line_rows)
+                counts["sale_lines"] += len(line_rows)
+                line_rows.clear()
+
+        def close_product(pid, book):
+            for wh, layers in book.items():
+                for layer in layers:
+                    if layer["remaining_quantity"] > 0:
+                        layer_rows.append({"product_id": pid, "warehouse_id": wh, **layer})
+            if len(layer_rows) + len(line_rows) >= REBUILD_CHUNK_SIZE:
+                flush_rows()
+
+        current, book = None, None
+        for event in self._events(product_id):
+            if event.product_id != current:
+                if current is not None:
+                    close_product(current, book)
+                current, book = event.product_id, defaultdict(deque)
+                counts["products"] += 1
+
+            quantity = Decimal(str(event.quantity or 0))
+            if event.kind == 0:
+                self._replay_receipt(book[event.warehouse_id], event, quantity)
+                continue
+
+            cost = Decimal("0")
+            remaining = quantity
+            pools = [book[event.warehouse_id], book[None]] if event.warehouse_id else list(book.values())
+            for pool in pools:
+                for layer in pool:
+                    if remaining == 0:
+                        break
+                    take = min(layer["remaining_quantity"], remaining)
+                    layer["remaining_quantity"] -= take
+                    cost += take * layer["unit_cost"]
+                    remaining -= take
+                while pool and pool[0]["remaining_quantity"] == 0 and self.method == "fifo":
+                    pool.popleft()
+            if remaining > 0:
+                cost += remaining * (fallback_costs.get(event.product_id) or Decimal("0"))
+            line_rows.append({
+                "id": event.ref_id,
+                "line_cost": cost.quantize(CENT),
+                "unit_cost": (cost / quantity).quantize(UNIT) if quantity else None,
+            })
+
+        if current is not None:
+            close_product(current, book)
+        flush_rows()
+        self.db.commit()
+        return counts
+
+    def _replay_receipt(self, pool: deque, event, quantity: Decimal) -> None:
+        unit_cost = Decimal(str(event.unit_cost or 0))
+        if self.method == "average" and pool:
+            layer = pool[0]
+            on_hand = layer["remaining_quantity"] + quantity
+            layer["unit_cost"] = ((layer["remaining_quantity"] * layer["unit_cost"] + quantity * unit_cost) / on_hand).quantize(UNIT)
+            layer["quantity"] += quantity
+            layer["remaining_quantity"] = on_hand
+            layer["received_at"] = event.at
+            return
+        pool.append({
+            "source_type": "average" if self.method == "average" else event.source_type,
+            "source_id": None if self.method == "average" else event.ref_id,
+            "received_at": event.at,
+            "unit_cost": unit_cost,
+            "quantity": quantity,
+            "remaining_quantity": quantity,
+        })
@@ -0,0 +1,283 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from multiprocessing import get_context
+from decimal import Decimal
+from io import BytesIO
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+from uuid import UUID
+import hashlib
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+from sqlalchemy.orm import Session, selectinload
+
+from app.core.config import settings
+from app.models.inventory import Sale, SaleItem
+
+# A4 at 150 DPI
+PAGE_SIZE = (1240, 1754)
+MARGIN = 90
+LINE_HEIGHT = 30
+ROWS_PER_PAGE = 38
+
+# Invoice template: (header, payload key, x offset, right aligned)
+ITEM_COLUMNS = [
+    ("Item", "name", 0, False),
+    ("SKU", "sku", 430, False),
+    ("Qty", "quantity", 690, True),
+    ("Unit Price", "unit_price", 830, True),
+    ("Disc", "discount", 910, True),
+    ("Tax", "tax", 970, True),
+    ("Total", "line_total", 1060, True),
+]
+TOTAL_ROWS = [
+    ("Subtotal", "subtotal"),
+    ("Tax", "tax_amount"),
+    ("Discount", "discount_amount"),
+    ("Total", "total_amount"),
+    ("Paid", "paid_amount"),
+]
+
+BATCH_CHUNK_SIZE = 200
+# Superseded versions are kept this long so responses already streaming them finish
+STALE_INVOICE_GRACE_SECONDS = 600
+
+# One worker pool for the life of the process; spawning workers per request
+# costs more than rendering a small batch
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_lock = Lock()
+
+
+def render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # Spawned, not forked: the pool is created lazily from a threaded
+            # server process and must not inherit its locks or DB connections
+            _render_pool = ProcessPoolExecutor(
+                max_workers=settings.INVOICE_RENDER_WORKERS,
+                mp_context=get_context("spawn"),
+            )
+        return _render_pool
+
+
+def shutdown_render_pool() -> None:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=True)
+            _render_pool = None
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, Decimal):
+        return f"{value:,.2f}"
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def render_invoice_pdf(invoice: dict) -> bytes:
+    """Render an invoice payload (see InvoiceService.build_payload) to PDF bytes."""
+    font = ImageFont.load_default(size=20)
+    title_font = ImageFont.load_default(size=40)
+    right_edge = PAGE_SIZE[0] - MARGIN
+
+    items = invoice["items"]
+    chunks = [items[i:i + ROWS_PER_PAGE] for i in range(0, len(items), ROWS_PER_PAGE)] or [[]]
+    pages = []
+    for page_no, chunk in enumerate(chunks, start=1):
+        page = Image.new("RGB", PAGE_SIZE, "white")
+        draw = ImageDraw.Draw(page)
+        y = MARGIN
+
+        draw.text((MARGIN, y), "INVOICE", font=title_font, fill="black")
+        draw.text((right_edge, y), f"Page {page_no} of {len(chunks)}", font=font, fill="black", anchor="ra")
+        y += 70
+        for label, key in (("Invoice #", "sale_number"), ("Date", "sale_date"), ("Due", "due_date")):
+            draw.text((MARGIN, y), f"{label}: {_fmt(invoice.get(key))}", font=font, fill="black")
+            y += LINE_HEIGHT
+        y += 10
+        draw.text((MARGIN, y), f"Bill to: {invoice.get('customer_name') or ''}", font=font, fill="black")
+        y += LINE_HEIGHT
+        for line in (invoice.get("shipping_address") or "").splitlines()[:3]:
+            draw.text((MARGIN, y), line, font=font, fill="black")
+            y += LINE_HEIGHT
+        y += 20
+
+        for header, _, x, right in ITEM_COLUMNS:
+            draw.text((MARGIN + x, y), header, font=font, fill="black", anchor="ra" if right else "la")
+        y += LINE_HEIGHT
+        draw.line((MARGIN, y, right_edge, y), fill="black", width=2)
+        y += 10
+        for item in chunk:
+            for _, key, x, right in ITEM_COLUMNS:
+                text = _fmt(item.get(key))
+                if key == "name":
+                    text = text[:34]
+                draw.text((MARGIN + x, y), text, font=font, fill="black", anchor="ra" if right else "la")
+            y += LINE_HEIGHT
+
+        if page_no == len(chunks):
+            y += 10
+            draw.line((MARGIN, y, right_edge, y), fill="black", width=2)
+            y += 20
+            for label, key in TOTAL_ROWS:
+                draw.text((right_edge - 250, y), label, font=font, fill="black", anchor="ra")
+                draw.text((right_edge, y), _fmt(invoice.get(key)), font=font, fill="black", anchor="ra")
+                y += LINE_HEIGHT
+        pages.append(page)
+
+    buffer = BytesIO()
+    pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:], resolution=150.0)
+    return buffer.getvalue()
+
+
+def write_invoice_pdf(invoice: dict, path: str) -> str:
+    """Render an invoice and write it atomically."""
+    target = Path(path)
+    # A unique name per write: two threads of one worker may render the same sale
+    with tempfile.NamedTemporaryFile(dir=target.parent, suffix=".tmp", delete=False) as tmp:
+        try:
+            tmp.write(render_invoice_pdf(invoice))
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    os.replace(tmp.name, target)
+    return str(target)
+
+
+class InvoiceService:
+    def __init__(self, db: Session, cache_dir: Optional[str] = None):
+        self.db = db
+        self.cache_dir = Path(cache_dir or settings.INVOICE_CACHE_DIR)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def cache_path(self, sale: Sale) -> Path:
+        """
+        Cache key: sale id, the sale's last modification time and a digest of
+        the customer and product names printed on it, which can change
+        without touching the sale
+        """
+        version = (sale.updated_at or sale.created_at).strftime("%Y%m%d%H%M%S%f")
+        names = [sale.customer.name if sale.customer else sale.customer_name or ""]
+        names += [f"{item.product.name}\t{item.product.sku}" if item.product else "" for item in sale.items]
+        digest = hashlib.sha1("\n".join(names).encode()).hexdigest()[:12]
+        return self.cache_dir / f"{sale.id}-{version}-{digest}.pdf"
+
+    def _sales_query(self):
+        return self.db.query(Sale).options(
+            selectinload(Sale.items).selectinload(SaleItem.product),
+        )
+
+    @staticmethod
+    def build_payload(sale: Sale) -> dict:
+        """Flatten a sale into plain data the renderer (and worker processes) can use"""
+        return {
+            "sale_id": str(sale.id),
+            "sale_number": sale.sale_number,
+            "sale_date": sale.sale_date,
+            "due_date": sale.due_date,
+            "customer_name": sale.customer.name if sale.customer else sale.customer_name,
+            "shipping_address": sale.shipping_address,
+            "subtotal": sale.subtotal,
+            "tax_amount": sale.tax_amount,
+            "discount_amount": sale.discount_amount,
+            "total_amount": sale.total_amount,
+            "paid_amount": sale.paid_amount,
+            "items": [
+                {
+                    "name": item.product.name if item.product else str(item.product_id),
+                    "sku": item.product.sku if item.product else "",
+                    "quantity": item.quantity,
+                    "unit_price": item.unit_price,
+                    "discount": item.discount,
+                    "tax": item.tax,
+                    "line_total": item.line_total,
+                }
+                for item in sale.items
+            ],
+        }
+
+    def get_invoice_pdf(self, sale_id: UUID) -> Optional[Path]:
+        """Return the cached invoice PDF, rendering it only if the sale changed since"""
+        sale = self._sales_query().filter(Sale.id == sale_id).first()
+        if not sale:
+            return None
+        path = self.cache_path(sale)
+        if not path.exists():
+            write_invoice_pdf(self.build_payload(sale), str(path))
+        return path
+
+    def render_batch(self, sale_ids: Iterable[UUID]) -> Dict[str, object]:
+        """Render many invoices through the shared process pool, skipping ones already cached"""
+        sale_ids = list(dict.fromkeys(sale_ids))
+        found = set()
+        cached = 0
+        futures = []
+        pool = render_pool()
+        for start in range(0, len(sale_ids), BATCH_CHUNK_SIZE):
+            chunk = sale_ids[start:start + BATCH_CHUNK_SIZE]
+            sales = self._sales_query().filter(Sale.id.in_(chunk)).all()
+            for sale in sales:
+                found.add(sale.id)
+                path = self.cache_path(sale)
+                if path.exists():
+                    cached += 1
+                    continue
+                futures.append(pool.submit(write_invoice_pdf, self.build_payload(sale), str(path)))
+            # Only this chunk: the session belongs to the caller
+            for sale in sales:
+                for item in sale.items:
+                    self.db.expunge(item)
+                self.db.expunge(sale)
+        for future in futures:
+            future.result()
+        self.sweep_stale()
+
+        return {
+            "rendered": len(futures),
+            "cached": cached,
+            "not_found": [sale_id for sale_id in sale_ids if sale_id not in found],
+        }
+
+    def sweep_stale(self, grace_seconds: int = STALE_INVOICE_GRACE_SECONDS) -> int:
+        """
+        Delete superseded versions of cached invoices. The newest file per sale
+        is kept, as is anything written within the grace period, since a
+        download may still be streaming it.
+        """
+        newest: Dict[str, float] = {}
+        files = []
+        for path in self.cache_dir.glob("*.pdf"):
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            sale_id = path.name[:36]
+            files.append((sale_id, path, mtime))
+            newest[sale_id] = max(newest.get(sale_id, mtime), mtime)
+
+        cutoff = time.time() - grace_seconds
+        removed = 0
+        for sale_id, path, mtime in files:
+            if mtime < newest[sale_id] and mtime < cutoff:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def sale_ids_between(self, start_date: date, end_date: date) -> List[UUID]:
+        rows = (
+            self.db.query(Sale.id)
+            .filter(Sale.sale_date >= start_date, Sale.sale_date <= end_date)
+            .order_by(Sale.sale_date, Sale.id)
+            .all()
+        )
+        return [row.id for row in rows]
@@ -0,0 +1,167 @@
+import re
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import select, func, and_
+from sqlalchemy.orm import Session
+
+from app.models.inventory import Product, Sale, SaleItem, WarehouseStock
+
+BIN_SEPARATORS = re.compile(r"[-_./\s]+")
+DIGITS = re.compile(r"(\d+)")
+
+
+def _natural(segment: str) -> tuple:
+    """Sort key that orders "A2" before "A10"; numbers are tagged so they never meet strings"""
+    return tuple((0, int(part)) if part.isdigit() else (1, part.upper()) for part in DIGITS.split(segment) if part)
+
+
+def parse_bin_location(bin_location: Optional[str]) -> Optional[dict]:
+    """
+    Split "zone-aisle-shelf[-level...]" (any of - _ . / or spaces between parts)
+    into its parts. None for an empty location.
+    """
+    segments = [segment for segment in BIN_SEPARATORS.split(bin_location or "") if segment]
+    if not segments:
+        return None
+    segments += [""] * (3 - len(segments))
+    return {"zone": segments[0], "aisle": segments[1], "shelf": segments[2], "rest": segments[3:]}
+
+
+def _walk_key(bin_parts: dict) -> tuple:
+    return (_natural(bin_parts["zone"]), _natural(bin_parts["aisle"]))
+
+
+def _shelf_key(bin_parts: dict) -> tuple:
+    return (_natural(bin_parts["shelf"]), tuple(_natural(part) for part in bin_parts["rest"]))
+
+
+class PickListService:
+    """
+    Pick waves for a warehouse's confirmed sales.
+
+    Orders are grouped into waves by where their first pick is, lines of a wave
+    are merged per product and bin, and each wave is ordered as an S-shaped walk:
+    zones and aisles ascending, shelves alternating direction from one aisle
+    to the next, so every aisle is entered once per wave. Lines without a bin
+    are listed after the walk.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _lines(self, warehouse_id: UUID, sale_ids: List[UUID]):
+        """Every requested sale with its per-product quantities and the product's bin, in one query"""
+        return self.db.execute(
+            select(
+                Sale.id.label("sale_id"),
+                Sale.sale_number,
+                Sale.status,
+                Sale.warehouse_id,
+                SaleItem.product_id,
+                func.sum(SaleItem.quantity).label("quantity"),
+                Product.sku,
+                Product.name,
+                WarehouseStock.bin_location,
+                WarehouseStock.available_quantity,
+            )
+            .outerjoin(SaleItem, SaleItem.sale_id == Sale.id)
+            .outerjoin(Product, Product.id == SaleItem.product_id)
+            .outerjoin(WarehouseStock, and_(
+                WarehouseStock.product_id == SaleItem.product_id,
+                WarehouseStock.warehouse_id == warehouse_id,
+            ))
+            .where(Sale.id.in_(sale_ids))
+            .group_by(Sale.id, SaleItem.product_id, Product.id, WarehouseStock.id)
+        ).all()
+
+    def build(self, warehouse_id: UUID, sale_ids: List[UUID], orders_per_wave: int = 10) -> dict:
+        sale_ids = list(dict.fromkeys(sale_ids))
+        orders: Dict[UUID, List] = {}
+        skipped: Dict[str, List[UUID]] = {"not_found": [], "not_confirmed": [], "other_warehouse": [], "no_items": []}
+        seen = set()
+        for row in self._lines(warehouse_id, sale_ids):
+            seen.add(row.sale_id)
+            if row.warehouse_id != warehouse_id:
+                reason = "other_warehouse"
+            elif row.status != "confirmed":
+                reason = "not_confirmed"
+            elif row.product_id is None:
+                reason = "no_items"
+            else:
+                orders.setdefault(row.sale_id, []).append(row)
+                continue
+            if row.sale_id not in skipped[reason]:
+                skipped[reason].append(row.sale_id)
+        skipped["not_found"] = [sale_id for sale_id in sale_ids if sale_id not in seen]
+
+        def first_stop(lines) -> Tuple[bool, tuple, tuple]:
+            located = [parse_bin_location(line.bin_location) for line in lines]
+            located = [parts for parts in located if parts]
+            if not located:
+                return (True, (), ())
+            first = min(located, key=lambda parts: (_walk_key(parts), _shelf_key(parts)))
+            return (False, _walk_key(first), _shelf_key(first))
+
+        # Orders that start in the same part of the warehouse share a wave
+        ranked = sorted(orders.items(), key=lambda item: first_stop(item[1]))
+        taken: Dict[Tuple[UUID, Optional[str]], Decimal] = {}
+        waves = [
+            self._wave(number, ranked[start:start + orders_per_wave], taken)
+            for number, start in enumerate(range(0, len(ranked), orders_per_wave), start=1)
+        ]
+        return {
+            "warehouse_id": warehouse_id,
+            "orders": len(orders),
+            "waves": waves,
+            "skipped": {reason: ids for reason, ids in skipped.items() if ids},
+        }
+
+    @staticmethod
+    def _wave(number: int, orders: List[Tuple[UUID, List]], taken: Dict[Tuple[UUID, Optional[str]], Decimal]) -> dict:
+        """taken carries what earlier waves already pick from each (product, bin)"""
+        merged: Dict[Tuple[UUID, Optional[str]], dict] = {}
+        for sale_id, lines in orders:
+            for line in lines:
+                pick = merged.get((line.product_id, line.bin_location))
+                if pick is None:
+                    pick = merged[(line.product_id, line.bin_location)] = {
+                        "product_id": line.product_id,
+                        "sku": line.sku,
+                        "name": line.name,
+                        "bin_location": line.bin_location,
+                        "bin": parse_bin_location(line.bin_location),
+                        "quantity": Decimal("0"),
+                        "available_quantity": line.available_quantity,
+                        "orders": [],
+                    }
+                pick["quantity"] += line.quantity
+                pick["orders"].append({"sale_id": sale_id, "sale_number": line.sale_number, "quantity": line.quantity})
+
+        aisles: Dict[tuple, List[dict]] = {}
+        unlocated = []
+        for pick in merged.values():
+            if pick["bin"]:
+                aisles.setdefault(_walk_key(pick["bin"]), []).append(pick)
+            else:
+                unlocated.append(pick)
+
+        picks = []
+        for turn, aisle in enumerate(sorted(aisles)):
+            # S-shape: walk up one aisle and back down the next
+            stops = sorted(aisles[aisle], key=lambda pick: (_shelf_key(pick["bin"]), pick["sku"] or ""), reverse=turn % 2 == 1)
+            picks.extend(stops)
+        picks.extend(sorted(unlocated, key=lambda pick: pick["sku"] or ""))
+
+        for sequence, pick in enumerate(picks, start=1):
+            pick["sequence"] = sequence
+            key = (pick["product_id"], pick["bin_location"])
+            taken[key] = taken.get(key, Decimal("0")) + pick["quantity"]
+            pick["short"] = pick["available_quantity"] is None or pick["available_quantity"] < taken[key]
+        return {
+            "wave": number,
+            "sale_ids": [sale_id for sale_id, _ in orders],
+            "aisles": len(aisles),
+            "picks": picks,
+        }
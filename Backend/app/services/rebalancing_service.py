@@ -0,0 +1,299 @@
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from io import BytesIO
+from time import perf_counter
+from typing import List, Optional
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import select, func, cast, insert, literal, union_all, text, BigInteger, Numeric, String
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+from sqlalchemy.orm import Session
+
+from app.models.inventory import Product, Warehouse, WarehouseStock, WarehouseTransfer, WarehouseTransferItem
+
+POSITION_DTYPE = np.dtype([("product", "S36"), ("warehouse", "S36"), ("surplus", "i8"), ("shortage", "i8")])
+
+
+def _cents(expr):
+    return func.round(expr * 100).cast(BigInteger)
+
+
+def generate_transfer_number() -> str:
+    now = datetime.utcnow()
+    return f"RB-{now.strftime('%Y%m%d')}-{uuid.uuid4().hex[:6].upper()}"
+
+
+class RebalancingService:
+    """
+    Draft transfers that move surplus stock to warehouses running short.
+
+    Product.min_stock_level and max_stock_level apply to every warehouse that
+    carries the product (has a warehouse_stock row). A warehouse is short by
+    what it lacks to reach min_stock_level, counting stock in transit to it and
+    pending transfers in and out; it has a surplus of what it holds above
+    max_stock_level, limited to its unreserved stock. Products without a
+    max_stock_level never have a surplus.
+
+    Per product, the largest surplus is matched to the largest shortage first,
+    then the next, and so on; all products are matched at once over int64
+    cents in NumPy. The lines are grouped into one pending transfer per
+    (source, destination) pair. Pending transfers count against later plans,
+    so planning twice does not move the same stock twice.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _pending(self):
+        """Quantities on pending transfers per product: negative out of the source, positive into the destination"""
+        lines = (
+            select(WarehouseTransfer.from_warehouse_id, WarehouseTransfer.to_warehouse_id,
+                   WarehouseTransferItem.product_id, WarehouseTransferItem.quantity)
+            .join(WarehouseTransferItem, WarehouseTransferItem.transfer_id == WarehouseTransfer.id)
+            .where(WarehouseTransfer.status == "pending")
+            .subquery()
+        )
+        moves = union_all(
+            select(lines.c.product_id, lines.c.from_warehouse_id.label("warehouse_id"),
+                   (-lines.c.quantity).label("quantity")),
+            select(lines.c.product_id, lines.c.to_warehouse_id, lines.c.quantity),
+        ).subquery()
+        return (
+            select(
+                moves.c.product_id,
+                moves.c.warehouse_id,
+                func.sum(func.greatest(-moves.c.quantity, 0)).label("outgoing"),
+                func.sum(moves.c.quantity).label("net"),
+            )
+            .group_by(moves.c.product_id, moves.c.warehouse_id)
+            .subquery()
+        )
+
+    def _positions(self, warehouse_ids: Optional[List[UUID]], category_id: Optional[UUID]):
+        """One row per (product, warehouse) with a surplus or a shortage, in cents, grouped by product"""
+        pending = self._pending()
+        available = WarehouseStock.available_quantity - func.coalesce(pending.c.outgoing, 0)
+        projected = (WarehouseStock.quantity + WarehouseStock.in_transit_quantity
+                     + func.coalesce(pending.c.net, 0))
+        # LEAST ignores NULLs, so a missing max_stock_level has to become "no surplus" explicitly
+        surplus = func.greatest(func.least(available, func.coalesce(projected - Product.max_stock_level, 0)), 0)
+        shortage = func.greatest(Product.min_stock_level - projected, 0)
+        stmt = (
+            select(
+                cast(WarehouseStock.product_id, String),
+                cast(WarehouseStock.warehouse_id, String),
+                _cents(surplus),
+                _cents(shortage),
+            )
+            .join(Product, Product.id == WarehouseStock.product_id)
+            .join(Warehouse, Warehouse.id == WarehouseStock.warehouse_id)
+            .outerjoin(pending, (pending.c.product_id == WarehouseStock.product_id)
+                       & (pending.c.warehouse_id == WarehouseStock.warehouse_id))
+            # Plain comparisons, so the cents are only computed for the rows that qualify
+            .where(
+                Product.is_active.isnot(False),
+                Warehouse.is_active.isnot(False),
+                ((projected > Product.max_stock_level) & (available > 0)) | (projected < Product.min_stock_level),
+            )
+            .order_by(WarehouseStock.product_id)
+        )
+        if warehouse_ids:
+            stmt = stmt.where(WarehouseStock.warehouse_id.in_(warehouse_ids))
+        if category_id:
+            stmt = stmt.where(Product.category_id == category_id)
+        return stmt
+
+    def _fetch(self, stmt) -> np.ndarray:
+        """COPY the positions out and parse them into a structured array in one pass"""
+        compiled = stmt.compile(dialect=self.db.get_bind().dialect, compile_kwargs={"render_postcompile": True})
+        buffer = BytesIO()
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY ({cursor.mogrify(str(compiled), compiled.params).decode()}) TO STDOUT", buffer)
+        finally:
+            cursor.close()
+        if not buffer.tell():
+            return np.zeros(0, dtype=POSITION_DTYPE)
+        buffer.seek(0)
+        return np.loadtxt(buffer, dtype=POSITION_DTYPE, delimiter="\t", comments=None, ndmin=1)
+
+    # -------- Plan --------
+    def plan(self, warehouse_ids: Optional[List[UUID]] = None, category_id: Optional[UUID] = None) -> dict:
+        """Matched lines as arrays: product, source and destination index, quantity in cents"""
+        rows = self._fetch(self._positions(warehouse_ids, category_id))
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows["product"][1:] != rows["product"][:-1]
+        products = np.cumsum(first) - 1
+        located_in, warehouses = np.unique(rows["warehouse"], return_inverse=True)
+
+        giving = rows["surplus"] > 0
+        taking = (rows["shortage"] > 0) & ~giving  # only when max_stock_level is set below min_stock_level
+        product, source, destination, quantity = self._match(
+            products[giving], warehouses[giving], rows["surplus"][giving],
+            products[taking], warehouses[taking], rows["shortage"][taking],
+            int(first.sum()),
+        )
+        return {
+            "positions": len(rows),
+            "product_ids": [UUID(key.decode()) for key in rows["product"][first].tolist()],
+            "warehouse_ids": [UUID(key.decode()) for key in located_in.tolist()],
+            "lines": self._lines(product, source, destination, quantity),
+        }
+
+    @staticmethod
+    def _lines(product, source, destination, quantity) -> np.ndarray:
+        lines = np.zeros(len(quantity), dtype=[("product", "i8"), ("source", "i8"), ("destination", "i8"), ("quantity", "i8")])
+        lines["product"], lines["source"], lines["destination"], lines["quantity"] = product, source, destination, quantity
+        return lines
+
+    @staticmethod
+    def _match(s_product, s_warehouse, s_quantity, d_product, d_warehouse, d_quantity, products: int):
+        """
+        Greedy largest-first matching for every product at once.
+
+        Each product's surpluses and shortages are laid end to end on a shared
+        axis, both cut at the smaller of the two totals; every stretch between
+        two consecutive cut points is one (source, destination) line.
+        """
+        s_order = np.lexsort((-s_quantity, s_product))
+        d_order = np.lexsort((-d_quantity, d_product))
+        s_product, s_warehouse, s_quantity = s_product[s_order], s_warehouse[s_order], s_quantity[s_order]
+        d_product, d_warehouse, d_quantity = d_product[d_order], d_warehouse[d_order], d_quantity[d_order]
+
+        s_total = np.zeros(products, dtype=np.int64)
+        d_total = np.zeros(products, dtype=np.int64)
+        np.add.at(s_total, s_product, s_quantity)
+        np.add.at(d_total, d_product, d_quantity)
+        matched = np.minimum(s_total, d_total)
+        offset = np.cumsum(matched) - matched
+
+        def ends(product, quantity, total):
+            # Running total within the product, capped at what it can match, shifted onto the shared axis
+            within = np.cumsum(quantity) - (np.cumsum(total) - total)[product]
+            return offset[product] + np.minimum(within, matched[product])
+
+        s_end = ends(s_product, s_quantity, s_total)
+        d_end = ends(d_product, d_quantity, d_total)
+        cuts = np.union1d(s_end, d_end)
+        starts = np.concatenate(([0], cuts))[:-1]
+        keep = cuts > starts
+        starts, cuts = starts[keep], cuts[keep]
+
+        s_line = np.searchsorted(s_end, starts, side="right")
+        d_line = np.searchsorted(d_end, starts, side="right")
+        return s_product[s_line], s_warehouse[s_line], d_warehouse[d_line], cuts - starts
+
+    # -------- Drafts --------
+    def rebalance(
+        self,
+        created_by: UUID,
+        warehouse_ids: Optional[List[UUID]] = None,
+        category_id: Optional[UUID] = None,
+        notes: Optional[str] = None,
+        dry_run: bool = True,
+        include_items: bool = False,
+    ) -> dict:
+        """Plan, and unless dry_run, insert the pending transfers and their items in two statements"""
+        started = perf_counter()
+        if not dry_run:
+            # Keeps a concurrent plan or new transfer from reading the same pending state
+            self.db.execute(text("LOCK TABLE warehouse_transfers IN SHARE ROW EXCLUSIVE MODE"))
+        plan = self.plan(warehouse_ids, category_id)
+        lines = plan["lines"]
+        warehouses = np.asarray(plan["warehouse_ids"] or [None], dtype=object)
+        product_ids = np.asarray(plan["product_ids"] or [None], dtype=object)
+
+        pairs, transfer_of_line = np.unique(
+            np.stack([lines["source"], lines["destination"]], axis=1), axis=0, return_inverse=True
+        ) if len(lines) else (np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=np.int64))
+        transfer_of_line = transfer_of_line.reshape(-1)
+        order = np.lexsort((lines["product"], transfer_of_line))
+        lines, transfer_of_line = lines[order], transfer_of_line[order]
+        bounds = np.searchsorted(transfer_of_line, np.arange(len(pairs) + 1))
+        totals = np.add.reduceat(lines["quantity"], bounds[:-1]) if len(pairs) else np.zeros(0, dtype=np.int64)
+
+        transfers = []
+        for index, (source, destination) in enumerate(pairs.tolist()):
+            transfer = {
+                "id": uuid.uuid4(),
+                "transfer_number": generate_transfer_number(),
+                "from_warehouse_id": warehouses[source],
+                "to_warehouse_id": warehouses[destination],
+                "lines": int(bounds[index + 1] - bounds[index]),
+                "quantity": Decimal(int(totals[index])).scaleb(-2),
+            }
+            if include_items:
+                chunk = lines[bounds[index]:bounds[index + 1]]
+                transfer["items"] = [
+                    {"product_id": product_id, "quantity": Decimal(quantity).scaleb(-2)}
+                    for product_id, quantity in zip(product_ids[chunk["product"]].tolist(), chunk["quantity"].tolist())
+                ]
+            transfers.append(transfer)
+
+        if not dry_run and transfers:
+            self.db.execute(
+                insert(WarehouseTransfer),
+                [
+                    {
+                        "id": transfer["id"],
+                        "transfer_number": transfer["transfer_number"],
+                        "from_warehouse_id": transfer["from_warehouse_id"],
+                        "to_warehouse_id": transfer["to_warehouse_id"],
+                        "transfer_date": date.today(),
+                        "status": "pending",
+                        "notes": notes or "Rebalancing plan",
+                        "created_by": created_by,
+                    }
+                    for transfer in transfers
+                ],
+            )
+            transfer_ids = np.asarray([transfer["id"] for transfer in transfers], dtype=object)
+            items = func.unnest(
+                cast(transfer_ids[transfer_of_line].tolist(), ARRAY(PG_UUID(as_uuid=True))),
+                cast(product_ids[lines["product"]].tolist(), ARRAY(PG_UUID(as_uuid=True))),
+                cast(lines["quantity"].tolist(), ARRAY(BigInteger)),
+            ).table_valued("transfer_id", "product_id", "quantity").render_derived("items")
+            self.db.execute(
+                insert(WarehouseTransferItem).from_select(
+                    ["id", "transfer_id", "product_id", "quantity", "received_quantity"],
+                    select(
+                        func.gen_random_uuid(), items.c.transfer_id, items.c.product_id,
+                        cast(items.c.quantity, Numeric(10, 2)) / 100, literal(0),
+                    ),
+                )
+            )
+            self.db.commit()
+
+        return {
+            "dry_run": dry_run,
+            "positions": plan["positions"],
+            "products": len(np.unique(lines["product"])),
+            "lines": len(lines),
+            "quantity": Decimal(int(lines["quantity"].sum())).scaleb(-2),
+            "transfers": transfers,
+            "seconds": round(perf_counter() - started, 3),
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from app.core.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Plan transfers from warehouses above max_stock_level to those below min_stock_level")
+    parser.add_argument("--created-by", type=UUID, help="user recorded on the transfers; required with --commit")
+    parser.add_argument("--warehouse", type=UUID, action="append", dest="warehouse_ids")
+    parser.add_argument("--commit", action="store_true", help="insert the pending transfers (default: dry run)")
+    args = parser.parse_args()
+    if args.commit and not args.created_by:
+        parser.error("--commit needs --created-by")
+
+    session = SessionLocal()
+    try:
+        result = RebalancingService(session).rebalance(args.created_by, args.warehouse_ids, dry_run=not args.commit)
+        print(json.dumps(result, indent=2, default=str))
+    finally:
+        session.close()
@@ -0,0 +1,214 @@
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from time import perf_counter
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import select, func, case, cast, insert, literal, text, DECIMAL
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+from sqlalchemy.orm import Session
+
+from app.models.inventory import Product, ProductSupplier, PurchaseOrder, PurchaseOrderItem
+
+# Orders whose outstanding quantities are already on their way
+OPEN_PO_STATUSES = ("draft", "pending", "partial")
+CENT = Decimal("0.01")
+
+
+def generate_reorder_number() -> str:
+    now = datetime.utcnow()
+    return f"RO-{now.strftime('%Y%m%d')}-{uuid.uuid4().hex[:6].upper()}"
+
+
+class ReorderService:
+    """
+    Draft purchase orders for every product at or below its reorder point.
+
+    Stock position is Product.current_stock plus what open orders (draft,
+    pending or partial) still have to deliver, so a second run does not order
+    the same shortfall again. Each product is ordered up to max_stock_level
+    (or back to its reorder point when it has none), rounded up to a multiple
+    of min_order_qty, from its preferred supplier; without one, the cheapest, then the fastest.
+    Lines are grouped into one draft order per supplier.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _suggestions(self, category_id: Optional[UUID], supplier_id: Optional[UUID]):
+        on_order = (
+            select(
+                PurchaseOrderItem.product_id,
+                func.sum(func.greatest(PurchaseOrderItem.quantity - func.coalesce(PurchaseOrderItem.received_qty, 0), 0))
+                .label("quantity"),
+            )
+            .join(PurchaseOrder, PurchaseOrder.id == PurchaseOrderItem.po_id)
+            .where(PurchaseOrder.status.in_(OPEN_PO_STATUSES))
+            .group_by(PurchaseOrderItem.product_id)
+            .subquery()
+        )
+        # One supplier per product
+        chosen = (
+            select(ProductSupplier)
+            .distinct(ProductSupplier.product_id)
+            .order_by(
+                ProductSupplier.product_id,
+                ProductSupplier.is_preferred.desc().nulls_last(),
+                ProductSupplier.supplier_price.asc().nulls_last(),
+                ProductSupplier.lead_time_days.asc().nulls_last(),
+                ProductSupplier.supplier_id,
+            )
+            .subquery()
+        )
+        position = func.coalesce(Product.current_stock, 0) + func.coalesce(on_order.c.quantity, 0)
+        shortfall = func.greatest(func.coalesce(Product.max_stock_level, Product.reorder_point) - position, 0)
+        # Suppliers sell in multiples of min_order_qty
+        quantity = case(
+            (chosen.c.min_order_qty > 0, func.ceil(shortfall / chosen.c.min_order_qty) * chosen.c.min_order_qty),
+            else_=shortfall,
+        )
+        unit_price = func.coalesce(chosen.c.supplier_price, Product.cost_price, 0)
+        stmt = (
+            select(
+                Product.id.label("product_id"),
+                Product.sku,
+                Product.name,
+                func.coalesce(Product.current_stock, 0).label("current_stock"),
+                func.coalesce(on_order.c.quantity, 0).label("on_order"),
+                Product.reorder_point,
+                chosen.c.supplier_id,
+                chosen.c.lead_time_days,
+                quantity.label("quantity"),
+                unit_price.label("unit_price"),
+                func.round(quantity * unit_price, 2).label("line_total"),
+            )
+            .outerjoin(on_order, on_order.c.product_id == Product.id)
+            .outerjoin(chosen, chosen.c.product_id == Product.id)
+            .where(
+                Product.is_active.isnot(False),
+                Product.reorder_point > 0,
+                position <= Product.reorder_point,
+            )
+            .order_by(chosen.c.supplier_id, Product.sku)
+        )
+        if category_id:
+            stmt = stmt.where(Product.category_id == category_id)
+        if supplier_id:
+            stmt = stmt.where(chosen.c.supplier_id == supplier_id)
+        return stmt
+
+    def run(
+        self,
+        category_id: Optional[UUID] = None,
+        supplier_id: Optional[UUID] = None,
+        dry_run: bool = True,
+        include_items: bool = False,
+    ) -> dict:
+        """Find what to reorder in one query; unless dry_run, insert the drafts in two statements"""
+        started = perf_counter()
+        if not dry_run:
+            # Two runs at once would both see the other's orders as missing
+            self.db.execute(text("LOCK TABLE purchase_orders IN SHARE ROW EXCLUSIVE MODE"))
+        rows = self.db.execute(self._suggestions(category_id, supplier_id)).all()
+
+        orders: Dict[UUID, dict] = {}
+        no_supplier: List[UUID] = []
+        for row in rows:
+            if row.supplier_id is None:
+                no_supplier.append(row.product_id)
+                continue
+            if row.quantity <= 0:
+                continue
+            order = orders.get(row.supplier_id)
+            if order is None:
+                order = orders[row.supplier_id] = {
+                    "id": uuid.uuid4(),
+                    "po_number": generate_reorder_number(),
+                    "supplier_id": row.supplier_id,
+                    "lines": 0,
+                    "total_amount": Decimal("0"),
+                    "lead_time_days": row.lead_time_days,
+                    "items": [],
+                }
+            order["lines"] += 1
+            order["total_amount"] += row.line_total
+            if row.lead_time_days is not None:
+                order["lead_time_days"] = max(order["lead_time_days"] or 0, row.lead_time_days)
+            order["items"].append(row)
+
+        if not dry_run and orders:
+            self.db.execute(
+                insert(PurchaseOrder),
+                [
+                    {
+                        "id": order["id"],
+                        "supplier_id": order["supplier_id"],
+                        "po_number": order["po_number"],
+                        "order_date": date.today(),
+                        "total_amount": order["total_amount"].quantize(CENT),
+                        "status": "draft",
+                    }
+                    for order in orders.values()
+                ],
+            )
+            lines = [(order["id"], item) for order in orders.values() for item in order["items"]]
+            items = func.unnest(
+                cast([po_id for po_id, _ in lines], ARRAY(PG_UUID(as_uuid=True))),
+                cast([item.product_id for _, item in lines], ARRAY(PG_UUID(as_uuid=True))),
+                cast([item.quantity for _, item in lines], ARRAY(DECIMAL(10, 2))),
+                cast([item.unit_price for _, item in lines], ARRAY(DECIMAL(10, 4))),
+                cast([item.line_total for _, item in lines], ARRAY(DECIMAL(12, 2))),
+            ).table_valued("po_id", "product_id", "quantity", "unit_price", "line_total").render_derived("items")
+            self.db.execute(
+                insert(PurchaseOrderItem).from_select(
+                    ["id", "po_id", "product_id", "quantity", "unit_price", "line_total", "received_qty"],
+                    select(
+                        func.gen_random_uuid(), items.c.po_id, items.c.product_id, items.c.quantity,
+                        items.c.unit_price, items.c.line_total, literal(0),
+                    ),
+                )
+            )
+            self.db.commit()
+
+        for order in orders.values():
+            items = order.pop("items")
+            if include_items:
+                order["items"] = [
+                    {
+                        "product_id": item.product_id,
+                        "sku": item.sku,
+                        "current_stock": item.current_stock,
+                        "on_order": item.on_order,
+                        "reorder_point": item.reorder_point,
+                        "quantity": item.quantity,
+                        "unit_price": item.unit_price,
+                        "line_total": item.line_total,
+                    }
+                    for item in items
+                ]
+        return {
+            "dry_run": dry_run,
+            "products": sum(order["lines"] for order in orders.values()),
+            "orders": list(orders.values()),
+            "no_supplier": no_supplier,
+            "seconds": round(perf_counter() - started, 3),
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from app.core.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Draft purchase orders for products at or below their reorder point")
+    parser.add_argument("--commit", action="store_true", help="insert the draft orders (default: dry run)")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        result = ReorderService(session).run(dry_run=not args.commit)
+        print(json.dumps({**result, "no_supplier": len(result["no_supplier"])}, indent=2, default=str))
+    finally:
+        session.close()
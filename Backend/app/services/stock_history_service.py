@@ -0,0 +1,259 @@
+from datetime import date, timedelta
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import select, func, case, delete, insert, literal, null, union_all, update, text, Date
+from sqlalchemy.orm import Session
+
+from app.models.inventory import InventoryTransaction, Product, StockSnapshot, WarehouseStock
+
+STOCK_LEVELS = ("warehouse", "product")
+
+
+def _signed_quantity():
+    return case(
+        (InventoryTransaction.transaction_type == "inbound", InventoryTransaction.quantity),
+        else_=-InventoryTransaction.quantity,
+    )
+
+
+class StockHistoryService:
+    """
+    Stock as of a past date: the nearest snapshot (or the live tables) plus or
+    minus the ledger movements between it and that date, summed in SQL.
+
+    "warehouse" level is warehouse_stock per product and warehouse, "product"
+    level is Product.current_stock; ledger rows carry the same split through
+    warehouse_id. A date means the end of that day.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    # -------- Sources --------
+    def _live(self, level: str, product_id: Optional[UUID], warehouse_id: Optional[UUID]):
+        if level == "product":
+            stmt = select(Product.id.label("product_id"), null().label("warehouse_id"), Product.current_stock.label("quantity"))
+            return stmt.where(Product.id == product_id) if product_id else stmt
+        stmt = select(WarehouseStock.product_id, WarehouseStock.warehouse_id, WarehouseStock.quantity)
+        if product_id:
+            stmt = stmt.where(WarehouseStock.product_id == product_id)
+        if warehouse_id:
+            stmt = stmt.where(WarehouseStock.warehouse_id == warehouse_id)
+        return stmt
+
+    def _snapshot(self, snapshot_date: date, level: str, product_id: Optional[UUID], warehouse_id: Optional[UUID]):
+        stmt = (
+            select(StockSnapshot.product_id, StockSnapshot.warehouse_id, StockSnapshot.quantity)
+            .where(StockSnapshot.snapshot_date == snapshot_date, *self._level_filters(StockSnapshot, level))
+        )
+        if product_id:
+            stmt = stmt.where(StockSnapshot.product_id == product_id)
+        if warehouse_id:
+            stmt = stmt.where(StockSnapshot.warehouse_id == warehouse_id)
+        return stmt
+
+    def _movements(
+        self,
+        after: Optional[date],
+        through: Optional[date],
+        sign: int,
+        level: str,
+        product_id: Optional[UUID],
+        warehouse_id: Optional[UUID],
+    ):
+        """Net movements after the end of `after` up to the end of `through`, times sign"""
+        stmt = select(
+            InventoryTransaction.product_id,
+            InventoryTransaction.warehouse_id,
+            (sign * func.sum(_signed_quantity())).label("quantity"),
+        ).where(*self._level_filters(InventoryTransaction, level))
+        if after:
+            stmt = stmt.where(InventoryTransaction.created_at >= after + timedelta(days=1))
+        if through:
+            stmt = stmt.where(InventoryTransaction.created_at < through + timedelta(days=1))
+        if product_id:
+            stmt = stmt.where(InventoryTransaction.product_id == product_id)
+        if warehouse_id:
+            stmt = stmt.where(InventoryTransaction.warehouse_id == warehouse_id)
+        return stmt.group_by(InventoryTransaction.product_id, InventoryTransaction.warehouse_id)
+
+    @staticmethod
+    def _level_filters(model, level: str) -> list:
+        return [model.warehouse_id.is_(None) if level == "product" else model.warehouse_id.isnot(None)]
+
+    @staticmethod
+    def _combine(*parts):
+        rows = union_all(*parts).subquery()
+        total = func.sum(rows.c.quantity)
+        return (
+            select(rows.c.product_id, rows.c.warehouse_id, total.label("quantity"))
+            .group_by(rows.c.product_id, rows.c.warehouse_id)
+            .having(total != 0)
+        )
+
+    # -------- Snapshots --------
+    def take_snapshot(self, snapshot_date: date) -> int:
+        """(Re)write both levels' quantities at the end of snapshot_date: live stock minus later movements. Caller commits."""
+        self.db.execute(delete(StockSnapshot).where(StockSnapshot.snapshot_date == snapshot_date))
+        rows = 0
+        for level in STOCK_LEVELS:
+            current = self._combine(
+                self._live(level, None, None),
+                self._movements(snapshot_date, None, -1, level, None, None),
+            ).subquery()
+            result = self.db.execute(
+                insert(StockSnapshot).from_select(
+                    ["snapshot_date", "product_id", "warehouse_id", "quantity"],
+                    select(literal(snapshot_date, Date), current.c.product_id, current.c.warehouse_id, current.c.quantity),
+                )
+            )
+            rows += result.rowcount
+        return rows
+
+    def _nearest_base(self, as_of: date) -> Tuple[str, Optional[date]]:
+        """The cheapest starting point: closest snapshot on either side, or the live tables"""
+        before, after = self.db.execute(
+            select(
+                func.max(StockSnapshot.snapshot_date).filter(StockSnapshot.snapshot_date <= as_of),
+                func.min(StockSnapshot.snapshot_date).filter(StockSnapshot.snapshot_date > as_of),
+            )
+        ).one()
+        candidates = [(max((date.today() - as_of).days, 0), "live", None)]
+        if after:
+            candidates.append(((after - as_of).days, "snapshot", after))
+        if before:
+            candidates.append(((as_of - before).days, "snapshot", before))
+        _, base, base_date = min(candidates, key=lambda candidate: candidate[0])
+        return base, base_date
+
+    # -------- Point in time --------
+    def stock_as_of(
+        self,
+        as_of: date,
+        level: str = "warehouse",
+        product_id: Optional[UUID] = None,
+        warehouse_id: Optional[UUID] = None,
+        use_snapshots: bool = True,
+    ) -> dict:
+        if not use_snapshots:
+            # Full replay of the ledger; only correct when it covers all history
+            base, base_date = "ledger", None
+            stmt = self._combine(self._movements(None, as_of, 1, level, product_id, warehouse_id))
+        else:
+            base, base_date = self._nearest_base(as_of)
+            if base == "live":
+                parts = (self._live(level, product_id, warehouse_id),
+                         self._movements(as_of, None, -1, level, product_id, warehouse_id))
+            elif base_date <= as_of:
+                parts = (self._snapshot(base_date, level, product_id, warehouse_id),
+                         self._movements(base_date, as_of, 1, level, product_id, warehouse_id))
+            else:
+                parts = (self._snapshot(base_date, level, product_id, warehouse_id),
+                         self._movements(as_of, base_date, -1, level, product_id, warehouse_id))
+            stmt = self._combine(*parts)
+
+        rows = self.db.execute(stmt.order_by("product_id", "warehouse_id")).all()
+        return {
+            "as_of": as_of,
+            "level": level,
+            "base": base,
+            "base_date": base_date,
+            "items": [
+                {"product_id": row.product_id, "warehouse_id": row.warehouse_id, "quantity": row.quantity}
+                for row in rows
+            ],
+        }
+
+
+def benchmark(db: Session, movements: int = 500_000, samples: int = 12) -> Dict[str, object]:
+    """
+    Time snapshot + delta against a full ledger replay over a synthetic year.
+
+    Everything runs in one transaction that is rolled back, but it rewrites the
+    ledger and warehouse_stock while it runs: use a development database.
+    """
+    service = StockHistoryService(db)
+    try:
+        pairs = db.execute(select(WarehouseStock.product_id, WarehouseStock.warehouse_id)).all()
+        if not pairs:
+            raise ValueError("benchmark needs at least one warehouse_stock row")
+
+        started = perf_counter()
+        db.execute(delete(InventoryTransaction))
+        db.execute(delete(StockSnapshot))
+        db.execute(
+            text("""
+                INSERT INTO inventory_transactions
+                    (id, product_id, warehouse_id, transaction_type, quantity, reference_type, created_at)
+                SELECT gen_random_uuid(), p.product_id, p.warehouse_id,
+                       CASE WHEN random() < 0.55 THEN 'inbound' ELSE 'outbound' END,
+                       (1 + floor(random() * 20))::numeric,
+                       'benchmark',
+                       now() - random() * interval '365 days'
+                FROM generate_series(1, :movements) g
+                JOIN (SELECT row_number() OVER () - 1 AS n, product_id, warehouse_id FROM warehouse_stock) p
+                  ON p.n = g % :pairs
+            """),
+            {"movements": movements, "pairs": len(pairs)},
+        )
+        # Live stock must equal the replayed ledger for the comparison to hold
+        totals = service._combine(service._movements(None, None, 1, "warehouse", None, None)).subquery()
+        db.execute(update(WarehouseStock).values(quantity=0))
+        db.execute(
+            update(WarehouseStock)
+            .where(WarehouseStock.product_id == totals.c.product_id, WarehouseStock.warehouse_id == totals.c.warehouse_id)
+            .values(quantity=totals.c.quantity)
+        )
+        db.execute(text("ANALYZE inventory_transactions"))
+        setup_seconds = perf_counter() - started
+
+        today = date.today()
+        started = perf_counter()
+        for months_back in range(1, 13):
+            service.take_snapshot(today - timedelta(days=30 * months_back))
+        snapshot_seconds = perf_counter() - started
+
+        dates = [today - timedelta(days=1 + i * 365 // samples) for i in range(samples)]
+        timings = {"snapshot_delta": 0.0, "full_replay": 0.0}
+        mismatches: List[date] = []
+        for as_of in dates:
+            started = perf_counter()
+            fast = service.stock_as_of(as_of)["items"]
+            timings["snapshot_delta"] += perf_counter() - started
+            started = perf_counter()
+            slow = service.stock_as_of(as_of, use_snapshots=False)["items"]
+            timings["full_replay"] += perf_counter() - started
+            if fast != slow:
+                mismatches.append(as_of)
+
+        return {
+            "movements": movements,
+            "setup_seconds": round(setup_seconds, 3),
+            "snapshots_seconds": round(snapshot_seconds, 3),
+            "queries": samples,
+            "snapshot_delta_avg_ms": round(timings["snapshot_delta"] / samples * 1000, 2),
+            "full_replay_avg_ms": round(timings["full_replay"] / samples * 1000, 2),
+            "mismatches": mismatches,
+        }
+    finally:
+        db.rollback()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from app.core.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Benchmark point-in-time stock queries on a synthetic year")
+    parser.add_argument("--movements", type=int, default=500_000)
+    parser.add_argument("--samples", type=int, default=12)
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        print(json.dumps(benchmark(session, args.movements, args.samples), indent=2, default=str))
+    finally:
+        session.close()
@@ -0,0 +1,206 @@
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import select, func, case, insert, literal, null, update, text, String
+from sqlalchemy.orm import Session
+
+from app.models.inventory import InventoryTransaction, Product, Sale, SaleItem, WarehouseStock
+
+REPAIR_BATCH_SIZE = 1000
+
+# Statement-level triggers on warehouse_stock that keep Product.current_stock
+# at the product's expected stock (installed disabled by migration f813f111d9d0,
+# function body replaced by 636a21cc69f1)
+ROLLUP_TRIGGERS = (
+    "warehouse_stock_rollup_insert",
+    "warehouse_stock_rollup_update",
+    "warehouse_stock_rollup_delete",
+)
+
+
+class StockReconciliationService:
+    """
+    Product.current_stock against its expected stock.
+
+    Creating a sale takes the quantity off current_stock straight away, while
+    warehouse_stock only drops when the sale ships, so the expected stock is
+    the warehouse total less the quantities of sales not yet shipped. The
+    warehouse rows are treated as the source of truth: repairs move
+    current_stock to the expected stock and write a "reconciliation" ledger
+    row for the difference. Products with no warehouse_stock row at all have
+    never been put away and are left out unless include_unlocated is set.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _mismatches(self, include_unlocated: bool = False):
+        totals = (
+            select(WarehouseStock.product_id, func.sum(WarehouseStock.quantity).label("warehouse_total"))
+            .group_by(WarehouseStock.product_id)
+            .subquery()
+        )
+        pending = (
+            select(SaleItem.product_id, func.sum(SaleItem.quantity).label("pending_sales"))
+            .join(Sale, Sale.id == SaleItem.sale_id)
+            .where(Sale.shipped_at.is_(None))
+            .group_by(SaleItem.product_id)
+            .subquery()
+        )
+        current = func.coalesce(Product.current_stock, 0)
+        warehouse_total = func.coalesce(totals.c.warehouse_total, 0)
+        pending_sales = func.coalesce(pending.c.pending_sales, 0)
+        expected = warehouse_total - pending_sales
+        return (
+            select(
+                Product.id.label("product_id"),
+                Product.sku,
+                Product.name,
+                current.label("current_stock"),
+                warehouse_total.label("warehouse_total"),
+                pending_sales.label("pending_sales"),
+                expected.label("expected_stock"),
+                (expected - current).label("difference"),
+            )
+            .join(totals, totals.c.product_id == Product.id, isouter=include_unlocated)
+            .outerjoin(pending, pending.c.product_id == Product.id)
+            .where(current != expected)
+        )
+
+    # -------- Report --------
+    def mismatches(
+        self,
+        after: Optional[UUID] = None,
+        limit: int = 100,
+        include_unlocated: bool = False,
+    ) -> Tuple[List[dict], bool]:
+        """One page of drifted products ordered by id, plus whether more follow"""
+        stmt = self._mismatches(include_unlocated)
+        if after:
+            stmt = stmt.where(Product.id > after)
+        rows = self.db.execute(stmt.order_by(Product.id).limit(limit + 1)).all()
+        return [dict(row._mapping) for row in rows[:limit]], len(rows) > limit
+
+    def summary(self, include_unlocated: bool = False) -> dict:
+        drift = self._mismatches(include_unlocated).subquery()
+        row = self.db.execute(
+            select(
+                func.count().label("products"),
+                func.coalesce(func.sum(func.abs(drift.c.difference)), 0).label("absolute_difference"),
+                func.coalesce(func.sum(drift.c.difference), 0).label("net_difference"),
+            )
+        ).one()
+        return {**row._mapping, "rollup_enabled": self.rollup_enabled()}
+
+    # -------- Repair --------
+    def _repair_batch(
+        self,
+        after: Optional[UUID],
+        limit: Optional[int],
+        include_unlocated: bool,
+        notes: Optional[str],
+    ) -> List[UUID]:
+        """One UPDATE ... RETURNING feeding the ledger insert; the caller commits"""
+        page = self._mismatches(include_unlocated)
+        if after:
+            page = page.where(Product.id > after)
+        page = page.order_by(Product.id).limit(limit).with_for_update(of=Product).subquery()
+        fixed = (
+            update(Product)
+            .where(Product.id == page.c.product_id)
+            .values(current_stock=page.c.expected_stock)
+            .returning(Product.id, Product.current_stock, page.c.difference)
+            .cte("fixed")
+        )
+        return self.db.execute(
+            insert(InventoryTransaction)
+            .from_select(
+                ["id", "product_id", "warehouse_id", "transaction_type", "quantity", "balance_after",
+                 "reference_type", "notes", "created_at"],
+                select(
+                    func.gen_random_uuid(), fixed.c.id, null(),
+                    case((fixed.c.difference > 0, "inbound"), else_="outbound"),
+                    func.abs(fixed.c.difference), fixed.c.current_stock, literal("reconciliation"),
+                    literal(notes or "Reconciled to warehouse stock less unshipped sales", String), func.clock_timestamp(),
+                ),
+            )
+            .add_cte(fixed)
+            .returning(InventoryTransaction.product_id)
+        ).scalars().all()
+
+    def repair(
+        self,
+        batch_size: int = REPAIR_BATCH_SIZE,
+        include_unlocated: bool = False,
+        notes: Optional[str] = None,
+    ) -> Dict[str, int]:
+        """Set current_stock to the expected stock, batch_size products per transaction"""
+        repaired = batches = 0
+        last_id = None
+        while True:
+            ids = self._repair_batch(last_id, batch_size, include_unlocated, notes)
+            self.db.commit()
+            if not ids:
+                break
+            repaired += len(ids)
+            batches += 1
+            last_id = max(ids)
+            if len(ids) < batch_size:
+                break
+        return {"repaired": repaired, "batches": batches}
+
+    # -------- Trigger-maintained rollup --------
+    def rollup_enabled(self) -> bool:
+        state = self.db.execute(
+            text("SELECT tgenabled FROM pg_trigger WHERE tgrelid = 'warehouse_stock'::regclass AND tgname = :name"),
+            {"name": ROLLUP_TRIGGERS[0]},
+        ).scalar()
+        return state is not None and state != "D"
+
+    def set_rollup(self, enabled: bool) -> dict:
+        """
+        Keep Product.current_stock trigger-maintained at the warehouse total
+        less unshipped sales (or stop). Enabling first brings every located
+        product in line, in the same transaction as the switch.
+
+        While enabled, every warehouse_stock write moves current_stock of the
+        products it touched to their expected stock and writes a "rollup"
+        ledger row for any change, overriding product-level updates made since.
+        """
+        action = "ENABLE" if enabled else "DISABLE"
+        repaired = 0
+        if enabled:
+            # The table lock keeps warehouse writes out until the triggers are on
+            self.db.execute(text("LOCK TABLE warehouse_stock IN SHARE ROW EXCLUSIVE MODE"))
+            repaired = len(self._repair_batch(None, None, False, "Reconciled before enabling stock rollup"))
+        for name in ROLLUP_TRIGGERS:
+            self.db.execute(text(f"ALTER TABLE warehouse_stock {action} TRIGGER {name}"))
+        self.db.commit()
+        return {"rollup_enabled": enabled, "repaired": repaired}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from app.core.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Reconcile Product.current_stock with warehouse_stock and open sales")
+    parser.add_argument("--repair", action="store_true", help="fix drifted products (default: report only)")
+    parser.add_argument("--batch-size", type=int, default=REPAIR_BATCH_SIZE)
+    parser.add_argument("--include-unlocated", action="store_true", help="also zero products with no warehouse rows")
+    parser.add_argument("--rollup", choices=["on", "off"], help="enable or disable the trigger-maintained rollup")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        service = StockReconciliationService(session)
+        if args.rollup:
+            output = service.set_rollup(args.rollup == "on")
+        elif args.repair:
+            output = service.repair(args.batch_size, args.include_unlocated)
+        else:
+            output = service.summary(args.include_unlocated)
+        print(json.dumps(output, indent=2, default=str))
+    finally:
+        session.close()
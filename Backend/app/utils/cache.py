@@ -0,0 +1,48 @@
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core.config import settings
+
+# Short-lived cache for dashboard-style reads. Uses Redis when REDIS_URL is
+# configured (shared by all workers), otherwise a per-process dict.
+_local: Dict[str, Tuple[float, Any]] = {}
+_lock = threading.Lock()
+_redis = None
+
+
+def _redis_client():
+    global _redis
+    if _redis is None and settings.REDIS_URL:
+        import redis
+        _redis = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=0.5)
+    return _redis
+
+
+def cached(key: str, ttl: int, loader: Callable[[], Any]) -> Any:
+    """Return the value stored under key, calling loader at most once per ttl seconds"""
+    client = _redis_client()
+    if client is not None:
+        import redis
+        try:
+            hit = client.get(key)
+            if hit is not None:
+                return json.loads(hit)
+            value = jsonable_encoder(loader())
+            client.set(key, json.dumps(value), ex=ttl)
+            return value
+        except redis.RedisError:
+            pass  # fall through to the in-process cache
+
+    now = time.monotonic()
+    with _lock:
+        hit = _local.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    value = jsonable_encoder(loader())
+    with _lock:
+        _local[key] = (now + ttl, value)
+    return value
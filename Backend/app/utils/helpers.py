@@ -0,0 +1,29 @@
+import base64
+import json
+from typing import Any, Callable, Optional, Tuple
+
+from fastapi import HTTPException
+
+# Keyset-paginated endpoints keep returning plain JSON arrays and hand the
+# cursor for the following page back in this header.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values: Any) -> str:
+    """Pack the keyset of the last row on a page into an opaque cursor."""
+    raw = json.dumps([str(v) if v is not None else None for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], *types: Callable[[str], Any]) -> Optional[Tuple[Any, ...]]:
+    """Unpack a cursor produced by encode_cursor, converting each value with the given types."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if len(values) != len(types):
+            raise ValueError("cursor arity mismatch")
+        return tuple(None if v is None else t(v) for t, v in zip(types, values))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")